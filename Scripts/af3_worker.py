@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+af3_worker.py
+
+功能说明：
+    AlphaFold3 常驻推理 worker。每块 GPU 启动一个容器，通过 --input_dir
+    一次处理队列目录中的全部 JSON，模型权重只加载一次、JAX 只编译一次。
+
+    队列目录结构（每个 worker 一个收件箱）：
+        queue_dir/
+        ├── worker0/   *.json
+        └── worker1/   *.json
+
+    batch_size = 0 时任务在启动前平均分给各 GPU，每块 GPU 只启动一个容器；
+    batch_size > 0 时各 worker 每次从共享队列中取 batch_size 个任务，先做完的 GPU 会继续取。
+    提供各任务的 token 数时按长度排序（见 job_scheduler.py）：最长优先、同一 token 桶的任务相邻。
+    估算内存超过上限的大任务（见 memory_model.py）在普通任务完成后逐个运行，并开启 AF3 统一内存。
+
+    每批输出先写入 output_dir/.scratch/ 下的临时目录，输出完整的任务整体 rename 到 output_dir，
+    并在任务账本（job_ledger.py）中记为 done；不完整的任务记为 failed，下次运行重新执行。
+"""
+
+import os
+import json
+import uuid
+import shlex
+import shutil
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor
+
+import command_runner
+import job_ledger
+import resources
+from job_scheduler import assign_lpt, lpt_order, report_schedule
+from memory_model import AF3_UNIFIED_MEMORY_ENV, estimate_af3, split_large
+
+# 资源池申请量：AF3 数据流程（jackhmmer/nhmmer）的 CPU 线程数
+AF3_DATA_PIPELINE_CPUS = 8
+# 容器输出的临时目录放在 output_dir 下，保证与最终输出位于同一文件系统
+SCRATCH_DIR = ".scratch"
+
+
+def af3_cpus(extra_args=""):
+    """跳过数据流程（--norun_data_pipeline）时推理只占用 1 个 CPU"""
+    return 1 if "--norun_data_pipeline" in extra_args else AF3_DATA_PIPELINE_CPUS
+
+
+def parse_devices(devices):
+    """解析 --gpus 参数，返回 GPU 编号列表；None 表示使用全部 GPU"""
+    if not devices or devices.strip().lower() == "all":
+        return None
+    return [d.strip() for d in devices.split(",") if d.strip()]
+
+
+def gpu_option(device):
+    """生成 docker 的 --gpus 参数；多块 GPU（0,1）需要加引号，否则 docker 按逗号拆分"""
+    if device is None:
+        return ["--gpus", "all"]
+    return ["--gpus", f'"device={device}"']
+
+
+def af3_command(input_path, input_flag, output_dir, model_dir, db_dir, docker_image, device=None, extra_args="",
+                docker_env="", name=None, gpu=True):
+    """
+    AlphaFold3 的 docker run 参数列表（不经过 shell）。
+    input_flag: --json_path（单个输入文件）或 --input_dir（常驻 worker 的收件箱目录）
+    name:       容器名，超时或取消时据此删除容器
+    """
+    container_input = "/root/input.json" if input_flag == "--json_path" else "/root/af_input"
+    return (
+        ["docker", "run", "--rm"]
+        + (["--name", name] if name else [])
+        + (gpu_option(device) if gpu else [])
+        + shlex.split(docker_env)
+        + ["-v", f"{os.path.abspath(input_path)}:{container_input}",
+           "-v", f"{os.path.abspath(output_dir)}:/root/af_output",
+           "-v", f"{os.path.abspath(model_dir)}:/root/models",
+           "-v", f"{os.path.abspath(db_dir)}:/root/public_databases",
+           docker_image,
+           "python", "run_alphafold.py",
+           f"{input_flag}={container_input}",
+           "--model_dir=/root/models",
+           "--output_dir=/root/af_output"]
+        + shlex.split(extra_args)
+    )
+
+
+def model_file(output_dir, name):
+    """
+    AF3 以小写的任务名命名输出目录：output_dir/<name>/<name>_model.cif。
+    返回绝对路径：同时用作任务账本中的任务名，从不同工作目录运行时指向同一行
+    """
+    name = name.lower()
+    return os.path.join(os.path.abspath(output_dir), name, f"{name}_model.cif")
+
+
+def data_file(output_dir, name):
+    """--norun_inference 的输出：output_dir/<name>/<name>_data.json（绝对路径，同 model_file）"""
+    name = name.lower()
+    return os.path.join(os.path.abspath(output_dir), name, f"{name}_data.json")
+
+
+def output_complete(output_dir, name, msa=False):
+    """
+    输出是否完整：MSA 步骤的 _data.json 能被解析；
+    推理步骤的 _model.cif 和最后写出的 _summary_confidences.json 都存在
+    """
+    if msa:
+        try:
+            with open(data_file(output_dir, name), "r") as f:
+                json.load(f)
+        except (OSError, ValueError):
+            return False
+        return True
+    model = model_file(output_dir, name)
+    return os.path.isfile(model) and os.path.isfile(model.replace("_model.cif", "_summary_confidences.json"))
+
+
+def make_scratch_dir(output_dir, label):
+    scratch = os.path.join(output_dir, SCRATCH_DIR, f"{label}.{os.getpid()}.{uuid.uuid4().hex[:8]}")
+    while True:
+        try:
+            os.makedirs(scratch)
+            return scratch
+        except FileNotFoundError:
+            # 另一个 worker 的 remove_scratch_dir 恰好删除了空的 .scratch/，重新创建
+            continue
+
+
+def publish_output(scratch, output_dir, name):
+    """把临时目录中的 <name>/ 整体 rename 到 output_dir；同名的旧目录（不完整的结果）先移入临时目录再删除"""
+    name = name.lower()
+    target = os.path.join(output_dir, name)
+    if os.path.isdir(target):
+        os.replace(target, os.path.join(scratch, f".{name}.old"))
+    os.replace(os.path.join(scratch, name), target)
+
+
+def remove_scratch_dir(output_dir, scratch):
+    """删除本任务的临时目录；其他进程可能仍在使用 .scratch/，只在其为空时删除"""
+    shutil.rmtree(scratch, ignore_errors=True)
+    try:
+        os.rmdir(os.path.join(output_dir, SCRATCH_DIR))
+    except OSError:
+        pass
+
+
+def fill_inbox(inbox, json_paths):
+    """清空收件箱并放入本批 JSON（优先硬链接，跨文件系统时复制）"""
+    if os.path.isdir(inbox):
+        shutil.rmtree(inbox)
+    os.makedirs(inbox)
+    for path in json_paths:
+        target = os.path.join(inbox, os.path.basename(path))
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copy(path, target)
+
+
+def run_worker_batch(inbox, output_dir, model_dir, db_dir, docker_image, device=None, extra_args="", docker_env="",
+                     label="worker", timeout=None):
+    """启动一个容器处理收件箱中的全部 JSON，返回退出码"""
+    name = command_runner.container_name(f"af3-{label}")
+    cmd = af3_command(inbox, "--input_dir", output_dir, model_dir, db_dir, docker_image, device, extra_args,
+                      docker_env, name)
+    return command_runner.run(cmd, f"AlphaFold3 worker {label}", timeout=timeout,
+                              cleanup=command_runner.docker_cleanup(name)).returncode
+
+
+def split_jobs(jobs, n_workers):
+    """按顺序轮流把任务分给各 worker"""
+    return [jobs[i::n_workers] for i in range(n_workers)]
+
+
+def run_inference_workers(jobs, output_dir, model_dir, db_dir, docker_image, queue_dir,
+                          devices=None, batch_size=0, extra_args="", on_done=None, tokens=None,
+                          ledger_step="af3_model", job_inputs=None):
+    """
+    用常驻 worker 执行 AlphaFold3 任务。
+
+    jobs:        [(name, json_path), ...]，调用方应已剔除任务账本中已完成的任务
+    on_done:     每个任务所在批次结束后调用 on_done(name)，用于 CIF → PDB 转换等后处理
+    tokens:      {name: token 数}；提供时按长度调度并打印预计总耗时，否则按输入顺序轮流分配
+    ledger_step: 任务账本中的步骤名；job_inputs 为 {name: 输入哈希}
+    某个 worker 抛出异常时，其余 worker 仍会做完各自的任务，之后抛出 RuntimeError
+    """
+    if not jobs:
+        return
+
+    devices = devices or [None]
+    os.makedirs(queue_dir, exist_ok=True)
+
+    data_pipeline = "--norun_data_pipeline" not in extra_args
+
+    def memory(batch):
+        """一个容器依次处理整批输入，按批内最大的估算值申请"""
+        estimates = [estimate_af3((tokens or {}).get(name, 0), data_pipeline) for name, _ in batch]
+        return max(host for host, _ in estimates), max(gpu for _, gpu in estimates)
+
+    jobs, large_jobs = split_large(jobs, lambda job: memory([job]), "AlphaFold3")
+
+    def run_batch(inbox, batch, device, label, docker_env=""):
+        fill_inbox(inbox, [path for _, path in batch])
+        host_gb, gpu_gb = memory(batch)
+        scratch = make_scratch_dir(output_dir, os.path.basename(inbox))
+        finished = set()
+        for name, _ in batch:
+            job_ledger.start(ledger_step, model_file(output_dir, name), (job_inputs or {}).get(name, ""))
+        try:
+            with resources.reserve(cpu=af3_cpus(extra_args), gpus=1, mem_gb=host_gb, gpu_mem_gb=gpu_gb,
+                                   device=device, label=f"af3 worker {label}") as gpu:
+                print(f"[INFO] Worker {label}: running AlphaFold3 on {len(batch)} inputs...")
+                # 一个容器依次处理整批输入，超时为各输入超时之和
+                timeouts = [command_runner.af3_timeout((tokens or {}).get(name, 0), data_pipeline)
+                            for name, _ in batch]
+                returncode = run_worker_batch(inbox, scratch, model_dir, db_dir, docker_image, gpu, extra_args,
+                                              docker_env, label=os.path.basename(inbox),
+                                              timeout=None if None in timeouts else sum(timeouts))
+            if returncode != 0:
+                print(f"[ERROR] Worker {label}: AlphaFold3 exited with code {returncode}")
+            # 容器中途退出时，已完整写出的任务仍然保留
+            for name, _ in batch:
+                complete = output_complete(scratch, name)
+                if complete:
+                    publish_output(scratch, output_dir, name)
+                job_ledger.finish(ledger_step, model_file(output_dir, name), returncode, complete)
+                finished.add(name)
+        except BaseException:
+            for name, _ in batch:
+                if name not in finished:
+                    job_ledger.finish(ledger_step, model_file(output_dir, name), -1, False)
+            raise
+        finally:
+            remove_scratch_dir(output_dir, scratch)
+        if on_done:
+            for name, _ in batch:
+                try:
+                    on_done(name)
+                except Exception as e:
+                    print(f"[ERROR] Worker {label}: post-processing failed for {name}: {e}")
+
+    if tokens is not None:
+        report_schedule(jobs, tokens, len(devices))
+    if batch_size > 0:
+        shared = Queue()
+        for job in (lpt_order(jobs, tokens) if tokens is not None else jobs):
+            shared.put(job)
+        static_batches = None
+    elif tokens is not None:
+        static_batches, _ = assign_lpt(jobs, tokens, len(devices))
+    else:
+        static_batches = split_jobs(jobs, len(devices))
+
+    def next_batch(worker_index):
+        if static_batches is not None:
+            batch, static_batches[worker_index] = static_batches[worker_index], []
+            return batch
+        batch = []
+        while len(batch) < batch_size:
+            try:
+                batch.append(shared.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def worker(worker_index, device):
+        inbox = os.path.join(queue_dir, f"worker{worker_index}")
+        label = f"{worker_index} (GPU {device})" if device is not None else str(worker_index)
+        while True:
+            batch = next_batch(worker_index)
+            if not batch:
+                break
+            run_batch(inbox, batch, device, label)
+        shutil.rmtree(inbox, ignore_errors=True)
+
+    # worker 抛出的异常（资源申请失败、命令被取消、收件箱写入失败等）在所有 worker 结束后重新抛出，
+    # 该 worker 剩余的任务没有运行，步骤不能算作完成
+    errors = []
+    with ThreadPoolExecutor(max_workers=len(devices), thread_name_prefix="af3-worker") as executor:
+        futures = [executor.submit(worker, i, device) for i, device in enumerate(devices)]
+        for i, future in enumerate(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"[ERROR] AlphaFold3 worker {i} stopped: {e}")
+                errors.append(e)
+    if errors:
+        raise RuntimeError(f"{len(errors)} of {len(devices)} AlphaFold3 workers failed; "
+                           f"their remaining inputs were not run") from errors[0]
+
+    # 大任务队列：普通任务全部完成后在第一个 GPU 上逐个运行
+    if large_jobs:
+        print(f"[INFO] Running {len(large_jobs)} large AlphaFold3 inputs one at a time with unified memory...")
+        inbox = os.path.join(queue_dir, "large")
+        for job in large_jobs:
+            run_batch(inbox, [job], devices[0], "large", AF3_UNIFIED_MEMORY_ENV)
+        shutil.rmtree(inbox, ignore_errors=True)
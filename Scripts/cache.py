@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+cache.py
+
+功能说明：
+    跨项目共享的内容寻址结果缓存，可以放在 NFS 上供多个流水线同时使用。
+
+    目录结构：
+        cache_dir/
+        ├── <namespace>/<key[:2]>/<key>/   缓存条目（结果文件 + meta.json）
+        └── tmp/                            正在写入的临时目录
+
+    并发安全：
+        条目先完整写入 tmp/ 下的私有目录，最后 rename 到最终位置（同一文件系统内为原子操作）。
+        多个进程同时写入同一 key 时只保留先完成的一份，其余丢弃。
+        meta.json 最后写入，只有包含 meta.json 的条目才视为有效。
+
+    LRU 淘汰：
+        每次命中都会更新 meta.json 的 mtime（NFS 上 atime 不可靠）。
+        总大小超过上限时按 mtime 从旧到新删除条目：先 rename 到 tmp/ 再删除，
+        正在读取的进程不会看到半删除的条目。
+
+    命中率统计：
+        各进程在结束时把命中/未命中次数追加到 cache_dir/stats.tsv。
+
+使用示例：
+    python cache.py stats -c /shared/ppi_cache
+    python cache.py evict -c /shared/ppi_cache --max_gb 500
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import hashlib
+import argparse
+import threading
+from collections import defaultdict
+
+META_FILE = "meta.json"
+TMP_DIR = "tmp"
+STATS_FILE = "stats.tsv"
+# 写入进程崩溃后遗留的临时目录，超过该时间后在淘汰时清理
+STALE_TMP_SECONDS = 24 * 3600
+
+
+def make_key(*parts):
+    """由若干字段生成缓存 key（sha256）"""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+_hash_memo = {}
+_hash_lock = threading.Lock()
+
+
+def file_sha256(path):
+    """计算文件内容的 sha256（按路径、大小、mtime 在进程内记忆）"""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _hash_lock:
+        if memo_key in _hash_memo:
+            return _hash_memo[memo_key]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _hash_lock:
+        _hash_memo[memo_key] = digest
+    return digest
+
+
+_counts = defaultdict(lambda: [0, 0])
+_counts_lock = threading.Lock()
+
+
+def count(namespace, hit):
+    """记录一次命中或未命中（进程内计数，flush_stats 时写入文件）"""
+    with _counts_lock:
+        _counts[namespace][0 if hit else 1] += 1
+
+
+def flush_stats(cache_dir):
+    """把本进程的命中/未命中次数追加到 stats.tsv"""
+    with _counts_lock:
+        rows = [(ns, hits, misses) for ns, (hits, misses) in _counts.items() if hits or misses]
+        _counts.clear()
+    if not rows:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    lines = "".join(
+        f"{int(time.time())}\t{socket.gethostname()}\t{ns}\t{hits}\t{misses}\n"
+        for ns, hits, misses in rows
+    )
+    # 单次 O_APPEND 写入，多个进程同时追加不会交错
+    fd = os.open(os.path.join(cache_dir, STATS_FILE), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, lines.encode())
+    finally:
+        os.close(fd)
+
+
+def entry_dir(cache_dir, namespace, key):
+    return os.path.join(cache_dir, namespace, key[:2], key)
+
+
+def lookup(cache_dir, namespace, key):
+    """查找缓存条目，命中时更新 LRU 时间并返回条目目录，否则返回 None"""
+    path = entry_dir(cache_dir, namespace, key)
+    meta_path = os.path.join(path, META_FILE)
+    try:
+        os.utime(meta_path)
+    except OSError:
+        return None
+    return path
+
+
+def read_meta(path):
+    with open(os.path.join(path, META_FILE), "r") as f:
+        return json.load(f)
+
+
+def insert(cache_dir, namespace, key, files, meta=None):
+    """
+    写入缓存条目。
+
+    files: {条目内文件名: 源文件路径}，源文件不存在的项会被忽略
+    返回条目目录；若其他进程已写入同一 key，直接返回已有条目
+    """
+    final = entry_dir(cache_dir, namespace, key)
+    if os.path.exists(os.path.join(final, META_FILE)):
+        return final
+
+    tmp = os.path.join(cache_dir, TMP_DIR, f"{key}.{os.getpid()}.{uuid.uuid4().hex}")
+    os.makedirs(tmp)
+    try:
+        stored = {}
+        for name, src in files.items():
+            if src and os.path.exists(src):
+                shutil.copyfile(src, os.path.join(tmp, name))
+                stored[name] = os.path.getsize(src)
+        meta = dict(meta or {})
+        meta.update({"key": key, "files": stored, "created": time.time()})
+        with open(os.path.join(tmp, META_FILE), "w") as f:
+            json.dump(meta, f, indent=2)
+
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        try:
+            os.rename(tmp, final)
+        except OSError:
+            # 其他进程已先写入（或残留了不完整的同名目录），保留已有条目
+            if not os.path.exists(os.path.join(final, META_FILE)):
+                raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return final
+
+
+def link_or_copy(src, dst):
+    """优先硬链接（条目被淘汰后链接仍有效），跨文件系统时复制"""
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def materialize(path, targets, required=None):
+    """
+    把条目中的文件放到目标位置。targets: {条目内文件名: 目标路径}，条目中没有的文件跳过。
+    返回 required（默认为全部 targets）中的文件是否都已就位：条目可能在 lookup 之后被并发的
+    evict 删除，此时调用方应按未命中处理，重新运行
+    """
+    for name, dst in targets.items():
+        src = os.path.join(path, name)
+        if os.path.exists(src):
+            os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+            try:
+                link_or_copy(src, dst)
+            except FileNotFoundError:
+                # 检查之后条目被删除
+                pass
+    required = targets if required is None else required
+    return all(os.path.exists(targets[name]) for name in required)
+
+
+def _iter_entries(cache_dir):
+    for namespace in os.listdir(cache_dir):
+        ns_dir = os.path.join(cache_dir, namespace)
+        if namespace == TMP_DIR or not os.path.isdir(ns_dir):
+            continue
+        for prefix in os.listdir(ns_dir):
+            prefix_dir = os.path.join(ns_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                path = os.path.join(prefix_dir, key)
+                try:
+                    last_used = os.stat(os.path.join(path, META_FILE)).st_mtime
+                    size = sum(
+                        os.path.getsize(os.path.join(path, name))
+                        for name in os.listdir(path)
+                    )
+                except OSError:
+                    # 条目正被其他进程淘汰
+                    continue
+                yield path, last_used, size
+
+
+def remove_entry(cache_dir, path):
+    """先 rename 到 tmp/ 再删除；其他进程已删除时静默跳过"""
+    trash = os.path.join(cache_dir, TMP_DIR, f"evict.{uuid.uuid4().hex}")
+    os.makedirs(os.path.dirname(trash), exist_ok=True)
+    try:
+        os.rename(path, trash)
+    except OSError:
+        return False
+    shutil.rmtree(trash, ignore_errors=True)
+    return True
+
+
+def evict(cache_dir, max_bytes):
+    """按 LRU 淘汰条目，直到总大小不超过 max_bytes；返回删除的条目数"""
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    tmp_root = os.path.join(cache_dir, TMP_DIR)
+    if os.path.isdir(tmp_root):
+        now = time.time()
+        for name in os.listdir(tmp_root):
+            path = os.path.join(tmp_root, name)
+            try:
+                if now - os.stat(path).st_mtime > STALE_TMP_SECONDS:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+    entries = sorted(_iter_entries(cache_dir), key=lambda e: e[1])
+    total = sum(size for _, _, size in entries)
+    removed = 0
+    for path, _, size in entries:
+        if total <= max_bytes:
+            break
+        if remove_entry(cache_dir, path):
+            removed += 1
+        total -= size
+    if removed:
+        print(f"[INFO] Cache eviction removed {removed} entries from {cache_dir}")
+    return removed
+
+
+def cache_stats(cache_dir):
+    """汇总各 namespace 的条目数、大小和累计命中率"""
+    summary = defaultdict(lambda: {"entries": 0, "bytes": 0, "hits": 0, "misses": 0})
+    for path, _, size in _iter_entries(cache_dir):
+        namespace = os.path.relpath(path, cache_dir).split(os.sep)[0]
+        summary[namespace]["entries"] += 1
+        summary[namespace]["bytes"] += size
+
+    stats_path = os.path.join(cache_dir, STATS_FILE)
+    if os.path.exists(stats_path):
+        with open(stats_path, "r") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) != 5:
+                    continue
+                summary[parts[2]]["hits"] += int(parts[3])
+                summary[parts[2]]["misses"] += int(parts[4])
+    return dict(summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or trim the shared PPI-Prediction result cache")
+    parser.add_argument("command", choices=["stats", "evict"], help="stats: entries, size and hit rate; evict: LRU trim")
+    parser.add_argument("-c", "--cache_dir", required=True, help="Cache directory")
+    parser.add_argument("--max_gb", type=float, default=None, help="Target cache size for evict")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.cache_dir):
+        print(f"[ERROR] Cache directory not found: {args.cache_dir}")
+        sys.exit(1)
+
+    if args.command == "evict":
+        if args.max_gb is None:
+            print("[ERROR] --max_gb is required for evict.")
+            sys.exit(1)
+        evict(args.cache_dir, int(args.max_gb * 1024 ** 3))
+
+    summary = cache_stats(args.cache_dir)
+    print("Namespace\tEntries\tSize_MB\tHits\tMisses\tHit_rate")
+    for namespace in sorted(summary):
+        row = summary[namespace]
+        lookups = row["hits"] + row["misses"]
+        rate = f"{row['hits'] / lookups:.1%}" if lookups else "-"
+        print(f"{namespace}\t{row['entries']}\t{row['bytes'] / 1024 ** 2:.1f}\t{row['hits']}\t{row['misses']}\t{rate}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+cif2pdb.py
+
+功能说明：
+    不依赖 PyMOL 的 mmCIF → PDB 转换。读取 _atom_site 表，按 PDB 固定列格式写出
+    ATOM/HETATM 记录，保留链 ID（auth_asym_id）和 B-factor 列（AlphaFold3 中为 pLDDT）。
+    只输出第一个 model。原生解析失败且系统中装有 PyMOL 时，自动退回到 PyMOL 转换。
+
+使用示例：
+    # 转换单个文件
+    python cif2pdb.py --cif af_output/at1g01010/at1g01010_model.cif --pdb at1g01010.pdb
+    # 一次转换整个 af_output 目录（<name>/<name>_model.cif → pdbs/<name>.pdb）
+    python cif2pdb.py -i af_output -o af_output/pdbs -n 8
+"""
+
+import os
+import re
+import sys
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import command_runner
+
+# mmCIF 中引号只有在后面紧跟空白或行尾时才算闭合
+TOKEN_RE = re.compile(r"""'(?:[^']|'(?=\S))*'|"(?:[^"]|"(?=\S))*"|\S+""")
+
+
+def _tokens(line):
+    for token in TOKEN_RE.findall(line):
+        if len(token) >= 2 and token[0] == token[-1] and token[0] in "'\"":
+            token = token[1:-1]
+        yield token
+
+
+def read_atom_site(cif_file):
+    """返回 (列名列表, 行列表)；只读取 _atom_site 循环"""
+    columns = []
+    rows = []
+    in_loop = False
+    reading_rows = False
+    pending = []
+    with open(cif_file, "r") as f:
+        for line in f:
+            stripped = line.strip()
+            if reading_rows:
+                if not stripped or stripped.startswith("#") or stripped.startswith("loop_") \
+                        or stripped.startswith("_") or stripped.startswith("data_"):
+                    break
+                pending.extend(_tokens(stripped))
+                while len(pending) >= len(columns):
+                    rows.append(pending[:len(columns)])
+                    pending = pending[len(columns):]
+                continue
+            if stripped.startswith("loop_"):
+                in_loop = True
+                columns = []
+                continue
+            if in_loop and stripped.startswith("_atom_site."):
+                columns.append(stripped.split(".", 1)[1].split()[0])
+                continue
+            if in_loop and columns:
+                reading_rows = True
+                pending.extend(_tokens(stripped))
+                while len(pending) >= len(columns):
+                    rows.append(pending[:len(columns)])
+                    pending = pending[len(columns):]
+                continue
+            if in_loop and stripped.startswith("_"):
+                in_loop = False
+    if not columns:
+        raise ValueError(f"No _atom_site loop in {cif_file}")
+    return columns, rows
+
+
+def _value(row, index, default=""):
+    if index is None:
+        return default
+    value = row[index]
+    return default if value in (".", "?") else value
+
+
+def _atom_name(name, element):
+    """PDB 原子名对齐：单字母元素且名字不足 4 位时从第 14 列开始"""
+    if len(name) < 4 and len(element) == 1:
+        return f" {name:<3}"
+    return f"{name:<4}"
+
+
+def format_pdb(columns, rows):
+    """把 _atom_site 行转换为 PDB 文本"""
+    col = {name: i for i, name in enumerate(columns)}
+    get = col.get
+    i_group = get("group_PDB")
+    i_element = get("type_symbol")
+    i_name = get("auth_atom_id", get("label_atom_id"))
+    i_alt = get("label_alt_id")
+    i_res = get("auth_comp_id", get("label_comp_id"))
+    i_chain = get("auth_asym_id", get("label_asym_id"))
+    i_seq = get("auth_seq_id", get("label_seq_id"))
+    i_icode = get("pdbx_PDB_ins_code")
+    i_x, i_y, i_z = get("Cartn_x"), get("Cartn_y"), get("Cartn_z")
+    i_occ = get("occupancy")
+    i_b = get("B_iso_or_equiv")
+    i_model = get("pdbx_PDB_model_num")
+
+    lines = []
+    first_model = None
+    prev = None
+    serial = 0
+    for row in rows:
+        if i_model is not None:
+            model = row[i_model]
+            if first_model is None:
+                first_model = model
+            elif model != first_model:
+                break
+
+        record = _value(row, i_group, "ATOM")
+        element = _value(row, i_element, "")
+        name = _value(row, i_name, "")
+        res_name = _value(row, i_res, "UNK")
+        chain = _value(row, i_chain, "A")[:1]
+        res_seq = _value(row, i_seq, "0")
+        icode = _value(row, i_icode, " ")[:1]
+
+        if prev is not None and prev[1] != chain:
+            serial += 1
+            lines.append(f"TER   {serial % 100000:>5}      {prev[0]:>3} {prev[1]:1}{prev[2]:>4}{prev[3]:1}")
+        serial += 1
+
+        lines.append(
+            f"{record:<6}{serial % 100000:>5} {_atom_name(name, element)}{_value(row, i_alt, ' ')[:1]:1}"
+            f"{res_name:>3} {chain:1}{res_seq:>4}{icode:1}   "
+            f"{float(row[i_x]):8.3f}{float(row[i_y]):8.3f}{float(row[i_z]):8.3f}"
+            f"{float(_value(row, i_occ, '1.0')):6.2f}{float(_value(row, i_b, '0.0')):6.2f}"
+            f"          {element.upper():>2}  "
+        )
+        prev = (res_name, chain, res_seq, icode)
+
+    if prev is not None:
+        serial += 1
+        lines.append(f"TER   {serial % 100000:>5}      {prev[0]:>3} {prev[1]:1}{prev[2]:>4}{prev[3]:1}")
+    lines.append("END")
+    return "\n".join(lines) + "\n"
+
+
+def convert_with_pymol(cif_file, pdb_file):
+    """PyMOL 转换；同样先写临时文件（PyMOL 按扩展名决定格式，保留 .pdb 后缀）再 rename"""
+    tmp_file = f"{pdb_file}.{os.getpid()}.tmp.pdb"
+    try:
+        command_runner.run(["pymol", "-c", "-q", "-d", f"load {cif_file}; save {tmp_file}; quit;"],
+                           f"pymol {os.path.basename(cif_file)}", timeout=command_runner.timeout_for("pymol"),
+                           check=True)
+        os.replace(tmp_file, pdb_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def convert_cif_to_pdb(cif_file, pdb_file):
+    """mmCIF → PDB；先写临时文件再 rename，原生转换失败且有 PyMOL 时退回 PyMOL"""
+    tmp_file = f"{pdb_file}.{os.getpid()}.tmp"
+    try:
+        columns, rows = read_atom_site(cif_file)
+        with open(tmp_file, "w") as f:
+            f.write(format_pdb(columns, rows))
+        os.replace(tmp_file, pdb_file)
+    except Exception as e:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        if shutil.which("pymol") is None:
+            raise
+        print(f"[WARNING] Native conversion failed for {cif_file} ({e}); falling back to PyMOL.")
+        convert_with_pymol(cif_file, pdb_file)
+
+
+def _convert_one(task):
+    cif_file, pdb_file = task
+    try:
+        convert_cif_to_pdb(cif_file, pdb_file)
+        return pdb_file, None
+    except Exception as e:
+        return pdb_file, str(e)
+
+
+def find_model_cifs(af_output_dir):
+    """查找 af_output/<name>/<name>_model.cif，返回 [(name, cif_path), ...]"""
+    found = []
+    for name in sorted(os.listdir(af_output_dir)):
+        cif_file = os.path.join(af_output_dir, name, f"{name}_model.cif")
+        if os.path.isfile(cif_file):
+            found.append((name, cif_file))
+    return found
+
+
+def convert_tree(af_output_dir, pdbs_dir, num_workers=1, overwrite=False):
+    """批量转换整个 AlphaFold3 输出目录，返回成功转换的数量"""
+    os.makedirs(pdbs_dir, exist_ok=True)
+    tasks = []
+    for name, cif_file in find_model_cifs(af_output_dir):
+        pdb_file = os.path.join(pdbs_dir, f"{name}.pdb")
+        if overwrite or not os.path.exists(pdb_file):
+            tasks.append((cif_file, pdb_file))
+
+    if num_workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(_convert_one, tasks, chunksize=16))
+    else:
+        results = [_convert_one(task) for task in tasks]
+
+    converted = 0
+    for pdb_file, error in results:
+        if error:
+            print(f"[ERROR] Failed to write {pdb_file}: {error}")
+        else:
+            converted += 1
+    return converted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert AlphaFold3 mmCIF models to PDB without PyMOL")
+    parser.add_argument("-i", "--input_dir", help="AlphaFold3 output directory (<name>/<name>_model.cif)")
+    parser.add_argument("-o", "--pdbs_dir", help="Directory for converted PDB files (default: INPUT_DIR/pdbs)")
+    parser.add_argument("-n", "--num_workers", type=int, default=1, help="Number of conversion processes")
+    parser.add_argument("--overwrite", action="store_true", help="Re-convert PDB files that already exist")
+    parser.add_argument("--cif", help="Convert a single mmCIF file")
+    parser.add_argument("--pdb", help="Output PDB for --cif")
+    args = parser.parse_args()
+
+    if args.cif:
+        if not args.pdb:
+            print("[ERROR] --pdb is required with --cif.")
+            sys.exit(1)
+        convert_cif_to_pdb(args.cif, args.pdb)
+        print(f"[DONE] Converted {args.cif} → {args.pdb}")
+        return
+
+    if not args.input_dir or not os.path.isdir(args.input_dir):
+        print("[ERROR] --input_dir must be an existing directory (or use --cif/--pdb).")
+        sys.exit(1)
+
+    pdbs_dir = args.pdbs_dir or os.path.join(args.input_dir, "pdbs")
+    converted = convert_tree(args.input_dir, pdbs_dir, args.num_workers, args.overwrite)
+    print(f"[DONE] Converted {converted} models into {pdbs_dir}")
+
+
+if __name__ == "__main__":
+    main()
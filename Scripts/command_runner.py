@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+command_runner.py
+
+功能说明：
+    各步骤共用的外部命令执行器。docker、hdock、createpl、pymol 都经由 run() 启动：
+        1. 不经过 shell：命令以参数列表传入，ID 或路径中的特殊字符不会被 shell 解释；
+        2. 墙钟超时：按任务规模（残基数 / token 数）估算（timeout_for），乘以 --timeout_scale；
+           超时后终止整个进程组，docker 容器另外用 docker rm -f 删除
+           （只结束 docker 客户端并不会停止容器）；
+        3. 重试：超时和瞬时失败（docker daemon 不可用、容器启动失败，退出码 125 等）
+           按指数退避重试 --retries 次（默认不重试）；程序本身的错误不重试；
+        4. 取消：收到 Ctrl-C / SIGTERM 时终止所有正在运行的命令及其容器，之后提交的命令直接失败。
+           信号处理函数由各脚本的 main() 调用 install_signal_handlers() 设置，
+           作为库导入（如 ppi_prediction.stages）时不会替换调用方的信号处理。
+
+    asyncio 事件循环在后台线程中运行，线程池 worker 调用 run() 提交命令并阻塞等待结果；
+    同时运行的命令数仍由调用方的线程池和资源池（resources.py）控制。
+    超时倍数和重试次数通过环境变量传给子进程（其他脚本），与 resources.py 的做法相同。
+"""
+
+import os
+import re
+import sys
+import uuid
+import random
+import signal
+import asyncio
+import threading
+import subprocess
+import concurrent.futures
+
+from job_scheduler import estimate_seconds
+
+TIMEOUT_SCALE_ENV_VAR = "PPI_TIMEOUT_SCALE"
+RETRIES_ENV_VAR = "PPI_RETRIES"
+# 默认超时倍数 1：按 TIMEOUTS 估算的墙钟上限生效；默认不重试
+DEFAULT_TIMEOUT_SCALE = 1
+DEFAULT_RETRIES = 0
+# 第 n 次重试前等待 BACKOFF_SECONDS × 2^n 秒（另加最多一半的随机抖动）
+BACKOFF_SECONDS = 30
+# 超时或取消时先发 SIGTERM，等待该时间后 SIGKILL
+KILL_GRACE_SECONDS = 10
+CLEANUP_TIMEOUT_SECONDS = 60
+# 与 coreutils timeout 相同，超时的命令以 124 作为退出码
+TIMEOUT_EXIT_CODE = 124
+STDERR_TAIL_BYTES = 8192
+
+# docker run 自身出错（daemon 不可用、容器创建失败）时退出码为 125
+TRANSIENT_EXIT_CODES = {125}
+TRANSIENT_MESSAGES = (
+    "Cannot connect to the Docker daemon",
+    "error during connect",
+    "Error response from daemon",
+    "TLS handshake timeout",
+    "i/o timeout",
+    "connection reset by peer",
+)
+
+# 墙钟超时（秒）= 固定部分 + 每单位规模的秒数 × 规模（残基数或 token 数）
+TIMEOUTS = {
+    "af3_msa": (4 * 3600, 4),
+    "af3_inference": (1800, 0),
+    "megadock": (1800, 2),
+    "ppiscore": (300, 0),
+    "hdock": (3600, 4),
+    "createpl": (600, 0),
+    "pymol": (600, 0),
+    "docker": (300, 0),
+}
+# AF3 推理另加 A100 参考耗时（job_scheduler.estimate_seconds）的若干倍，覆盖较慢的 GPU 和统一内存
+AF3_RUNTIME_FACTOR = 20
+
+_settings = {}
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+_running = set()
+_cancelled = threading.Event()
+_handlers_installed = False
+
+
+def configure(timeout_scale=None, retries=None):
+    """设置超时倍数（0 表示不限时）和重试次数；同时写入环境变量，子进程使用相同的设置"""
+    if timeout_scale is not None:
+        os.environ[TIMEOUT_SCALE_ENV_VAR] = str(timeout_scale)
+    if retries is not None:
+        os.environ[RETRIES_ENV_VAR] = str(retries)
+    _settings["timeout_scale"] = float(os.environ.get(TIMEOUT_SCALE_ENV_VAR, DEFAULT_TIMEOUT_SCALE))
+    _settings["retries"] = int(os.environ.get(RETRIES_ENV_VAR, DEFAULT_RETRIES))
+
+
+def get_timeout_scale():
+    return _settings.get("timeout_scale", float(os.environ.get(TIMEOUT_SCALE_ENV_VAR, DEFAULT_TIMEOUT_SCALE)))
+
+
+def get_retries():
+    return _settings.get("retries", int(os.environ.get(RETRIES_ENV_VAR, DEFAULT_RETRIES)))
+
+
+def timeout_for(kind, size=0):
+    """某类任务的墙钟超时（秒）；--timeout_scale 0 时返回 None（不限时）"""
+    scale = get_timeout_scale()
+    if not scale:
+        return None
+    base, per_unit = TIMEOUTS[kind]
+    seconds = base + per_unit * size
+    if kind == "af3_inference":
+        seconds += AF3_RUNTIME_FACTOR * estimate_seconds(size)
+    return seconds * scale
+
+
+def af3_timeout(tokens, data_pipeline=True, inference=True):
+    """AF3 任务的超时：数据流程和推理两部分之和"""
+    parts = [timeout_for("af3_msa", tokens) if data_pipeline else 0,
+             timeout_for("af3_inference", tokens) if inference else 0]
+    return None if None in parts else sum(parts)
+
+
+def container_name(label):
+    """docker run --name 使用的唯一容器名，超时或取消时据此删除容器"""
+    return f"ppi-{re.sub(r'[^A-Za-z0-9_.-]', '_', label)}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def docker_cleanup(name):
+    """删除（必要时先停止）容器的命令；--rm 的容器被 kill 后也会被删除，重复执行无害"""
+    return [["docker", "rm", "-f", name]]
+
+
+def install_signal_handlers():
+    """
+    Ctrl-C / SIGTERM 时先终止所有命令；只能在主线程中设置。
+    替换的是整个进程的信号处理，只由脚本的 main() 调用
+    """
+    global _handlers_installed
+    if _handlers_installed or threading.current_thread() is not threading.main_thread():
+        return
+    signal.signal(signal.SIGINT, _handle_signal)
+    signal.signal(signal.SIGTERM, _handle_signal)
+    _handlers_installed = True
+
+
+def _handle_signal(signum, frame):
+    cancel_all()
+    if signum == signal.SIGINT:
+        raise KeyboardInterrupt
+    raise SystemExit(128 + signum)
+
+
+def _ensure_loop():
+    """启动后台事件循环；fork 出的子进程（进程池 worker）没有父进程的循环线程，另建一个"""
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _running.clear()
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            threading.Thread(target=_loop.run_forever, name="command-runner", daemon=True).start()
+    return _loop
+
+
+async def _run_cleanup(cleanup):
+    for argv in cleanup:
+        try:
+            proc = await asyncio.create_subprocess_exec(*argv, stdout=subprocess.DEVNULL,
+                                                        stderr=subprocess.DEVNULL)
+            await asyncio.wait_for(proc.wait(), CLEANUP_TIMEOUT_SECONDS)
+        except (OSError, asyncio.TimeoutError):
+            pass
+
+
+async def _terminate(proc, cleanup):
+    """先删除容器，再终止进程组：SIGTERM，宽限期后 SIGKILL"""
+    await _run_cleanup(cleanup)
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            return
+        try:
+            await asyncio.wait_for(proc.wait(), KILL_GRACE_SECONDS)
+            return
+        except asyncio.TimeoutError:
+            continue
+
+
+async def _run_once(argv, timeout, cwd, capture, cleanup):
+    """运行一次，返回 (退出码, stdout, stderr 末尾, 是否超时)；stderr 同时转发到本进程的 stderr"""
+    # 新的会话：超时或取消时可以终止整个进程组
+    proc = await asyncio.create_subprocess_exec(
+        *argv, cwd=cwd, stdout=subprocess.PIPE if capture else None, stderr=subprocess.PIPE,
+        start_new_session=True
+    )
+    tail = bytearray()
+
+    async def pump_stderr():
+        while True:
+            data = await proc.stderr.read(65536)
+            if not data:
+                return
+            sys.stderr.buffer.write(data)
+            sys.stderr.buffer.flush()
+            tail.extend(data)
+            del tail[:-STDERR_TAIL_BYTES]
+
+    async def read_stdout():
+        return await proc.stdout.read() if capture else None
+
+    async def communicate():
+        _, stdout = await asyncio.gather(pump_stderr(), read_stdout())
+        await proc.wait()
+        return stdout
+
+    try:
+        stdout = await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        await _terminate(proc, cleanup)
+        return TIMEOUT_EXIT_CODE, b"", tail.decode(errors="replace"), True
+    except asyncio.CancelledError:
+        await _terminate(proc, cleanup)
+        raise
+    return proc.returncode, stdout, tail.decode(errors="replace"), False
+
+
+def is_transient(returncode, stderr_tail, timed_out):
+    if timed_out or returncode in TRANSIENT_EXIT_CODES:
+        return True
+    return returncode != 0 and any(message in stderr_tail for message in TRANSIENT_MESSAGES)
+
+
+async def _run(argv, label, timeout, retries, cwd, capture, cleanup):
+    attempt = 0
+    while True:
+        try:
+            returncode, stdout, stderr_tail, timed_out = await _run_once(argv, timeout, cwd, capture, cleanup)
+        except OSError as e:
+            # 可执行文件不存在等启动错误，与 shell 的 127 对应
+            print(f"[ERROR] {label}: failed to start {argv[0]}: {e}")
+            return subprocess.CompletedProcess(argv, 127, b"" if capture else None, str(e))
+        if timed_out:
+            print(f"[TIMEOUT] {label}: still running after {timeout:.0f}s, killed")
+        if returncode == 0 or attempt >= retries or not is_transient(returncode, stderr_tail, timed_out):
+            return subprocess.CompletedProcess(argv, returncode, stdout, stderr_tail)
+        delay = BACKOFF_SECONDS * 2 ** attempt
+        delay += random.uniform(0, delay / 2)
+        attempt += 1
+        print(f"[RETRY] {label}: exit code {returncode}, retrying in {delay:.0f}s ({attempt}/{retries})")
+        # 失败的尝试可能留下同名容器
+        await _run_cleanup(cleanup)
+        await asyncio.sleep(delay)
+
+
+def run(argv, label, timeout=None, retries=None, cwd=None, capture=False, check=False, cleanup=()):
+    """
+    运行外部命令并等待结束，返回 subprocess.CompletedProcess（capture=True 时 stdout 为 bytes）。
+
+    timeout: 每次尝试的墙钟超时（秒），None 表示不限时
+    retries: 超时和瞬时失败的重试次数，None 时使用 --retries 的设置
+    cleanup: 超时、取消或重试前执行的清理命令（如 docker_cleanup(name)）
+    check:   退出码非 0 时抛出 subprocess.CalledProcessError
+    已取消（收到 Ctrl-C / SIGTERM）时抛出 RuntimeError
+    """
+    if _cancelled.is_set():
+        raise RuntimeError(f"{label}: cancelled")
+    argv = [str(arg) for arg in argv]
+    loop = _ensure_loop()
+    future = asyncio.run_coroutine_threadsafe(
+        _run(argv, label, timeout, get_retries() if retries is None else retries, cwd, capture, list(cleanup)),
+        loop
+    )
+    _running.add(future)
+    try:
+        result = future.result()
+    except concurrent.futures.CancelledError:
+        raise RuntimeError(f"{label}: cancelled")
+    finally:
+        _running.discard(future)
+    if check and result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, argv, result.stdout, result.stderr)
+    return result
+
+
+def cancel_all(wait_seconds=CLEANUP_TIMEOUT_SECONDS + 2 * KILL_GRACE_SECONDS):
+    """取消所有正在运行的命令，等待其容器和进程组被清理；之后提交的命令直接失败"""
+    _cancelled.set()
+    futures = list(_running)
+    if not futures:
+        return
+    print(f"[INFO] Cancelling {len(futures)} running commands...")
+    for future in futures:
+        future.cancel()
+    # 取消在事件循环中完成清理后才真正结束
+    loop = _loop
+    if loop is not None:
+        async def drain():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            if tasks:
+                await asyncio.wait(tasks, timeout=wait_seconds)
+        try:
+            asyncio.run_coroutine_threadsafe(drain(), loop).result(wait_seconds + 1)
+        except (concurrent.futures.TimeoutError, RuntimeError):
+            pass
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+dedup.py
+
+功能说明：
+    按序列 / 结构内容去重。蛋白组中经常有序列完全相同的不同 ID（可变剪接模型重复、旁系同源拷贝等），
+    而结构预测和对接结果只取决于输入内容，因此每个唯一输入只计算一次：
+        单蛋白 AF3    每条唯一序列只折叠一次，代表 ID 为 FASTA 中第一次出现的 ID；
+                      其余 ID 的输出目录文件和 PDB 以硬链接（跨文件系统时复制）生成
+        复合物 AF3    两条链序列相同（不计顺序）的 pair 只预测一次，输出同样以链接生成
+        MEGADOCK / HDOCK
+                      两个 PDB 内容（结构索引中的 sha256）相同的 pair 只对接一次，得分复制给其余 pair
+
+    单蛋白步骤把别名表（ID → 代表 ID）写入输出目录下的 dedup.tsv；
+    Inference 步骤没有 FASTA，从 json_dir（即 Msa 步骤的输出目录）读取该文件。
+"""
+
+import os
+
+import cache
+from job_scheduler import format_seconds
+
+DEDUP_FILE = "dedup.tsv"
+
+
+def dedup(items, key_fn, name_fn=lambda item: item):
+    """
+    按 key_fn 去重，保持原有顺序。
+    返回 (唯一任务列表, {别名: 代表}, {代表: [别名, ...]})，名字由 name_fn 给出
+    """
+    unique = []
+    representative = {}
+    aliases = {}
+    aliases_of = {}
+    for item in items:
+        key = key_fn(item)
+        if key in representative:
+            rep = representative[key]
+            aliases[name_fn(item)] = rep
+            aliases_of.setdefault(rep, []).append(name_fn(item))
+        else:
+            representative[key] = name_fn(item)
+            unique.append(item)
+    return unique, aliases, aliases_of
+
+
+def write_aliases(path, aliases):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write("ID\tRepresentative\n")
+        for alias in sorted(aliases):
+            f.write(f"{alias}\t{aliases[alias]}\n")
+    os.replace(tmp, path)
+
+
+def read_aliases(path):
+    """读取 dedup.tsv；文件不存在时返回空表"""
+    aliases = {}
+    if not os.path.exists(path):
+        return aliases
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) == 2 and parts[0] != "ID":
+                aliases[parts[0]] = parts[1]
+    return aliases
+
+
+def invert(aliases):
+    aliases_of = {}
+    for alias in sorted(aliases):
+        aliases_of.setdefault(aliases[alias], []).append(alias)
+    return aliases_of
+
+
+def link_file(src, dst):
+    """src 存在且 dst 尚不存在时建立链接；返回是否新建"""
+    if not os.path.exists(src) or os.path.exists(dst):
+        return False
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+    cache.link_or_copy(src, dst)
+    return True
+
+
+def link_output_dir(output_dir, rep_name, alias_name):
+    """
+    把 AF3 输出目录 output_dir/<rep>/ 中的文件链接到 output_dir/<alias>/，
+    文件名前缀 <rep>_ 替换为 <alias>_（子目录中的各 seed 样本不复制）
+    """
+    rep_dir = os.path.join(output_dir, rep_name)
+    if not os.path.isdir(rep_dir):
+        return
+    alias_dir = os.path.join(output_dir, alias_name)
+    for name in os.listdir(rep_dir):
+        src = os.path.join(rep_dir, name)
+        if not os.path.isfile(src):
+            continue
+        if name.startswith(f"{rep_name}_"):
+            name = f"{alias_name}_{name[len(rep_name) + 1:]}"
+        link_file(src, os.path.join(alias_dir, name))
+
+
+def report(label, n_total, n_unique, seconds_total=None, seconds_saved=None):
+    """打印去重节省的任务数（以及按 job_scheduler 估算的 GPU 时间）"""
+    if n_total == n_unique:
+        print(f"[INFO] Dedup ({label}): {n_total} inputs, no duplicates")
+        return
+    text = f"[INFO] Dedup ({label}): {n_total} inputs → {n_unique} unique, {n_total - n_unique} jobs skipped"
+    if seconds_total:
+        text += (f" (~{format_seconds(seconds_saved)} of {format_seconds(seconds_total)} predicted GPU time, "
+                 f"{100 * seconds_saved / seconds_total:.0f}%)")
+    print(text)
+
+
+def dedup_pairs(pairs, structures, label):
+    """
+    对接 pair 按两个 PDB 的内容（结构索引中的 sha256，不计顺序）去重。
+    返回 (唯一 pair 列表, {别名 pair: 代表 pair})；索引中缺失的 pair 原样保留
+    """
+    def key(pair):
+        entries = [structures.get(pid) for pid in pair]
+        if None in entries:
+            return pair
+        return tuple(sorted(entry["sha256"] for entry in entries))
+
+    unique, aliases, _ = dedup(pairs, key, name_fn=tuple)
+    report(label, len(pairs), len(unique))
+    return unique, aliases
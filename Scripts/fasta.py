@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+fasta.py
+
+功能说明：
+    各步骤共用的 FASTA 读取。第一次打开某个 FASTA 时在其旁边生成 samtools faidx 格式的索引
+    <fasta>.fai（ID、序列长度、序列起始字节、每行碱基数、每行字节数），之后：
+        1. 只读取索引即可得到全部 ID 和序列长度（job_scheduler.py、pair 列表校验）；
+        2. 按 ID 随机读取序列：FASTA 以 mmap 只读映射，只访问所需记录所在的页，
+           复合物预测只读取 pair 列表中出现的序列，不必把整个 FASTA 读入内存。
+    FASTA 比索引新（被修改过）时自动重建索引；已有的 samtools faidx 索引可直接复用。
+    单蛋白预测需要全部序列，仍用 parse_fasta() 顺序读取整个文件。
+    FASTA 所在目录不可写时只在内存中建立索引。
+    ID 取 > 之后第一个空白之前的部分；同一 ID 出现多次时以最后一条为准（与原来的 parse_fasta 相同）。
+
+使用示例：
+    python fasta.py index pep.fa                 # 生成 / 更新 pep.fa.fai
+    python fasta.py fetch pep.fa AT1G01010 AT1G01020
+"""
+
+import os
+import sys
+import mmap
+import argparse
+from collections.abc import Mapping
+
+INDEX_SUFFIX = ".fai"
+# 提取序列时去掉的换行和空白
+WHITESPACE = b" \t\r\n"
+
+
+def index_path(fasta_file):
+    return f"{fasta_file}{INDEX_SUFFIX}"
+
+
+def scan_fasta(fasta_file):
+    """逐行扫描 FASTA，返回 {ID: [长度, 序列起始字节, 每行碱基数, 每行字节数]}"""
+    entries = {}
+    current = None
+    offset = 0
+    with open(fasta_file, "rb") as f:
+        for line in f:
+            size = len(line)
+            if line.startswith(b">"):
+                protein_id = line[1:].split(None, 1)[0].decode()
+                current = entries[protein_id] = [0, offset + size, 0, 0]
+            elif current is not None:
+                bases = len(line.strip(WHITESPACE))
+                if bases and not current[2]:
+                    current[2], current[3] = bases, size
+                current[0] += bases
+            offset += size
+    return entries
+
+
+def write_index(path, entries):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        for protein_id, (length, offset, line_bases, line_width) in entries.items():
+            f.write(f"{protein_id}\t{length}\t{offset}\t{line_bases}\t{line_width}\n")
+    os.replace(tmp, path)
+
+
+def read_index(path):
+    """{ID: 索引行其余部分}；数值列在用到时才解析（FastaIndex._entry），百万条记录的索引也能很快读入"""
+    with open(path, "r") as f:
+        return dict(line.split("\t", 1) for line in f if "\t" in line)
+
+
+def load_index(fasta_file):
+    """读取 FASTA 的索引；不存在或比 FASTA 旧时重新扫描并写入 <fasta>.fai"""
+    path = index_path(fasta_file)
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(fasta_file):
+            return read_index(path)
+    except OSError:
+        pass
+
+    entries = scan_fasta(fasta_file)
+    try:
+        write_index(path, entries)
+        print(f"[INFO] FASTA index {path}: {len(entries)} sequences")
+    except OSError as e:
+        print(f"[WARNING] Cannot write FASTA index {path} ({e}); keeping it in memory only")
+    return entries
+
+
+class FastaIndex(Mapping):
+    """
+    按 ID 随机访问的只读 FASTA：{ID: 序列} 的 Mapping，序列在访问时才从 mmap 中读取。
+    len()、迭代 ID 和 length() 只用索引，不读取序列。
+    """
+
+    def __init__(self, fasta_file):
+        self.fasta_file = fasta_file
+        self._entries = load_index(fasta_file)
+        self._map = None
+
+    def _mapped(self):
+        if self._map is None:
+            with open(self.fasta_file, "rb") as f:
+                # 空文件不能映射；此时索引也为空，不会走到读取序列
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def _entry(self, protein_id):
+        """[长度, 序列起始字节, 每行碱基数, 每行字节数]"""
+        entry = self._entries[protein_id]
+        if isinstance(entry, str):
+            entry = self._entries[protein_id] = [int(value) for value in entry.split("\t")[:4]]
+        return entry
+
+    def __getitem__(self, protein_id):
+        length, offset = self._entry(protein_id)[:2]
+        data = self._mapped()
+        # 记录在下一个 > 行之前结束；从前一个换行开始查找，空序列时也能立即停下
+        end = data.find(b"\n>", offset - 1)
+        if end < 0:
+            end = len(data)
+        sequence = data[offset:max(end, offset)].translate(None, WHITESPACE).decode()
+        if len(sequence) != length:
+            raise ValueError(f"{index_path(self.fasta_file)} does not match {self.fasta_file} "
+                             f"({protein_id}); delete the index to rebuild it")
+        return sequence
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, protein_id):
+        return protein_id in self._entries
+
+    def length(self, protein_id):
+        """序列长度（来自索引，不读取序列）"""
+        return self._entry(protein_id)[0]
+
+    def lengths(self):
+        return {protein_id: self._entry(protein_id)[0] for protein_id in self._entries}
+
+    def fetch(self, protein_ids):
+        """只读取给定 ID 的序列，返回 {ID: 序列}；按文件中的位置读取，顺序访问映射"""
+        return {pid: self[pid] for pid in sorted(set(protein_ids), key=lambda pid: self._entry(pid)[1])}
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_fasta(fasta_file):
+    """打开 FASTA（必要时先建立索引），返回 FastaIndex"""
+    return FastaIndex(fasta_file)
+
+
+def parse_fasta(fasta_file):
+    """
+    读取整个 FASTA，返回 {ID: 序列}，保持文件中的顺序。
+    单蛋白预测需要全部序列，顺序读取比逐条随机访问快，不经过索引
+    """
+    sequences = {}
+    with open(fasta_file, "r") as file:
+        protein_id = None
+        sequence = []
+        for line in file:
+            line = line.strip()
+            if line.startswith(">"):
+                if protein_id:
+                    sequences[protein_id] = "".join(sequence)
+                protein_id = line[1:].split()[0]
+                sequence = []
+            else:
+                sequence.append(line)
+        if protein_id:
+            sequences[protein_id] = "".join(sequence)
+    return sequences
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a faidx-style FASTA index or fetch sequences by ID")
+    parser.add_argument("command", choices=["index", "fetch"], help="index: build/refresh FASTA.fai; fetch: print records")
+    parser.add_argument("fasta", help="FASTA file")
+    parser.add_argument("ids", nargs="*", help="IDs to fetch")
+    args = parser.parse_args()
+
+    with open_fasta(args.fasta) as index:
+        if args.command == "index":
+            print(f"[DONE] {len(index)} sequences indexed in {index_path(args.fasta)}")
+            return
+        for protein_id in args.ids:
+            if protein_id not in index:
+                print(f"[WARNING] {protein_id} not found in {args.fasta}", file=sys.stderr)
+                continue
+            print(f">{protein_id}\n{index[protein_id]}")
+
+
+if __name__ == "__main__":
+    main()
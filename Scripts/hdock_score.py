@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+hdock_score.py
+
+功能说明：
+    直接读取 HDOCK 的 .out 文件获取对接得分，无需运行 createpl 生成复合物 PDB。
+    .out 中的 decoy 已按得分排好序（第一条即 createpl -nmax 1 输出模型的 REMARK Score），
+    因此只需读取前 K 行。
+
+使用示例（离线重新汇总整个 hdock_out 目录）：
+    python hdock_score.py -d hdock_out -r hdock.tsv
+    python hdock_score.py -d hdock_out -r hdock_top10.tsv -k 10
+"""
+
+import os
+import sys
+import argparse
+
+# decoy 行：3 个旋转角 + 3 个平移 + 对接得分 + ...
+SCORE_COLUMN = 6
+MAX_HEADER_LINES = 16
+
+
+def _decoy_score(line):
+    """decoy 行返回得分，表头行返回 None"""
+    fields = line.split()
+    if len(fields) <= SCORE_COLUMN:
+        return None
+    try:
+        for field in fields[:SCORE_COLUMN]:
+            float(field)
+        return float(fields[SCORE_COLUMN])
+    except ValueError:
+        return None
+
+
+def read_top_scores(out_file, k=1):
+    """返回 .out 文件中前 k 个 decoy 的得分（按文件顺序，即从优到差）"""
+    scores = []
+    header_lines = 0
+    with open(out_file, "r") as f:
+        for line in f:
+            score = _decoy_score(line)
+            if score is None:
+                if scores:
+                    break
+                header_lines += 1
+                if header_lines > MAX_HEADER_LINES:
+                    raise ValueError(f"No decoy table found in {out_file}")
+                continue
+            scores.append(score)
+            if len(scores) >= k:
+                break
+    return scores
+
+
+def top_score(out_file):
+    """最优 decoy 的得分，与 createpl 写入复合物 PDB 的 REMARK Score 相同"""
+    scores = read_top_scores(out_file, 1)
+    if not scores:
+        raise ValueError(f"No decoys in {out_file}")
+    return scores[0]
+
+
+def split_out_name(out_name):
+    """从 R-L.out 文件名中拆出受体和配体 ID"""
+    stem = os.path.basename(out_name)[:-len(".out")]
+    R, _, L = stem.partition("-")
+    return R, L
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read HDOCK scores from .out files without running createpl")
+    parser.add_argument("-d", "--out_dir", required=True, help="Directory containing HDOCK R-L.out files")
+    parser.add_argument("-r", "--result_file", required=True, help="Output TSV (R, L, score[, top-K scores])")
+    parser.add_argument("-k", "--top_k", type=int, default=1, help="Also report the top K decoy scores (default: 1)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.out_dir):
+        print(f"[ERROR] Output directory not found: {args.out_dir}")
+        sys.exit(1)
+
+    results = []
+    for name in sorted(os.listdir(args.out_dir)):
+        if not name.endswith(".out"):
+            continue
+        R, L = split_out_name(name)
+        try:
+            scores = read_top_scores(os.path.join(args.out_dir, name), args.top_k)
+        except Exception as e:
+            print(f"[ERROR] Failed to read {name}: {e}")
+            continue
+        if scores:
+            results.append((R, L, scores))
+
+    results.sort(key=lambda x: x[2][0], reverse=True)
+    with open(args.result_file, "w") as out:
+        for R, L, scores in results:
+            extra = "\t" + ",".join(f"{s:.4f}" for s in scores) if args.top_k > 1 else ""
+            out.write(f"{R}\t{L}\t{scores[0]:.4f}{extra}\n")
+
+    print(f"[DONE] Scored {len(results)} HDOCK outputs. Results saved to {args.result_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+job_ledger.py
+
+功能说明：
+    各步骤共用的 SQLite 任务账本，取代原来按输出文件（.out、.out.pdb、_data.json、_model.cif）
+    是否存在来判断跳过的做法。每个任务（步骤 + 主输出文件路径）一行，记录状态、输入哈希、
+    起止时间、耗时、运行次数和退出码：
+        running  已启动；进程被 kill 后保持该状态，留下的文件不会被采信，下次运行重新执行
+        done     退出码为 0，输出已通过“临时文件 + rename”原子写入到最终位置
+        failed   退出码非 0 或输出不完整，下次运行重新执行
+        adopted  账本中原本没有记录、已有输出通过完整性检查后被采信（升级前的输出目录或账本被删除）
+    只有 done / adopted、输入哈希（PDB 内容或序列 + 参数）与本次相同且输出文件仍然存在的任务才会跳过，
+    重启时每个任务只需一次主键查询和一次 stat，不必重新读取输出文件；输出已被删除的任务改记为 failed 并重新运行。
+
+    账本位置：--job_ledger 或环境变量 PPI_JOB_LEDGER；run_pipeline.py 使用 work_dir/jobs.sqlite，
+    并通过环境变量传给各子命令和进程池。单独运行某个脚本且两者都未指定时使用其输出目录下的 jobs.sqlite。
+    SQLite 依赖文件锁，work_dir 位于锁不可靠的 NFS 上时请用 --job_ledger 指向本机磁盘。
+
+    与 ledger.py 的区别：ledger.py 记录结果表中已有哪些 pair（增量运行），
+    本账本记录每个对接、预测任务本身是否完成。
+
+使用示例：
+    python job_ledger.py status -j work/jobs.sqlite
+    python job_ledger.py status -j work/jobs.sqlite --step megadock --state failed
+    python job_ledger.py forget -j work/jobs.sqlite --step hdock --state failed
+"""
+
+import os
+import sys
+import time
+import uuid
+import socket
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+
+ENV_VAR = "PPI_JOB_LEDGER"
+LEDGER_FILE = "jobs.sqlite"
+# 多个进程同时写入时等待锁的最长时间
+BUSY_TIMEOUT_SECONDS = 600
+DONE_STATES = ("done", "adopted")
+STATES = ("running", "done", "failed", "adopted")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    step      TEXT NOT NULL,
+    job       TEXT NOT NULL,
+    inputs    TEXT NOT NULL,
+    state     TEXT NOT NULL,
+    exit_code INTEGER,
+    started   REAL,
+    finished  REAL,
+    seconds   REAL,
+    attempts  INTEGER NOT NULL DEFAULT 0,
+    host      TEXT,
+    pid       INTEGER,
+    PRIMARY KEY (step, job)
+)
+"""
+
+_ledger_path = None
+_local = threading.local()
+
+
+def configure(path=None, default_dir=None):
+    """
+    启用任务账本：path > 环境变量 > default_dir/jobs.sqlite。
+    同时写入环境变量，子进程（其他脚本、进程池）使用同一个账本
+    """
+    global _ledger_path
+    path = path or os.environ.get(ENV_VAR) or (os.path.join(default_dir, LEDGER_FILE) if default_dir else None)
+    if path:
+        path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.environ[ENV_VAR] = path
+    _ledger_path = path
+    return path
+
+
+def get_ledger_path():
+    return _ledger_path or os.environ.get(ENV_VAR)
+
+
+def _connect(path=None):
+    """每个线程、每个进程各用一个连接；未启用账本时返回 None"""
+    path = path or get_ledger_path()
+    if not path:
+        return None
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    key = (os.getpid(), path)
+    conn = connections.get(key)
+    if conn is None:
+        # isolation_level=None：每条语句单独提交，不会长时间持有写锁
+        conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+        conn.execute(SCHEMA)
+        connections[key] = conn
+    return conn
+
+
+def _upsert(conn, step, job, inputs, state, exit_code=None, started=None, finished=None, attempt=0):
+    seconds = finished - started if started is not None and finished is not None else None
+    conn.execute(
+        """
+        INSERT INTO jobs (step, job, inputs, state, exit_code, started, finished, seconds, attempts, host, pid)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (step, job) DO UPDATE SET
+            inputs = excluded.inputs, state = excluded.state, exit_code = excluded.exit_code,
+            started = excluded.started, finished = excluded.finished, seconds = excluded.seconds,
+            attempts = jobs.attempts + excluded.attempts, host = excluded.host, pid = excluded.pid
+        """,
+        (step, job, inputs, state, exit_code, started, finished, seconds, attempt, socket.gethostname(), os.getpid())
+    )
+
+
+def lookup(step, job):
+    """返回 (state, inputs, exit_code)；没有记录或未启用账本时返回 None"""
+    conn = _connect()
+    if conn is None:
+        return None
+    return conn.execute("SELECT state, inputs, exit_code FROM jobs WHERE step = ? AND job = ?",
+                        (step, job)).fetchone()
+
+
+def is_done(step, job, inputs, adopt=None):
+    """
+    任务已完成、输入哈希相同且输出文件（job）仍然存在时返回 True。
+    adopt: 账本中没有该任务时调用的完整性检查（无参数，返回 bool）；
+           通过时把已有输出记为 adopted。running / failed 的任务不做检查，一律重新运行；
+           已完成但输出已被删除的任务改记为 failed，重新运行
+    """
+    conn = _connect()
+    if conn is None:
+        return False
+    row = conn.execute("SELECT state, inputs FROM jobs WHERE step = ? AND job = ?", (step, job)).fetchone()
+    if row is None:
+        if adopt is None:
+            return False
+        try:
+            complete = adopt()
+        except (OSError, ValueError):
+            complete = False
+        if complete:
+            _upsert(conn, step, job, inputs, "adopted")
+        return bool(complete)
+    state, recorded = row
+    if state not in DONE_STATES or recorded != inputs:
+        return False
+    if not os.path.exists(job):
+        print(f"[WARNING] {step}: output {job} is recorded as {state} but missing, running it again")
+        conn.execute("UPDATE jobs SET state = 'failed', exit_code = NULL WHERE step = ? AND job = ?", (step, job))
+        return False
+    return True
+
+
+def record(step, job, inputs, state="done", exit_code=0):
+    """不经过运行直接记录结果（例如从缓存链接得到输出）"""
+    conn = _connect()
+    if conn is not None:
+        now = time.time()
+        _upsert(conn, step, job, inputs, state, exit_code, now, now)
+
+
+def start(step, job, inputs):
+    conn = _connect()
+    if conn is not None:
+        _upsert(conn, step, job, inputs, "running", started=time.time(), attempt=1)
+
+
+def finish(step, job, exit_code, ok=None):
+    """ok 为 None 时按退出码判断；批量运行时由调用方按各任务的输出是否完整给出"""
+    conn = _connect()
+    if conn is None:
+        return
+    if ok is None:
+        ok = exit_code == 0
+    now = time.time()
+    conn.execute(
+        "UPDATE jobs SET state = ?, exit_code = ?, finished = ?, seconds = ? - COALESCE(started, ?) "
+        "WHERE step = ? AND job = ?",
+        ("done" if ok else "failed", exit_code, now, now, now, step, job)
+    )
+
+
+@contextmanager
+def track(step, job, inputs):
+    """
+    记录一次运行：进入时为 running，with 块内把退出码写入 run["exit_code"]，
+    输出不完整时把 run["ok"] 设为 False。块内抛出异常时记为 failed
+    （subprocess.CalledProcessError 记录其退出码，其他异常记为 -1）
+    """
+    start(step, job, inputs)
+    run = {"exit_code": None, "ok": None}
+    try:
+        yield run
+    except BaseException as e:
+        finish(step, job, getattr(e, "returncode", None) or run["exit_code"] or -1, False)
+        raise
+    exit_code = run["exit_code"] if run["exit_code"] is not None else -1
+    finish(step, job, exit_code, run["ok"])
+
+
+def partial_path(path):
+    """与 path 同目录的临时文件名；写完后 os.replace 到 path"""
+    return f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.part"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or edit the SQLite job ledger")
+    parser.add_argument("command", choices=["status", "forget"],
+                        help="status: job counts per step, or list jobs with --state/--job; forget: delete matching jobs")
+    parser.add_argument("-j", "--job_ledger", default=os.environ.get(ENV_VAR),
+                        help=f"Job ledger file (default: ${ENV_VAR})")
+    parser.add_argument("--step", default=None, help="Only jobs of this step, e.g. megadock, hdock, af3_model")
+    parser.add_argument("--state", choices=STATES, default=None, help="Only jobs in this state")
+    parser.add_argument("--job", default=None, help="Only this job (output path)")
+    args = parser.parse_args()
+
+    if not args.job_ledger or not os.path.exists(args.job_ledger):
+        print(f"[ERROR] Job ledger not found: {args.job_ledger} (use --job_ledger or ${ENV_VAR})")
+        sys.exit(1)
+    conn = _connect(args.job_ledger)
+
+    where = []
+    params = []
+    for column in ("step", "state", "job"):
+        if getattr(args, column):
+            where.append(f"{column} = ?")
+            params.append(getattr(args, column))
+    clause = f" WHERE {' AND '.join(where)}" if where else ""
+
+    if args.command == "forget":
+        deleted = conn.execute(f"DELETE FROM jobs{clause}", params).rowcount
+        print(f"[DONE] Removed {deleted} jobs from {args.job_ledger}; they will run again.")
+        return
+
+    if args.state or args.job:
+        print("Step\tState\tExit\tAttempts\tSeconds\tHost:PID\tJob")
+        for step, job, state, exit_code, attempts, seconds, host, pid in conn.execute(
+                f"SELECT step, job, state, exit_code, attempts, seconds, host, pid FROM jobs{clause} "
+                f"ORDER BY step, job", params):
+            exit_text = "-" if exit_code is None else exit_code
+            seconds_text = "-" if seconds is None else f"{seconds:.0f}"
+            print(f"{step}\t{state}\t{exit_text}\t{attempts}\t{seconds_text}\t{host}:{pid}\t{job}")
+        return
+
+    print("Step\t" + "\t".join(STATES) + "\tHours")
+    rows = conn.execute(
+        f"SELECT step, state, COUNT(*), COALESCE(SUM(seconds), 0) FROM jobs{clause} GROUP BY step, state", params
+    ).fetchall()
+    for step in sorted({row[0] for row in rows}):
+        counts = {state: count for s, state, count, _ in rows if s == step}
+        hours = sum(seconds for s, _, _, seconds in rows if s == step) / 3600
+        print(f"{step}\t" + "\t".join(str(counts.get(state, 0)) for state in STATES) + f"\t{hours:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+job_scheduler.py
+
+功能说明：
+    按序列长度为 AlphaFold3 任务排序和分配 worker。
+
+    AF3 把输入补齐到最近的 token 桶（--buckets，默认 256, 512, ..., 5120）后编译模型，
+    同一个桶内的输入复用同一份编译结果；推理耗时随补齐后的 token 数近似按 2.2 次方增长。
+    因此：
+        1. 任务按“最长优先”（LPT）排序：长任务先跑，短任务填补各 GPU 的尾部空闲；
+        2. 排序键以桶为主，同一桶的任务在队列中连续，常驻 worker 连续处理同一桶只编译一次；
+        3. 静态分配（batch_size = 0）时每个任务交给当前预计负载最小的 worker。
+    排序只依赖 token 数和任务名，相同输入总是得到相同的顺序和分配。
+
+    预计耗时按 AF3 官方 A100 参考耗时估算，只用于比较不同排序和 worker 数，不代表实际运行时间。
+
+使用示例（预览调度，不运行 AF3）：
+    python job_scheduler.py -fa pep.fa -w 4
+    python job_scheduler.py -fa pep.fa -l Protein_pair.list -w 2
+"""
+
+import argparse
+
+# AF3 run_alphafold.py 的默认 --buckets
+AF3_BUCKETS = [256, 512, 768, 1024, 1280, 1536, 2048, 2560, 3072, 3584, 4096, 4608, 5120]
+
+# 耗时模型：固定开销 + 1024 token 的参考耗时 × (补齐 token 数 / 1024) ^ 指数（A100 参考值，单位秒）
+AF3_OVERHEAD_SECONDS = 20.0
+AF3_SECONDS_AT_1024 = 60.0
+AF3_COST_EXPONENT = 2.2
+
+
+def token_bucket(n_tokens, buckets=AF3_BUCKETS):
+    """AF3 补齐后的 token 数；超过最大桶时不补齐"""
+    for bucket in buckets:
+        if n_tokens <= bucket:
+            return bucket
+    return n_tokens
+
+
+def estimate_seconds(n_tokens):
+    """单个输入的预计推理耗时（秒）"""
+    return AF3_OVERHEAD_SECONDS + AF3_SECONDS_AT_1024 * (token_bucket(n_tokens) / 1024) ** AF3_COST_EXPONENT
+
+
+def lpt_order(jobs, tokens):
+    """
+    最长优先排序：先按桶从大到小，桶内按 token 数从大到小，最后按任务名。
+
+    jobs:   [(name, ...), ...]，元组第一个元素为任务名
+    tokens: {name: token 数}；缺失的任务视为 0，排在最后
+    """
+    def key(job):
+        n = tokens.get(job[0], 0)
+        return -token_bucket(n), -n, job[0]
+    return sorted(jobs, key=key)
+
+
+def assign_lpt(jobs, tokens, n_workers):
+    """按 LPT 顺序把每个任务交给当前预计负载最小的 worker（负载相同时取编号小的），返回 (各 worker 任务列表, 各 worker 负载)"""
+    batches = [[] for _ in range(n_workers)]
+    loads = [0.0] * n_workers
+    for job in lpt_order(jobs, tokens):
+        worker = min(range(n_workers), key=lambda i: (loads[i], i))
+        batches[worker].append(job)
+        loads[worker] += estimate_seconds(tokens.get(job[0], 0))
+    return batches, loads
+
+
+def predict_makespan(jobs, tokens, n_workers):
+    """按给定顺序做列表调度（空闲 worker 取下一个任务），返回预计总耗时（秒）"""
+    loads = [0.0] * max(1, n_workers)
+    for job in jobs:
+        worker = min(range(len(loads)), key=lambda i: (loads[i], i))
+        loads[worker] += estimate_seconds(tokens.get(job[0], 0))
+    return max(loads)
+
+
+def format_seconds(seconds):
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+def report_schedule(jobs, tokens, n_workers):
+    """打印桶分布和预计总耗时（LPT 顺序 vs 输入顺序）"""
+    if not jobs:
+        return
+    buckets = {}
+    for job in jobs:
+        bucket = token_bucket(tokens.get(job[0], 0))
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+    summary = ", ".join(f"{bucket}:{count}" for bucket, count in sorted(buckets.items(), reverse=True))
+    print(f"[INFO] AF3 schedule: {len(jobs)} inputs on {n_workers} workers, token buckets {{{summary}}}")
+    print(f"[INFO] Predicted makespan: {format_seconds(predict_makespan(lpt_order(jobs, tokens), tokens, n_workers))} "
+          f"longest-first vs {format_seconds(predict_makespan(jobs, tokens, n_workers))} in input order "
+          f"(A100 reference timings)")
+
+
+def main():
+    from pair_list import read_pair_list
+    from fasta import open_fasta
+
+    parser = argparse.ArgumentParser(description="Preview the length-aware AlphaFold3 schedule")
+    parser.add_argument("-fa", "--fasta", required=True, help="Protein FASTA file")
+    parser.add_argument("-l", "--pair_list", default=None, help="Pair list: schedule complexes instead of monomers")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of GPU workers")
+    args = parser.parse_args()
+
+    # 只需要序列长度，直接取自 FASTA 索引
+    lengths = open_fasta(args.fasta).lengths()
+    if args.pair_list:
+        lengths = {pid.lower(): length for pid, length in lengths.items()}
+        tokens = {f"{id1}-{id2}": lengths[id1] + lengths[id2]
+                  for id1, id2 in read_pair_list(args.pair_list, known_ids=lengths)}
+    else:
+        tokens = lengths
+
+    jobs = [(name,) for name in tokens]
+    report_schedule(jobs, tokens, args.workers)
+    batches, loads = assign_lpt(jobs, tokens, args.workers)
+    for i, (batch, load) in enumerate(zip(batches, loads)):
+        print(f"worker{i}\t{format_seconds(load)}\t" + ",".join(
+            f"{name}({tokens[name]})" for name, in batch))
+
+
+if __name__ == "__main__":
+    main()
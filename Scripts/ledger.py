@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ledger.py
+
+功能说明：
+    增量运行（--incremental）使用的已完成 pair 账本。
+
+    每个结果表旁有一个只追加的账本 <result_file>.ledger，每行一个已得到结果的规范化 pair
+    （pair_list.canonical_pair）。增量运行时：
+        1. pair 列表减去账本即为需要计算的增量，只为增量规划任务；
+        2. 新结果按块追加到结果表末尾（块内按得分排序），不重写已有的行；
+        3. 新完成的 pair 追加到账本。失败的 pair 不写入账本，下次运行自动重试。
+    账本不存在而结果表已存在时（例如之前做过一次完整运行），先从结果表的 ID 列生成账本。
+    非增量运行会重写结果表，同时删除旧账本，下次增量运行再从新的结果表生成。
+"""
+
+import os
+
+from pair_list import canonical_pair
+
+LEDGER_SUFFIX = ".ledger"
+
+
+def ledger_path(result_file):
+    return f"{result_file}{LEDGER_SUFFIX}"
+
+
+def pair_from_row(line, joined=False):
+    """结果表一行 → 规范化 pair；joined=True 时第一列为 AF3 复合物的 ID1-ID2"""
+    parts = line.rstrip("\n").split("\t")
+    if joined:
+        if parts[0] == "Pair" or "-" not in parts[0]:
+            return None
+        return canonical_pair(*parts[0].split("-", 1))
+    if len(parts) < 3:
+        return None
+    return canonical_pair(parts[0], parts[1])
+
+
+def append_lines(path, lines):
+    """追加若干行；已有文件不以换行结尾时先补一个换行"""
+    if not lines:
+        return
+    prefix = ""
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                prefix = "\n"
+    with open(path, "a") as f:
+        f.write(prefix + "".join(f"{line}\n" for line in lines))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_ledger(result_file, joined=False):
+    """返回已完成的规范化 pair 集合；账本不存在时从已有的结果表生成"""
+    path = ledger_path(result_file)
+    done = set()
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2:
+                    done.add((parts[0], parts[1]))
+        return done
+
+    if os.path.exists(result_file):
+        with open(result_file, "r") as f:
+            for line in f:
+                pair = pair_from_row(line, joined)
+                if pair:
+                    done.add(pair)
+        append_lines(path, [f"{id1}\t{id2}" for id1, id2 in sorted(done)])
+        print(f"[INFO] Ledger {path} created from {len(done)} pairs in {result_file}")
+    return done
+
+
+def record(result_file, pairs):
+    """把新完成的 pair 追加到账本"""
+    append_lines(ledger_path(result_file), [f"{id1}\t{id2}" for id1, id2 in sorted(set(pairs))])
+
+
+def reset(result_file):
+    """非增量运行重写了结果表，删除旧账本"""
+    try:
+        os.remove(ledger_path(result_file))
+    except FileNotFoundError:
+        pass
+
+
+def select_pending(pairs, done, label):
+    """pair 列表减去已完成的 pair，保持原有顺序"""
+    pending = [pair for pair in pairs if pair not in done]
+    print(f"[INFO] Incremental {label}: {len(pairs)} pairs in the list, {len(pairs) - len(pending)} already done, "
+          f"{len(pending)} to run")
+    return pending
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+megadock_score.py
+
+功能说明：
+    直接读取 MEGADOCK 的 .out 文件计算 PPI score，无需再启动容器运行 ppiscore。
+    得分定义与 ppiscore 相同：取前 N 个 decoy 的对接得分，
+        E = (最高得分 - 平均得分) / 标准差
+
+使用示例（离线重新打分整个 megadock_out 目录）：
+    python megadock_score.py -d megadock_out -N 10800 -r megadock.tsv
+"""
+
+import os
+import argparse
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# decoy 行：3 个旋转角 + 3 个平移（体素坐标）+ 对接得分
+SCORE_COLUMN = 6
+MAX_HEADER_LINES = 16
+
+
+def _is_decoy_line(line):
+    fields = line.split()
+    if len(fields) <= SCORE_COLUMN:
+        return False
+    try:
+        for field in fields[:SCORE_COLUMN + 1]:
+            float(field)
+    except ValueError:
+        return False
+    return True
+
+
+def read_decoy_scores(out_file, n_decoys=None):
+    """读取 .out 文件中前 n_decoys 个 decoy 的得分，返回 numpy 数组"""
+    header_lines = 0
+    with open(out_file, "r") as f:
+        for line in f:
+            if _is_decoy_line(line):
+                break
+            header_lines += 1
+            if header_lines > MAX_HEADER_LINES:
+                raise ValueError(f"No decoy table found in {out_file}")
+        else:
+            return np.empty(0)
+
+    scores = np.loadtxt(
+        out_file,
+        skiprows=header_lines,
+        usecols=SCORE_COLUMN,
+        max_rows=n_decoys,
+        ndmin=1,
+    )
+    return scores
+
+
+def ppi_score(out_file, n_decoys):
+    """按 ppiscore 的定义计算 E 值"""
+    scores = read_decoy_scores(out_file, n_decoys)
+    if scores.size == 0:
+        raise ValueError(f"No decoys in {out_file}")
+    sd = scores.std()
+    if sd == 0:
+        raise ValueError(f"Zero score variance in {out_file}")
+    return float((scores.max() - scores.mean()) / sd)
+
+
+def split_out_name(out_name):
+    """从 R-L.out 文件名中拆出受体和配体 ID"""
+    stem = os.path.basename(out_name)[:-len(".out")]
+    R, _, L = stem.partition("-")
+    return R, L
+
+
+def _score_one(out_file, n_decoys):
+    R, L = split_out_name(out_file)
+    try:
+        return R, L, ppi_score(out_file, n_decoys)
+    except Exception as e:
+        print(f"[WARNING] Unable to score {os.path.basename(out_file)}: {e}")
+        return R, L, None
+
+
+def rescore_directory(out_dir, n_decoys, num_workers=1):
+    """对目录中所有 .out 文件重新打分，返回 [(R, L, score), ...]"""
+    out_files = sorted(
+        os.path.join(out_dir, name) for name in os.listdir(out_dir)
+        if name.endswith(".out") and "-" in name
+    )
+    if num_workers > 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(_score_one, out_files, [n_decoys] * len(out_files), chunksize=64))
+    else:
+        results = [_score_one(path, n_decoys) for path in out_files]
+    return [r for r in results if r[2] is not None]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute MEGADOCK PPI scores from .out files without ppiscore")
+    parser.add_argument("-d", "--out_dir", required=True, help="MEGADOCK output directory containing R-L.out files")
+    parser.add_argument("-N", type=int, default=10800, help="Number of decoys used for scoring, default 10800")
+    parser.add_argument("-r", "--result_file", default="megadock_result.txt", help="File to save MEGADOCK scores")
+    parser.add_argument("-n", "--num_workers", type=int, default=1, help="Number of scoring processes, default 1")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.out_dir):
+        print(f"[ERROR] Output directory not found: {args.out_dir}")
+        sys.exit(1)
+
+    results = rescore_directory(args.out_dir, args.N, args.num_workers)
+    results.sort(key=lambda x: x[2], reverse=True)
+
+    with open(args.result_file, "w") as out:
+        out.write("\n".join(f"{R}\t{L}\t{score:.4f}" for R, L, score in results))
+
+    print(f"[DONE] Scored {len(results)} MEGADOCK outputs. Results saved to {args.result_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+memory_model.py
+
+功能说明：
+    估算单个任务的主机内存和显存峰值，供资源池（resources.py）做准入控制：
+    任务只有在估算值放得进当前空闲的内存 / 显存时才会启动。
+
+    每类任务的估算都是“截距 + 斜率 × 规模特征”（单位 GB）：
+        af3_msa   AF3 数据流程（jackhmmer/nhmmer），特征 = token 数 / 1000
+        af3       AF3 推理，特征 = (补齐到 token 桶后的 token 数 / 1000)^2，pair 表示随 token 数平方增长
+        megadock  MEGADOCK FFT，特征 = 网格点数（百万），网格边长由受体和配体直径（结构索引）估算
+        hdock     HDOCK，特征 = 受体与配体原子总数 / 1000
+
+    默认系数是偏保守的经验值，可用过去运行中观测到的峰值校准：
+        python memory_model.py record -r DIR --kind af3 --size 2300 --host_gb 38 --gpu_gb 52
+        python memory_model.py fit -r DIR
+    size 为 token 数（af3 / af3_msa）、MEGADOCK .out 第一行的网格边长（megadock）或原子总数（hdock）。
+    fit 对每类任务做最小二乘拟合，再上移截距使所有观测值都不超过估算值，结果写入 DIR/memory_model.json，
+    之后所有使用同一资源目录的脚本都按校准后的模型估算。
+
+    估算值超过上限的任务属于“大任务”。上限默认等于资源池的总内存和单卡显存，可用 limit 子命令调低。
+    各脚本把大任务放进单独的队列，等普通任务全部完成后逐个运行并独占申请资源；
+    AF3 大任务同时开启统一内存（显存不足时借用主机内存），不会因为与其他任务同时运行而 OOM。
+
+使用示例：
+    python memory_model.py show -r DIR --kind af3 --size 3000
+    python memory_model.py limit -r DIR --host_gb 200 --gpu_gb 40
+"""
+
+import os
+import sys
+import json
+import math
+import argparse
+
+import resources
+from job_scheduler import token_bucket
+
+MODEL_FILE = "memory_model.json"
+OBSERVATION_FILE = "memory_observations.tsv"
+KINDS = ["af3_msa", "af3", "megadock", "hdock"]
+
+# 每类任务：[截距, 斜率]，分别对应主机内存和显存
+DEFAULT_MODEL = {
+    "af3_msa": {"host_gb": [16.0, 2.0], "gpu_gb": [0.0, 0.0]},
+    "af3": {"host_gb": [12.0, 1.0], "gpu_gb": [6.0, 2.4]},
+    "megadock": {"host_gb": [1.0, 0.08], "gpu_gb": [0.5, 0.05]},
+    "hdock": {"host_gb": [0.5, 0.15], "gpu_gb": [0.0, 0.0]},
+}
+
+# MEGADOCK 默认网格间距（Å）
+MEGADOCK_GRID_SPACING = 1.2
+
+# AF3 官方文档中处理超长输入的设置：关闭显存预分配，允许借用主机内存
+AF3_UNIFIED_MEMORY_ENV = ("-e XLA_PYTHON_CLIENT_PREALLOCATE=false -e TF_FORCE_UNIFIED_MEMORY=true "
+                          "-e XLA_CLIENT_MEM_FRACTION=3.2")
+
+_ceilings = None
+# load_model() 的结果，按模型文件路径缓存
+_models = {}
+
+
+def fft_size(n):
+    """不小于 n 且只含因子 2、3、5 的整数（FFT 网格边长）"""
+    n = max(1, int(math.ceil(n)))
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
+def megadock_grid(r_diameter, l_diameter):
+    """受体网格需容纳受体和绕其表面平移的配体，边长约为两者直径之和"""
+    return fft_size((r_diameter + l_diameter) / MEGADOCK_GRID_SPACING)
+
+
+def feature(kind, size):
+    if kind == "af3":
+        return (token_bucket(size) / 1000) ** 2
+    if kind == "megadock":
+        return size ** 3 / 1e6
+    return size / 1000
+
+
+def _model_path(resource_dir=None):
+    resource_dir = resource_dir or resources.get_resource_dir()
+    return os.path.join(resource_dir, MODEL_FILE) if resource_dir else None
+
+
+def load_model(resource_dir=None):
+    """默认系数，叠加资源目录中校准后的系数和上限"""
+    model = {kind: dict(coef) for kind, coef in DEFAULT_MODEL.items()}
+    model["ceiling_gb"] = {}
+    path = _model_path(resource_dir)
+    if path and os.path.exists(path):
+        with open(path, "r") as f:
+            saved = json.load(f)
+        for kind in KINDS:
+            model[kind].update(saved.get(kind, {}))
+        model["ceiling_gb"] = saved.get("ceiling_gb", {})
+    return model
+
+
+def get_model():
+    """
+    当前资源目录的模型，每个进程只读取一次：规划时每个任务都要估算多次，不必每次重新解析 JSON。
+    返回值是共享的，不要修改（需要修改时用 load_model()）
+    """
+    path = _model_path()
+    if path not in _models:
+        _models[path] = load_model()
+    return _models[path]
+
+
+def save_model(resource_dir, model):
+    _write_json(os.path.join(resource_dir, MODEL_FILE), model)
+    _models.clear()
+
+
+def estimate(kind, size, model=None):
+    """返回 (主机内存 GB, 显存 GB)"""
+    model = model or get_model()
+    x = feature(kind, size)
+    host = model[kind]["host_gb"][0] + model[kind]["host_gb"][1] * x
+    gpu = model[kind]["gpu_gb"][0] + model[kind]["gpu_gb"][1] * x
+    return round(host, 1), round(gpu, 1)
+
+
+def estimate_af3(tokens, data_pipeline=True, inference=True):
+    """AF3 任务：数据流程和推理先后运行，主机内存取两者较大值"""
+    model = get_model()
+    host, gpu = 0.0, 0.0
+    if data_pipeline:
+        host = estimate("af3_msa", tokens, model)[0]
+    if inference:
+        inf_host, gpu = estimate("af3", tokens, model)
+        host = max(host, inf_host)
+    return host, gpu
+
+
+def estimate_megadock(r_entry, l_entry):
+    return estimate("megadock", megadock_grid(r_entry["diameter"], l_entry["diameter"]))
+
+
+def estimate_hdock(r_entry, l_entry):
+    return estimate("hdock", r_entry["atoms"] + l_entry["atoms"])
+
+
+def get_ceilings():
+    """大任务上限 (主机内存 GB, 显存 GB)；未配置时取资源池总量（未启用资源池时为本机总量）"""
+    global _ceilings
+    if _ceilings is None:
+        configured = get_model()["ceiling_gb"]
+        limits = resources.get_limits()
+        gpu_totals = list(limits.get("gpu_mem_gb", {}).values())
+        _ceilings = (
+            configured.get("host") or limits.get("mem_gb") or None,
+            configured.get("gpu") or (min(gpu_totals) if gpu_totals else None),
+        )
+    return _ceilings
+
+
+def is_large(host_gb, gpu_gb):
+    host_ceiling, gpu_ceiling = get_ceilings()
+    return bool((host_ceiling and host_gb > host_ceiling) or (gpu_ceiling and gpu_gb > gpu_ceiling))
+
+
+def split_large(jobs, estimate_fn, label, name_fn=lambda job: job[0]):
+    """把估算值超过上限的任务分到单独的大任务队列，保持原有顺序；返回 (普通任务, 大任务)"""
+    normal, large = [], []
+    for job in jobs:
+        host, gpu = estimate_fn(job)
+        if is_large(host, gpu):
+            print(f"[INFO] {label} {name_fn(job)}: estimated {host:.0f}G host / {gpu:.0f}G GPU memory "
+                  f"exceeds the ceiling, moved to the large-job queue")
+            large.append(job)
+        else:
+            normal.append(job)
+    return normal, large
+
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def record_observation(resource_dir, kind, size, host_gb, gpu_gb=None):
+    path = os.path.join(resource_dir, OBSERVATION_FILE)
+    new_file = not os.path.exists(path)
+    with open(path, "a") as f:
+        if new_file:
+            f.write("Kind\tSize\tHost_GB\tGPU_GB\n")
+        f.write(f"{kind}\t{size}\t{host_gb}\t{'' if gpu_gb is None else gpu_gb}\n")
+
+
+def read_observations(resource_dir):
+    observations = []
+    path = os.path.join(resource_dir, OBSERVATION_FILE)
+    if not os.path.exists(path):
+        return observations
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) != 4 or parts[0] not in KINDS:
+                continue
+            observations.append((parts[0], float(parts[1]), float(parts[2]),
+                                 float(parts[3]) if parts[3] else None))
+    return observations
+
+
+def fit_line(points, default):
+    """最小二乘拟合 [截距, 斜率]，再上移截距覆盖所有观测点；特征值不足两个时沿用默认斜率"""
+    xs = [x for x, _ in points]
+    slope = default[1]
+    if len(set(xs)) >= 2:
+        mean_x = sum(xs) / len(xs)
+        mean_y = sum(y for _, y in points) / len(points)
+        sxx = sum((x - mean_x) ** 2 for x in xs)
+        slope = max(0.0, sum((x - mean_x) * (y - mean_y) for x, y in points) / sxx)
+    intercept = max(y - slope * x for x, y in points)
+    return [round(max(0.0, intercept), 3), round(slope, 5)]
+
+
+def fit_model(resource_dir):
+    """用观测记录重新拟合系数并写入 memory_model.json，保留已配置的上限"""
+    model = load_model(resource_dir)
+    observations = read_observations(resource_dir)
+    for kind in KINDS:
+        for column, index in (("host_gb", 2), ("gpu_gb", 3)):
+            points = [(feature(kind, obs[1]), obs[index]) for obs in observations
+                      if obs[0] == kind and obs[index] is not None]
+            if points:
+                model[kind][column] = fit_line(points, model[kind][column])
+                print(f"[INFO] {kind} {column}: {len(points)} observations → "
+                      f"{model[kind][column][0]} + {model[kind][column][1]} × feature")
+    save_model(resource_dir, model)
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate, calibrate and limit per-job memory use")
+    parser.add_argument("command", choices=["show", "record", "fit", "limit"],
+                        help="show: print an estimate; record: add an observed peak; fit: recalibrate from "
+                             "observations; limit: set the large-job ceilings")
+    parser.add_argument("-r", "--resource_dir", default=os.environ.get(resources.ENV_VAR),
+                        help=f"Resource pool directory holding the model (default: ${resources.ENV_VAR})")
+    parser.add_argument("--kind", choices=KINDS, help="Job type (show, record)")
+    parser.add_argument("--size", type=float,
+                        help="Tokens (af3, af3_msa), MEGADOCK grid edge, or total atoms (hdock)")
+    parser.add_argument("--host_gb", type=float, default=None, help="Observed host peak (record) or ceiling (limit)")
+    parser.add_argument("--gpu_gb", type=float, default=None, help="Observed GPU peak (record) or ceiling (limit)")
+    args = parser.parse_args()
+
+    if args.command != "show" and not args.resource_dir:
+        print(f"[ERROR] --resource_dir or ${resources.ENV_VAR} is required.")
+        sys.exit(1)
+    if args.resource_dir:
+        resources.configure(args.resource_dir)
+
+    if args.command == "show":
+        if not args.kind or args.size is None:
+            print("[ERROR] --kind and --size are required for show.")
+            sys.exit(1)
+        host, gpu = estimate(args.kind, args.size)
+        host_ceiling, gpu_ceiling = get_ceilings()
+        print(f"{args.kind}\tsize={args.size:g}\thost={host:.1f}G\tgpu={gpu:.1f}G\t"
+              f"{'large' if is_large(host, gpu) else 'normal'} (ceiling host={host_ceiling}G, gpu={gpu_ceiling}G)")
+    elif args.command == "record":
+        if not args.kind or args.size is None or args.host_gb is None:
+            print("[ERROR] --kind, --size and --host_gb are required for record.")
+            sys.exit(1)
+        record_observation(args.resource_dir, args.kind, args.size, args.host_gb, args.gpu_gb)
+        print(f"[DONE] Recorded {args.kind} observation in {os.path.join(args.resource_dir, OBSERVATION_FILE)}")
+    elif args.command == "fit":
+        fit_model(args.resource_dir)
+        print(f"[DONE] Memory model saved to {os.path.join(args.resource_dir, MODEL_FILE)}")
+    else:
+        model = load_model(args.resource_dir)
+        if args.host_gb is not None:
+            model["ceiling_gb"]["host"] = args.host_gb
+        if args.gpu_gb is not None:
+            model["ceiling_gb"]["gpu"] = args.gpu_gb
+        save_model(args.resource_dir, model)
+        print(f"[DONE] Large-job ceilings: {model['ceiling_gb']}")
+
+
+if __name__ == "__main__":
+    main()
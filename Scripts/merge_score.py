@@ -28,22 +28,265 @@ merge_docking_results.py
 
 import pandas as pd
 import argparse
+import hashlib
+import heapq
+import io
+import itertools
+import json
 import sys
 import os
+import tempfile
+
+# 各来源得分列名，同时决定输出中的列顺序
+SCORE_COLUMNS = {
+    "megadock": "MEGADOCK_Score",
+    "hdock": "HDOCK_Score",
+    "af": "Alphafold_pTM+ipTM",
+}
+
+HEADER_NOTE = (
+    "MEGADOCK PPI Score > 12, 80% probability of interaction; "
+    "> 10, 50% probability of interaction; "
+    "> 8, 10% probability of interaction. "
+    "HDOCK docking score < -200, high probability of interaction. "
+    "pTM + ipTM > 0.75, indicating that the model's predictions of protein-protein interface "
+    "interactions and overall complex structure are highly reliable."
+)
+
+# 增量合并的状态：各来源已合并到的字节位置
+STATE_SUFFIX = ".state.json"
 
 
 def normalize_ids(df, id1_col="ID1", id2_col="ID2"):
-    """将ID转为大写并按字母顺序重新排列，保证ID1 < ID2"""
-    df[id1_col] = df[id1_col].str.upper()
-    df[id2_col] = df[id2_col].str.upper()
-    df[['ID1', 'ID2']] = pd.DataFrame(
-        df[[id1_col, id2_col]].apply(lambda x: sorted([x[id1_col], x[id2_col]]), axis=1).tolist(),
-        index=df.index
-    )
+    """
+    按 pair_list.canonical_pair 规范化（转小写后按字母顺序排列），保证ID1 < ID2，再将ID转为大写。
+    整列比较后交换，不逐行调用 Python 函数
+    """
+    id1 = df[id1_col].astype(str).str.lower()
+    id2 = df[id2_col].astype(str).str.lower()
+    swap = id1 > id2
+    df['ID1'] = id1.where(~swap, id2).str.upper()
+    df['ID2'] = id2.where(~swap, id1).str.upper()
     return df
 
 
-def main():
+def _prepare(kind, df):
+    """规范化 ID，返回 ID1 ID2 得分 三列"""
+    column = SCORE_COLUMNS[kind]
+    if kind == "af":
+        df[['ID1', 'ID2']] = df['Pair'].str.split('-', n=1, expand=True)
+        df = normalize_ids(df)
+        df[column] = (df['PTM'] + df['IPTM']).round(2)
+        return df[['ID1', 'ID2', column]]
+    return normalize_ids(df)
+
+
+def read_table(kind, path, chunksize=None, header=True):
+    """
+    读取一个来源的得分表；给定 chunksize 时返回按块规范化的迭代器。header=False 用于读取 AF3 表追加的部分。
+    只有空的得分视为缺失，NA、null 等 ID 原样保留（与 _read_bucket 相同，两种合并方式的输出才一致）
+    """
+    column = SCORE_COLUMNS[kind]
+    if kind == "af":
+        kwargs = dict(sep="\t", dtype={"Pair": str, "PTM": float, "IPTM": float}, keep_default_na=False,
+                      na_values={"PTM": [""], "IPTM": [""]})
+        if not header:
+            kwargs.update(header=None, names=["Pair", "PTM", "IPTM"])
+    else:
+        kwargs = dict(sep="\t", header=None, names=["ID1", "ID2", column],
+                      dtype={"ID1": str, "ID2": str, column: float}, keep_default_na=False,
+                      na_values={column: [""]})
+    if chunksize is None:
+        return _prepare(kind, pd.read_csv(path, **kwargs))
+    return (_prepare(kind, chunk) for chunk in pd.read_csv(path, chunksize=chunksize, **kwargs))
+
+
+def merge_tables(dfs):
+    """依次外连接各来源的表，按 ID1、ID2 排序"""
+    merged = dfs[0]
+    for df in dfs[1:]:
+        merged = pd.merge(merged, df, on=['ID1', 'ID2'], how='outer')
+    return merged.sort_values(by=["ID1", "ID2"], ignore_index=True)
+
+
+def merge_in_memory(sources, output):
+    dfs = [read_table(kind, path) for kind, path in sources]
+    merged = merge_tables(dfs)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(HEADER_NOTE + "\n")
+        merged.to_csv(f, sep="\t", index=False)
+    os.replace(tmp, output)
+
+
+def empty_table(kind):
+    return pd.DataFrame({"ID1": pd.Series(dtype=object), "ID2": pd.Series(dtype=object),
+                         SCORE_COLUMNS[kind]: pd.Series(dtype=float)})
+
+
+def _read_bucket(path, kind):
+    column = SCORE_COLUMNS[kind]
+    if not os.path.exists(path):
+        return empty_table(kind)
+    return pd.read_csv(path, sep="\t", header=None, names=["ID1", "ID2", column],
+                       dtype={"ID1": str, "ID2": str, column: float}, keep_default_na=False,
+                       na_values={column: [""]})
+
+
+def _sort_key(line):
+    return line.split("\t", 2)[:2]
+
+
+def merge_streaming(sources, output, chunksize, n_buckets=64, tmp_dir=None):
+    """
+    表大于内存时的合并，输出与 merge_in_memory 完全相同：
+        1. 分块读取各表，按规范化后的 pair 哈希写入 n_buckets 个分桶文件；
+        2. 同一 pair 总在同一个桶里，逐桶外连接、排序后写出；
+        3. 各桶已有序，按 (ID1, ID2) 多路归并为最终输出。
+    任一时刻内存中只有一个块或一个桶
+    """
+    with tempfile.TemporaryDirectory(prefix="merge_score.", dir=tmp_dir) as tmp:
+        for kind, path in sources:
+            for chunk in read_table(kind, path, chunksize):
+                buckets = pd.util.hash_pandas_object(chunk[['ID1', 'ID2']], index=False) % n_buckets
+                for bucket, part in chunk.groupby(buckets.to_numpy()):
+                    part.to_csv(os.path.join(tmp, f"{kind}.{bucket}.tsv"), sep="\t", index=False, header=False,
+                                mode="a")
+
+        sorted_files = []
+        for bucket in range(n_buckets):
+            dfs = [_read_bucket(os.path.join(tmp, f"{kind}.{bucket}.tsv"), kind) for kind, _ in sources]
+            merged = merge_tables(dfs)
+            if merged.empty:
+                continue
+            path = os.path.join(tmp, f"merged.{bucket}.tsv")
+            merged.to_csv(path, sep="\t", index=False, header=False)
+            sorted_files.append(path)
+        header = "\t".join(["ID1", "ID2"] + [SCORE_COLUMNS[kind] for kind, _ in sources])
+
+        handles = [open(path, "r", encoding="utf-8") for path in sorted_files]
+        tmp_output = f"{output}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_output, "w", encoding="utf-8") as f:
+                f.write(HEADER_NOTE + "\n")
+                f.write(header + "\n")
+                f.writelines(heapq.merge(*handles, key=_sort_key))
+            os.replace(tmp_output, output)
+        finally:
+            for handle in handles:
+                handle.close()
+            if os.path.exists(tmp_output):
+                os.remove(tmp_output)
+
+
+def merge_full(sources, output, chunksize=None, n_buckets=64, tmp_dir=None):
+    if chunksize:
+        merge_streaming(sources, output, chunksize, n_buckets, tmp_dir)
+    else:
+        merge_in_memory(sources, output)
+    save_state(output, sources)
+
+
+def _tail_hash(path, offset):
+    """offset 之前最后 4 KB 的哈希，用于发现结果表在两次合并之间被重写"""
+    with open(path, "rb") as f:
+        start = max(0, offset - 4096)
+        f.seek(start)
+        return hashlib.sha256(f.read(offset - start)).hexdigest()
+
+
+def save_state(output, sources, offsets=None):
+    offsets = offsets or {}
+    state = {
+        "columns": ["ID1", "ID2"] + [SCORE_COLUMNS[kind] for kind, _ in sources],
+        "sources": {},
+    }
+    for kind, path in sources:
+        offset = offsets.get(kind, os.path.getsize(path))
+        state["sources"][kind] = {"path": os.path.abspath(path), "offset": offset,
+                                  "tail_sha256": _tail_hash(path, offset)}
+    tmp = f"{output}{STATE_SUFFIX}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, f"{output}{STATE_SUFFIX}")
+
+
+def read_delta(kind, path, source_state):
+    """
+    上次合并之后追加的完整行，返回 (规范化后的表, 新的字节位置)；
+    结果表被截短或重写（不再是只追加）时返回 None
+    """
+    offset = source_state["offset"]
+    if os.path.getsize(path) < offset or _tail_hash(path, offset) != source_state["tail_sha256"]:
+        return None
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b"\n") + 1  # 最后一行可能还在写入，只合并完整的行
+    text = data[:end].decode("utf-8")
+    if not text.strip():
+        return empty_table(kind), offset + end
+    return read_table(kind, io.StringIO(text), header=False), offset + end
+
+
+def _merge_into(output, delta):
+    """把已排序的新行并入已有输出：同一 pair 的行合并（新的得分覆盖旧的，空值保留旧值），其余行原样复制"""
+    new_lines = io.StringIO()
+    delta.to_csv(new_lines, sep="\t", index=False, header=False)
+    new_lines.seek(0)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(output, "r", encoding="utf-8") as old, open(tmp, "w", encoding="utf-8") as out:
+        out.write(old.readline())
+        out.write(old.readline())
+        for _, group in itertools.groupby(heapq.merge(old, new_lines, key=_sort_key), key=_sort_key):
+            group = list(group)
+            if len(group) == 1:
+                out.write(group[0])
+                continue
+            fields = group[0].rstrip("\n").split("\t")
+            for line in group[1:]:
+                for i, value in enumerate(line.rstrip("\n").split("\t")):
+                    if value:
+                        fields[i] = value
+            out.write("\t".join(fields) + "\n")
+    os.replace(tmp, output)
+
+
+def merge_incremental(sources, output, chunksize=None, n_buckets=64, tmp_dir=None):
+    """
+    只合并各来源表在上次合并之后追加的行（见 ledger.py 的增量运行）。
+    没有状态文件、来源或列发生变化、或某个来源被重写时退回完整合并
+    """
+    state_path = f"{output}{STATE_SUFFIX}"
+    columns = ["ID1", "ID2"] + [SCORE_COLUMNS[kind] for kind, _ in sources]
+    state = None
+    if os.path.exists(state_path) and os.path.exists(output):
+        with open(state_path, "r") as f:
+            state = json.load(f)
+    if state is None or state["columns"] != columns:
+        print("🔄 没有可用的合并状态，执行完整合并")
+        merge_full(sources, output, chunksize, n_buckets, tmp_dir)
+        return
+
+    deltas = []
+    offsets = {}
+    for kind, path in sources:
+        result = read_delta(kind, path, state["sources"][kind])
+        if result is None:
+            print(f"🔄 {path} 在上次合并后被重写，执行完整合并")
+            merge_full(sources, output, chunksize, n_buckets, tmp_dir)
+            return
+        deltas.append(result[0])
+        offsets[kind] = result[1]
+
+    delta = merge_tables(deltas)
+    print(f"➕ 增量合并：{len(delta)} 个新增或更新的 pair")
+    if len(delta):
+        _merge_into(output, delta)
+    save_state(output, sources, offsets)
+
+
+def build_parser():
     parser = argparse.ArgumentParser(
         description="Merge MEGADOCK, HDOCK, and AlphaFold results into one table."
     )
@@ -51,65 +294,51 @@ def main():
     parser.add_argument("--hdock", help="Path to hdock.tsv file (optional)")
     parser.add_argument("--af", help="Path to AlphaFold af_c.tsv file (optional)")
     parser.add_argument("--output", required=True, help="Output TSV file name")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="Stream the inputs in chunks of this many rows for tables larger than memory")
+    parser.add_argument("--buckets", type=int, default=64,
+                        help="Number of on-disk hash partitions in streaming mode (each must fit in memory)")
+    parser.add_argument("--tmp_dir", default=None, help="Directory for streaming-mode partitions (default: system temp)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Merge only rows appended to the inputs since the last merge into the existing output")
+    parser.add_argument("--store", default=None,
+                        help="Also write a columnar score store (Arrow IPC, needs pyarrow) to this directory; "
+                             "query it with score_store.py")
+    return parser
 
-    args = parser.parse_args()
 
+def run(args):
+    """执行合并；没有输入文件时抛出 ValueError，合并出错时抛出原异常"""
     if not any([args.megadock, args.hdock, args.af]):
-        print("❌ 错误：请至少提供一个输入文件 (--megadock / --hdock / --af)")
-        sys.exit(1)
+        raise ValueError("请至少提供一个输入文件 (--megadock / --hdock / --af)")
 
-    dfs = []
-    merge_cols = ['ID1', 'ID2']
+    sources = []
+    for kind, label, path in (("megadock", "MEGADOCK", args.megadock), ("hdock", "HDOCK", args.hdock),
+                              ("af", "AlphaFold", args.af)):
+        if path and os.path.exists(path):
+            print(f"📄 读取 {label} 文件: {path}")
+            sources.append((kind, path))
 
-    try:
-        if args.megadock and os.path.exists(args.megadock):
-            print(f"📄 读取 MEGADOCK 文件: {args.megadock}")
-            megadock = pd.read_csv(args.megadock, sep="\t", header=None, names=["ID1", "ID2", "MEGADOCK_Score"])
-            megadock = normalize_ids(megadock)
-            dfs.append(megadock)
-
-        if args.hdock and os.path.exists(args.hdock):
-            print(f"📄 读取 HDOCK 文件: {args.hdock}")
-            hdock = pd.read_csv(args.hdock, sep="\t", header=None, names=["ID1", "ID2", "HDOCK_Score"])
-            hdock = normalize_ids(hdock)
-            dfs.append(hdock)
-
-        if args.af and os.path.exists(args.af):
-            print(f"📄 读取 AlphaFold 文件: {args.af}")
-            af = pd.read_csv(args.af, sep="\t")
-            af[['ID1', 'ID2']] = af['Pair'].str.split('-', expand=True)
-            af = normalize_ids(af)
-            af['Alphafold_pTM+ipTM'] = (af['PTM'] + af['IPTM']).round(2)
-            af = af[['ID1', 'ID2', 'Alphafold_pTM+ipTM']]
-            dfs.append(af)
-
-        # 合并文件
-        if len(dfs) == 1:
-            merged = dfs[0]
-        else:
-            merged = dfs[0]
-            for df in dfs[1:]:
-                merged = pd.merge(merged, df, on=merge_cols, how='outer')
-
-        # 排序
-        merged = merged.sort_values(by=["ID1", "ID2"], ignore_index=True)
-
-        # 输出文件
-        header_note = (
-            "MEGADOCK PPI Score > 12, 80% probability of interaction; "
-            "> 10, 50% probability of interaction; "
-            "> 8, 10% probability of interaction. "
-            "HDOCK docking score < -200, high probability of interaction. "
-            "pTM + ipTM > 0.75, indicating that the model's predictions of protein-protein interface "
-            "interactions and overall complex structure are highly reliable."
-        )
-
-        with open(args.output, "w", encoding="utf-8") as f:
-            f.write(header_note + "\n")
-            merged.to_csv(f, sep="\t", index=False)
-
-        print(f"✅ 合并完成，输出文件：{args.output}")
+    if args.incremental:
+        merge_incremental(sources, args.output, args.chunksize, args.buckets, args.tmp_dir)
+    else:
+        merge_full(sources, args.output, args.chunksize, args.buckets, args.tmp_dir)
+
+    if args.store:
+        from score_store import build_store
+        index = build_store(args.output, args.store)
+        print(f"📦 列式存储：{args.store}（{index['pairs']} 个 pair）")
+
+    print(f"✅ 合并完成，输出文件：{args.output}")
 
+
+def main():
+    args = build_parser().parse_args()
+    if not any([args.megadock, args.hdock, args.af]):
+        print("❌ 错误：请至少提供一个输入文件 (--megadock / --hdock / --af)")
+        sys.exit(1)
+    try:
+        run(args)
     except Exception as e:
         print(f"❌ 出错：{e}")
         sys.exit(1)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+pair_list.py
+
+功能说明：
+    所有步骤共用的 pair 列表读取。每个 pair 在规划任务之前先规范化为唯一形式：
+        1. ID 转为小写（与 AF3 输出目录名、单体 PDB 文件名一致）；
+        2. 两个 ID 按字母顺序排列，A B 与 B A 是同一个 pair；
+        3. 重复的 pair 只保留第一次出现的位置，其余行丢弃。
+    列数不足的行、以及给定 FASTA 时序列中不存在的 ID 会打印警告并跳过。
+    表头行（ID1 ID2）、空行和 # 开头的注释行被忽略。
+
+    MEGADOCK、HDOCK、AF3 复合物预测、DAG 调度和 merge_score.py 都使用同一个 canonical_pair，
+    各结果表中的 pair 因此可以直接对齐，不会重复计算。
+
+使用示例（检查并输出规范化后的列表）：
+    python pair_list.py -l Protein_pair.list -fa pep.fa -o Protein_pair.canonical.list
+"""
+
+import os
+import argparse
+
+
+def canonical_pair(id1, id2):
+    """规范化的 pair：小写，按字母顺序排列"""
+    id1, id2 = id1.lower(), id2.lower()
+    return (id1, id2) if id1 <= id2 else (id2, id1)
+
+
+def is_header(parts):
+    return [part.upper() for part in parts[:2]] == ["ID1", "ID2"]
+
+
+def read_pair_list(path, known_ids=None):
+    """
+    读取 pair 列表，返回规范化、去重后的 [(id1, id2), ...]，保持首次出现的顺序。
+    known_ids: 可选的合法 ID 集合（不区分大小写），含其他 ID 的 pair 被跳过
+    """
+    known = {pid.lower() for pid in known_ids} if known_ids is not None else None
+    pairs = []
+    seen = set()
+    n_lines = n_duplicate = n_invalid = 0
+    with open(path, "r") as f:
+        for line_no, line in enumerate(f, 1):
+            parts = line.split()
+            if not parts or parts[0].startswith("#") or is_header(parts):
+                continue
+            n_lines += 1
+            if len(parts) < 2:
+                print(f"[WARNING] {path}:{line_no}: expected two IDs, got '{line.strip()}', skipping...")
+                n_invalid += 1
+                continue
+            pair = canonical_pair(parts[0], parts[1])
+            if known is not None and (pair[0] not in known or pair[1] not in known):
+                print(f"[WARNING] Sequence missing for {parts[0]} or {parts[1]}, skipping...")
+                n_invalid += 1
+                continue
+            if pair in seen:
+                n_duplicate += 1
+                continue
+            seen.add(pair)
+            pairs.append(pair)
+
+    if n_duplicate or n_invalid:
+        print(f"[INFO] Pair list {os.path.basename(path)}: {n_lines} pairs → {len(pairs)} unique "
+              f"({n_duplicate} duplicate or reversed, {n_invalid} invalid)")
+    return pairs
+
+
+def select_known(pairs, known_ids):
+    """已读取的规范化 pair 列表中去掉含未知 ID 的 pair（与 read_pair_list 的 known_ids 相同）"""
+    known = {pid.lower() for pid in known_ids}
+    selected = []
+    for id1, id2 in pairs:
+        if id1 not in known or id2 not in known:
+            print(f"[WARNING] Sequence missing for {id1} or {id2}, skipping...")
+            continue
+        selected.append((id1, id2))
+    return selected
+
+
+def write_pair_list(path, pairs):
+    with open(path, "w") as f:
+        for id1, id2 in pairs:
+            f.write(f"{id1}\t{id2}\n")
+
+
+def main():
+    from fasta import open_fasta
+
+    parser = argparse.ArgumentParser(description="Canonicalise, deduplicate and validate a protein pair list")
+    parser.add_argument("-l", "--pair_list", required=True, help="Protein pair list file")
+    parser.add_argument("-fa", "--fasta", default=None, help="FASTA file; drop pairs with IDs missing from it")
+    parser.add_argument("-o", "--output", default=None, help="Write the canonical pair list here")
+    args = parser.parse_args()
+
+    known_ids = open_fasta(args.fasta) if args.fasta else None
+    pairs = read_pair_list(args.pair_list, known_ids)
+    if args.output:
+        write_pair_list(args.output, pairs)
+        print(f"[DONE] {len(pairs)} canonical pairs saved to {args.output}")
+    else:
+        print(f"[DONE] {len(pairs)} canonical pairs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+pipeline_dag.py
+
+功能说明：
+    run_pipeline.py 的依赖驱动调度（--scheduler dag）。各步骤不再串行等待：
+
+        单蛋白 AF3 ──► 每个 pair 的 MEGADOCK（GPU 池）
+                   ├─► 每个 pair 的 HDOCK（CPU 池）
+                   └─► 复合物 AF3（单蛋白 MSA 全部完成后）
+        全部完成 ──► 合并得分
+
+    单蛋白 AF3 在后台运行，调度器定期扫描 af_output/pdbs/，某个 pair 的两个单体 PDB
+    都出现后立即把它的 MEGADOCK 和 HDOCK 任务分别提交到各自的资源池。
+    PDB 由 cif2pdb/缓存以“临时文件 + rename”写入，扫描到的文件都是完整的。
+
+    --skip_* 参数对应去掉图中的节点：跳过单蛋白 AF3 时所有 pair 立即就绪（PDB 须已存在），
+    跳过某个对接步骤时不创建对应的资源池。
+    估算内存超过上限的对接任务（见 memory_model.py）不进入资源池，等普通任务完成后逐个运行。
+    两个 PDB 内容与已提交 pair 相同的 pair（见 dedup.py）不再提交，结束后复用代表 pair 的得分。
+    各对接任务在运行前查询任务账本（job_ledger.py，work_dir/jobs.sqlite），已完成且输入未变的任务直接读取结果。
+"""
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from queue import Queue
+
+import cache
+import ledger
+import run_hdock as hdock_runner
+import run_megadock as megadock_runner
+from dedup import report
+from memory_model import estimate_hdock, estimate_megadock, is_large
+from structure_index import build_index, choose_receptor_ligand, get_entry, save_index
+
+
+def list_pdb_ids(pdb_dir):
+    if not os.path.isdir(pdb_dir):
+        return set()
+    return {name[:-4] for name in os.listdir(pdb_dir) if name.endswith(".pdb")}
+
+
+def run_step(stage, description, errors):
+    """在本进程中运行一个流水线步骤；失败时记录到 errors，返回是否成功"""
+    try:
+        stage()
+    except Exception as e:
+        print(f"[ERROR] {description} failed: {e}")
+        errors.append(f"{description} failed: {e}")
+        return False
+    return True
+
+
+def start_megadock_pool(args, pdb_dir, output_dir):
+    """MEGADOCK 资源池：每个 worker 一个设备槽位（--megadock_persistent 时附带常驻容器）"""
+    devices = megadock_runner.parse_devices(args.megadock_devices)
+    workers = args.megadock_workers or (len(devices) if devices else 1)
+    omp_threads = max(1, args.megadock_cpu_cores // workers)
+    slots = Queue()
+    containers = []
+    for i, device in enumerate(megadock_runner.build_device_slots(workers, devices)):
+        container = None
+        if args.megadock_persistent:
+            container = megadock_runner.start_megadock_container(
+                f"megadock-{os.getpid()}-{i}", pdb_dir, output_dir,
+                args.megadock_docker_image, omp_threads, device
+            )
+            containers.append(container)
+        slots.put((device, container))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    print(f"[INFO] MEGADOCK pool: {workers} workers, OMP_NUM_THREADS={omp_threads} per job")
+    return executor, slots, containers, omp_threads
+
+
+def run_dag(args, paths, data, single_af=None, complex_af=None, poll_interval=30):
+    """
+    按依赖关系执行单蛋白 AF3、MEGADOCK、HDOCK 和复合物 AF3。
+
+    data:       ppi_prediction.PipelineData，提供已读取的 pair 列表
+    single_af:  运行单蛋白 AF3 的函数（None 表示跳过），在后台线程中调用
+    complex_af: 运行复合物 AF3 的函数，在单蛋白步骤结束后调用（None 表示跳过）
+    任一步骤失败时在其余步骤完成后抛出 RuntimeError
+    """
+    pdb_dir = os.path.join(paths["af_output_dir"], "pdbs")
+    os.makedirs(pdb_dir, exist_ok=True)
+    pending = list(data.pairs) if not (args.skip_megadock and args.skip_hdock) else []
+    # 增量运行：各对接步骤只运行账本中没有的 pair
+    done_megadock = set()
+    done_hdock = set()
+    if args.incremental:
+        if not args.skip_megadock:
+            done_megadock = ledger.read_ledger(paths["megadock_result"])
+        if not args.skip_hdock:
+            done_hdock = ledger.read_ledger(paths["hdock_result"])
+        pending = ledger.select_pending(
+            pending,
+            {pair for pair in pending if (args.skip_megadock or pair in done_megadock)
+             and (args.skip_hdock or pair in done_hdock)},
+            "docking",
+        )
+    print(f"[INFO] DAG scheduler: {len(pending)} docking pairs")
+
+    # AF3 链：单蛋白 → 复合物，在后台线程中顺序执行；单蛋白结束时设置 single_af_done
+    errors = []
+    single_af_done = threading.Event()
+
+    def run_alphafold_steps():
+        ok = True
+        try:
+            if single_af:
+                ok = run_step(single_af, "AlphaFold3 single-protein prediction", errors)
+        finally:
+            single_af_done.set()
+        if ok and complex_af:
+            run_step(complex_af, "AlphaFold3 complex prediction", errors)
+
+    af_thread = threading.Thread(target=run_alphafold_steps, daemon=True)
+    af_thread.start()
+
+    structures = build_index(pdb_dir, paths["structure_index"])
+
+    megadock_pool = None
+    containers = []
+    hdock_pool = None
+    megadock_futures = []
+    hdock_futures = []
+    large_megadock = []
+    large_hdock = []
+    representative = {}
+    aliases = {}
+    n_ready = 0
+    try:
+        if not args.skip_megadock:
+            megadock_pool, slots, containers, omp_threads = start_megadock_pool(
+                args, pdb_dir, paths["megadock_output_dir"]
+            )
+        if not args.skip_hdock:
+            executor_cls = ProcessPoolExecutor if args.hdock_executor == "process" else ThreadPoolExecutor
+            hdock_pool = executor_cls(max_workers=args.hdock_threads)
+            hdock_task = hdock_runner.run_hdock_task if args.hdock_executor == "process" else hdock_runner.run_hdock_on_pair
+            print(f"[INFO] HDOCK pool: {args.hdock_threads} {args.hdock_executor} workers")
+
+        while True:
+            single_af_finished = single_af_done.is_set()
+            available = list_pdb_ids(pdb_dir)
+            still_pending = []
+            for id1, id2 in pending:
+                if id1 not in available or id2 not in available:
+                    still_pending.append((id1, id2))
+                    continue
+                entries = {pid: get_entry(structures, pdb_dir, pid) for pid in (id1, id2)}
+                n_ready += 1
+                run_megadock = megadock_pool is not None and (id1, id2) not in done_megadock
+                run_hdock = hdock_pool is not None and (id1, id2) not in done_hdock
+                key = (tuple(sorted(entries[pid]["sha256"] for pid in (id1, id2))), run_megadock, run_hdock)
+                if key in representative:
+                    aliases[(id1, id2)] = representative[key]
+                    continue
+                representative[key] = (id1, id2)
+                if run_megadock:
+                    megadock_args = (
+                        slots, os.path.join(pdb_dir, f"{id1}.pdb"), os.path.join(pdb_dir, f"{id2}.pdb")
+                    )
+                    megadock_kwargs = dict(
+                        output_dir=paths["megadock_output_dir"],
+                        pdb_dir=pdb_dir,
+                        docker_image=args.megadock_docker_image,
+                        n_decoys=args.megadock_decoys,
+                        t=args.megadock_fft_threads,
+                        cpu_cores=omp_threads,
+                        cache_dir=args.cache_dir,
+                        structures=entries,
+                    )
+                    if is_large(*estimate_megadock(entries[id1], entries[id2])):
+                        print(f"[INFO] MEGADOCK {id1}-{id2}: moved to the large-job queue")
+                        large_megadock.append(((id1, id2), megadock_args, megadock_kwargs))
+                    else:
+                        megadock_futures.append(((id1, id2), megadock_pool.submit(
+                            megadock_runner.run_megadock_in_slot, *megadock_args, **megadock_kwargs
+                        )))
+                if run_hdock:
+                    hdock_args = (id1, id2, pdb_dir, paths["hdock_output_dir"], args.hdock_path)
+                    hdock_kwargs = dict(
+                        cache_dir=args.cache_dir,
+                        structures=entries,
+                        model_threshold=args.hdock_model_threshold,
+                        build_model=args.hdock_all_models,
+                    )
+                    if is_large(*estimate_hdock(entries[id1], entries[id2])):
+                        print(f"[INFO] HDOCK {id1}-{id2}: moved to the large-job queue")
+                        large_hdock.append(((id1, id2), hdock_args, hdock_kwargs))
+                    else:
+                        hdock_futures.append(((id1, id2), hdock_pool.submit(hdock_task, *hdock_args, **hdock_kwargs)))
+            if len(still_pending) != len(pending):
+                print(f"[INFO] DAG scheduler: {len(pending) - len(still_pending)} pairs ready, "
+                      f"{len(still_pending)} waiting for monomer structures")
+            pending = still_pending
+
+            # 单蛋白步骤结束后的这一轮扫描是最后一次
+            if single_af_finished or not pending:
+                break
+            time.sleep(poll_interval)
+
+        for id1, id2 in pending:
+            print(f"[WARNING] Missing PDB file for pair: {id1}, {id2}")
+        report("docking pairs", n_ready, len(representative))
+
+        megadock_results = []
+        megadock_scores = {}
+        for pair, future in megadock_futures:
+            try:
+                R, L, score = future.result()
+            except Exception as e:
+                print(f"[ERROR] MEGADOCK task failed: {e}")
+                continue
+            if score is not None:
+                megadock_results.append(f"{R}\t{L}\t{score:.4f}")
+                megadock_scores[pair] = score
+
+        hdock_results = []
+        hdock_by_pair = {}
+        for pair, future in hdock_futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"[ERROR] HDOCK task failed: {e}")
+                continue
+            if result:
+                hdock_results.append(result)
+                hdock_by_pair[pair] = result
+
+        # 大任务队列：普通任务全部完成后逐个运行
+        for pair, task_args, task_kwargs in large_megadock:
+            try:
+                R, L, score = megadock_runner.run_megadock_in_slot(*task_args, **task_kwargs)
+            except Exception as e:
+                print(f"[ERROR] MEGADOCK task failed: {e}")
+                continue
+            if score is not None:
+                megadock_results.append(f"{R}\t{L}\t{score:.4f}")
+                megadock_scores[pair] = score
+        for pair, task_args, task_kwargs in large_hdock:
+            try:
+                result = hdock_runner.run_hdock_on_pair(*task_args, **task_kwargs)
+            except Exception as e:
+                print(f"[ERROR] HDOCK task failed: {e}")
+                continue
+            if result:
+                hdock_results.append(result)
+                hdock_by_pair[pair] = result
+
+        # 重复的 pair 复用代表 pair 的得分
+        for alias, rep in aliases.items():
+            R, L, _, _ = choose_receptor_ligand(structures, pdb_dir, *alias)
+            if rep in megadock_scores:
+                megadock_results.append(f"{R}\t{L}\t{megadock_scores[rep]:.4f}")
+            if rep in hdock_by_pair:
+                hdock_results.append((R, L) + hdock_by_pair[rep][2:])
+    finally:
+        if megadock_pool:
+            megadock_pool.shutdown(wait=True)
+        if hdock_pool:
+            hdock_pool.shutdown(wait=True)
+        for container in containers:
+            megadock_runner.stop_megadock_container(container)
+
+    if not args.skip_megadock:
+        megadock_runner.write_results(megadock_results, paths["megadock_result"], append=args.incremental)
+        print(f"[INFO] MEGADOCK results: {len(megadock_results)} pairs → {paths['megadock_result']}")
+    if not args.skip_hdock:
+        hdock_runner.write_results(hdock_results, paths["hdock_result"], append=args.incremental)
+        try:
+            os.rmdir(os.path.join(paths["hdock_output_dir"], hdock_runner.SCRATCH_DIR))
+        except OSError:
+            pass
+        print(f"[INFO] HDOCK results: {len(hdock_results)} pairs → {paths['hdock_result']}")
+
+    save_index(structures, paths["structure_index"], pdb_dir)
+    if args.cache_dir:
+        cache.flush_stats(args.cache_dir)
+        if args.cache_max_gb:
+            cache.evict(args.cache_dir, int(args.cache_max_gb * 1024 ** 3))
+
+    af_thread.join()
+    if errors:
+        raise RuntimeError("; ".join(errors))
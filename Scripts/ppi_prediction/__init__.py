@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+"""
+ppi_prediction
+
+功能说明：
+    在同一进程中调用流水线各步骤的接口（run_pipeline.py 使用），各步骤共用已读取的
+    FASTA、pair 列表和结构索引。Scripts/ 下的 run_*.py、merge_score.py 仍是各步骤的命令行入口，
+    它们与本包调用同一个 run()。
+
+使用示例（Scripts/ 需在 sys.path 中，例如 PYTHONPATH=Scripts）：
+    from ppi_prediction import PipelineData, fold_monomers, dock_megadock, dock_hdock, fold_complexes, merge
+
+    data = PipelineData("Protein_pair.list", "pep.fa", structure_index="work/structure_index.tsv")
+    pdb_dir = fold_monomers(data, "work/af_json", "work/af_output", "af3_params", "af3_db")
+    dock_megadock(data, pdb_dir, "work/megadock_out", "work/megadock.tsv", persistent=True)
+    dock_hdock(data, pdb_dir, "work/hdock_out", "work/hdock.tsv", threads=16)
+    fold_complexes(data, "work/af_complex_json", "work/af_complex_out", "af3_params", "af3_db",
+                   "work/af_complex.tsv", msa_dir=["work/af_output"])
+    merge("work/merged_scores.tsv", megadock="work/megadock.tsv", hdock="work/hdock.tsv", af="work/af_complex.tsv")
+"""
+
+from .stages import PipelineData, dock_hdock, dock_megadock, fold_complexes, fold_monomers, merge
+
+__all__ = ["PipelineData", "fold_monomers", "dock_megadock", "dock_hdock", "fold_complexes", "merge"]
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+ppi_prediction/stages.py
+
+功能说明：
+    流水线五个步骤的进程内接口。每个函数用对应脚本的命令行默认值补全参数，
+    再调用脚本的 run()，行为与命令行运行该脚本相同，但：
+        1. FASTA 序列和规范化的 pair 列表由 PipelineData 读取一次，各步骤共用；
+        2. 结构索引按 PDB 目录缓存，MEGADOCK 和 HDOCK 共用，不必各自重新 stat / 解析 PDB；
+           跳过单蛋白预测时，复合物预测通过 FASTA 索引只读取 pair 中的序列；
+        3. 失败时抛出异常（ValueError / RuntimeError 等），而不是 sys.exit。
+    **options 为脚本命令行参数的 dest 名（如 num_workers、persistent_worker、cache_dir），
+    拼错的参数名抛出 TypeError。
+"""
+
+import os
+import argparse
+from functools import cached_property
+
+import merge_score
+import run_alphafold3
+import run_alphafold3_complex
+import run_hdock
+import run_megadock
+from fasta import FastaIndex, open_fasta, parse_fasta
+from pair_list import read_pair_list
+from structure_index import build_index
+
+
+class PipelineData:
+    """
+    各步骤共用的输入数据，在第一次用到时读取。
+    pair_list:       pair 列表文件（MEGADOCK、HDOCK、复合物 AF3）
+    fasta:           FASTA 文件（单蛋白和复合物 AF3）
+    structure_index: 结构索引文件，跨运行复用（可选）
+    """
+
+    def __init__(self, pair_list: str | None = None, fasta: str | None = None,
+                 structure_index: str | None = None):
+        self.pair_list = pair_list
+        self.fasta = fasta
+        self.structure_index = structure_index
+        self._structures: dict[str, dict[str, dict]] = {}
+
+    @cached_property
+    def sequences(self) -> dict[str, str]:
+        """全部 {ID: 序列}，ID 保持 FASTA 中的大小写（单蛋白预测）"""
+        return parse_fasta(self.fasta)
+
+    @cached_property
+    def fasta_index(self) -> FastaIndex:
+        """FASTA 的 faidx 索引，按 ID 读取单条序列"""
+        return open_fasta(self.fasta)
+
+    def sequence_source(self) -> dict[str, str] | FastaIndex:
+        """已读取全部序列时直接使用，否则按需从索引读取（复合物预测只需 pair 中的序列）"""
+        return self.__dict__.get("sequences") or self.fasta_index
+
+    @cached_property
+    def pairs(self) -> list[tuple[str, str]]:
+        """规范化、去重后的 pair 列表（pair_list.read_pair_list）"""
+        return read_pair_list(self.pair_list)
+
+    def structures(self, pdb_dir: str) -> dict[str, dict]:
+        """pdb_dir 的结构索引；同一目录只建立一次"""
+        pdb_dir = os.path.abspath(pdb_dir)
+        if pdb_dir not in self._structures:
+            self._structures[pdb_dir] = build_index(pdb_dir, self.structure_index)
+        return self._structures[pdb_dir]
+
+    def forget_structures(self, pdb_dir: str) -> None:
+        """pdb_dir 中的 PDB 有变化（例如单蛋白预测刚写入新的结构），下次使用时重新建立索引"""
+        self._structures.pop(os.path.abspath(pdb_dir), None)
+
+
+def _namespace(module, **values) -> argparse.Namespace:
+    """脚本命令行参数的默认值 + values；未知的参数名抛出 TypeError"""
+    parser = module.build_parser()
+    defaults = {action.dest: action.default for action in parser._actions if action.dest != "help"}
+    unknown = sorted(set(values) - set(defaults))
+    if unknown:
+        raise TypeError(f"Unknown {module.__name__} options: {', '.join(unknown)}")
+    defaults.update(values)
+    return argparse.Namespace(**defaults)
+
+
+def fold_monomers(data: PipelineData, json_dir: str, output_dir: str, parameter_dir: str, database_dir: str,
+                  step: str = "Prediction", **options) -> str:
+    """单蛋白 AlphaFold3（run_alphafold3.py）；返回单体 PDB 目录 OUTPUT_DIR/pdbs"""
+    args = _namespace(run_alphafold3, step=step, fasta=data.fasta, json_dir=json_dir, output_dir=output_dir,
+                      parameter_dir=parameter_dir, database_dir=database_dir, **options)
+    # Inference 从 json_dir 中的 _data.json 读取序列
+    run_alphafold3.run(args, sequences=data.sequences if step != "Inference" and data.fasta else None)
+    pdb_dir = os.path.join(output_dir, "pdbs")
+    data.forget_structures(pdb_dir)
+    return pdb_dir
+
+
+def dock_megadock(data: PipelineData, pdb_dir: str, output_dir: str, result_file: str,
+                  n_decoys: int = 10800, fft_threads: int = 3, cpu_cores: int = 32, **options) -> str:
+    """MEGADOCK 对接（run_megadock.py）；返回结果文件路径"""
+    args = _namespace(run_megadock, pair_list=data.pair_list, pdb_dir=pdb_dir, output_dir=output_dir,
+                      result_file=result_file, N=n_decoys, t=fft_threads, e=cpu_cores,
+                      structure_index=data.structure_index, **options)
+    run_megadock.run(args, pairs=data.pairs, structures=data.structures(pdb_dir))
+    return result_file
+
+
+def dock_hdock(data: PipelineData, pdb_dir: str, output_dir: str, result_file: str, **options) -> str:
+    """HDOCK 对接（run_hdock.py）；返回结果文件路径"""
+    args = _namespace(run_hdock, pair_list=data.pair_list, pdb_dir=pdb_dir, output_dir=output_dir,
+                      result_file=result_file, structure_index=data.structure_index, **options)
+    run_hdock.run(args, pairs=data.pairs, structures=data.structures(pdb_dir))
+    return result_file
+
+
+def fold_complexes(data: PipelineData, json_dir: str, output_dir: str, model_dir: str, database_dir: str,
+                   outfile: str, **options) -> str:
+    """复合物 AlphaFold3（run_alphafold3_complex.py）；返回 ptm/iptm 结果文件路径"""
+    args = _namespace(run_alphafold3_complex, pair_list=data.pair_list, fasta=data.fasta, json_dir=json_dir,
+                      output_dir=output_dir, model_dir=model_dir, database_dir=database_dir, outfile=outfile,
+                      **options)
+    run_alphafold3_complex.run(args, sequences=data.sequence_source(), pairs=data.pairs)
+    return outfile
+
+
+def merge(output: str, megadock: str | None = None, hdock: str | None = None, af: str | None = None,
+          **options) -> str:
+    """合并各步骤的得分表（merge_score.py）；返回合并结果路径"""
+    args = _namespace(merge_score, output=output, megadock=megadock, hdock=hdock, af=af, **options)
+    merge_score.run(args)
+    return output
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+resources.py
+
+功能说明：
+    跨进程的 CPU / GPU / 内存令牌池。各脚本在启动 AlphaFold3、MEGADOCK、HDOCK 等子进程前
+    先申请资源，运行结束后归还；同一节点上同时运行的多个 run_pipeline.py 共用同一个资源目录，
+    从而不会互相超额占用机器。
+
+    通过 --resource_dir 或环境变量 PPI_RESOURCE_DIR 启用；未设置时 reserve() 不做任何限制。
+    资源目录应位于本机磁盘（flock 在部分 NFS 上不可靠），目录结构：
+        resource_dir/
+        ├── limits.json   资源总量（首次使用时按本机自动探测，可用 init 子命令修改）
+        ├── state.json    当前租约和等待队列
+        └── lock          flock 互斥锁
+
+    分配规则：
+        请求按到达顺序排队；只有在满足所有更早等待者之后仍有余量时才会分配，
+        大任务不会被持续到来的小任务饿死。
+        持有租约的进程退出（包括被 kill）后，其租约在下一次分配时自动回收。
+
+使用示例：
+    python resources.py init -r /var/tmp/ppi_resources --cpus 64 --gpus 0,1,2,3 --mem_gb 480 --gpu_mem_gb 80
+    python resources.py status -r /var/tmp/ppi_resources
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import fcntl
+import socket
+import argparse
+import subprocess
+from contextlib import contextmanager
+
+ENV_VAR = "PPI_RESOURCE_DIR"
+LIMITS_FILE = "limits.json"
+STATE_FILE = "state.json"
+LOCK_FILE = "lock"
+POLL_SECONDS = 2.0
+
+_resource_dir = None
+
+
+def configure(resource_dir=None):
+    """启用资源池；同时写入环境变量，使子进程（其他脚本）加入同一个资源池"""
+    global _resource_dir
+    resource_dir = resource_dir or os.environ.get(ENV_VAR)
+    if resource_dir:
+        resource_dir = os.path.abspath(resource_dir)
+        os.makedirs(resource_dir, exist_ok=True)
+        os.environ[ENV_VAR] = resource_dir
+    _resource_dir = resource_dir
+    return resource_dir
+
+
+def get_resource_dir():
+    return _resource_dir or os.environ.get(ENV_VAR)
+
+
+def detect_limits():
+    """探测本机 CPU 核数、GPU 编号、显存和内存"""
+    gpu_mem_gb = {}
+    try:
+        out = subprocess.run(["nvidia-smi", "--query-gpu=index,memory.total", "--format=csv,noheader,nounits"],
+                             capture_output=True, text=True, timeout=30)
+        if out.returncode == 0:
+            for line in out.stdout.splitlines():
+                parts = [p.strip() for p in line.split(",")]
+                if len(parts) == 2 and parts[0]:
+                    gpu_mem_gb[parts[0]] = int(parts[1]) // 1024
+    except (OSError, subprocess.TimeoutExpired, ValueError):
+        pass
+
+    mem_gb = 0
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    mem_gb = int(line.split()[1]) // (1024 * 1024)
+                    break
+    except OSError:
+        pass
+
+    return {"cpu": os.cpu_count() or 1, "mem_gb": mem_gb, "gpus": {gpu: 1 for gpu in gpu_mem_gb},
+            "gpu_mem_gb": gpu_mem_gb}
+
+
+@contextmanager
+def _locked(resource_dir):
+    fd = os.open(os.path.join(resource_dir, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def _read_json(path, default):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def load_limits(resource_dir):
+    """读取资源总量；首次使用时写入自动探测的结果（调用方需持有锁）"""
+    path = os.path.join(resource_dir, LIMITS_FILE)
+    limits = _read_json(path, None)
+    if limits is None:
+        limits = detect_limits()
+        _write_json(path, limits)
+    return limits
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _reap(state):
+    """回收本机上已退出进程的租约和等待记录"""
+    host = socket.gethostname()
+    for section in ("leases", "waiters"):
+        for key in list(state[section]):
+            record = state[section][key]
+            if record["host"] == host and not _pid_alive(record["pid"]):
+                del state[section][key]
+
+
+def _free_pool(limits, leases):
+    cpu = limits["cpu"] - sum(lease["cpu"] for lease in leases)
+    mem_gb = limits["mem_gb"] - sum(lease["mem_gb"] for lease in leases)
+    gpus = dict(limits["gpus"])
+    # 未配置显存（旧版 limits.json）的 GPU 不限制显存
+    gpu_mem_gb = {gpu: limits.get("gpu_mem_gb", {}).get(gpu, float("inf")) for gpu in gpus}
+    for lease in leases:
+        for gpu in lease["gpu_ids"]:
+            if gpu in gpus:
+                gpus[gpu] -= 1
+                gpu_mem_gb[gpu] -= lease.get("gpu_mem_gb", 0)
+    return {"cpu": cpu, "mem_gb": mem_gb, "gpus": gpus, "gpu_mem_gb": gpu_mem_gb}
+
+
+def _take(pool, request):
+    """从 pool 中扣除 request；资源不足时返回 None，否则返回分配到的 GPU 编号"""
+    if request["cpu"] > pool["cpu"] or request["mem_gb"] > pool["mem_gb"]:
+        return None
+    gpu_ids = []
+    if request["gpus"]:
+        def fits(gpu):
+            return pool["gpus"].get(gpu, 0) > 0 and pool["gpu_mem_gb"].get(gpu, 0) >= request["gpu_mem_gb"]
+        if request["device"] is not None:
+            candidates = [request["device"]] if fits(request["device"]) else []
+        else:
+            # 优先选择空闲槽位最多、其次空闲显存最多的 GPU
+            candidates = sorted((g for g in pool["gpus"] if fits(g)),
+                                key=lambda g: (-pool["gpus"][g], -pool["gpu_mem_gb"][g]))
+        if len(candidates) < request["gpus"]:
+            return None
+        gpu_ids = candidates[:request["gpus"]]
+    pool["cpu"] -= request["cpu"]
+    pool["mem_gb"] -= request["mem_gb"]
+    for gpu in gpu_ids:
+        pool["gpus"][gpu] -= 1
+        pool["gpu_mem_gb"][gpu] -= request["gpu_mem_gb"]
+    return gpu_ids
+
+
+def _hold(pool, request):
+    """为暂时无法满足的更早等待者预留资源（可以扣成负数），后到的请求不能占用"""
+    pool["cpu"] -= request["cpu"]
+    pool["mem_gb"] -= request["mem_gb"]
+    if request["device"] is not None:
+        held = [request["device"]] if request["gpus"] else []
+    else:
+        held = [g for g, n in pool["gpus"].items() if n > 0][:request["gpus"]]
+    for gpu in held:
+        pool["gpus"][gpu] = pool["gpus"].get(gpu, 0) - 1
+        pool["gpu_mem_gb"][gpu] = pool["gpu_mem_gb"].get(gpu, 0) - request["gpu_mem_gb"]
+
+
+def _try_grant(limits, state, waiter_id):
+    """更早的等待者先占用资源，剩余部分足够时才分配给 waiter_id"""
+    pool = _free_pool(limits, state["leases"].values())
+    for key, waiter in sorted(state["waiters"].items(), key=lambda item: item[1]["since"]):
+        gpu_ids = _take(pool, waiter)
+        if key == waiter_id:
+            return gpu_ids
+        if gpu_ids is None:
+            _hold(pool, waiter)
+    return None
+
+
+def _normalize_request(limits, cpu, gpus, mem_gb, device, gpu_mem_gb=0):
+    """
+    把请求限制在资源总量以内，避免永远无法满足；未配置 GPU 时不计 GPU。
+    超过总量的请求被截断为总量，即独占该资源（大任务队列依赖这一点）。
+    """
+    if device is not None and str(device).lower() == "all":
+        device = None
+    if device is not None and str(device) not in limits["gpus"]:
+        device = None
+    gpu_totals = list(limits.get("gpu_mem_gb", {}).values())
+    if device is not None and str(device) in limits.get("gpu_mem_gb", {}):
+        gpu_totals = [limits["gpu_mem_gb"][str(device)]]
+    gpus = min(max(0, int(gpus)), len(limits["gpus"]))
+    return {
+        "cpu": min(max(0, int(cpu)), limits["cpu"]),
+        "mem_gb": min(max(0.0, float(mem_gb)), limits["mem_gb"]) if limits["mem_gb"] else 0.0,
+        "gpus": gpus,
+        "gpu_mem_gb": min(max(0.0, float(gpu_mem_gb)), max(gpu_totals)) if gpus and gpu_totals else 0.0,
+        "device": str(device) if device is not None else None,
+    }
+
+
+def get_limits():
+    """资源池总量；未启用资源池时返回本机探测结果"""
+    resource_dir = get_resource_dir()
+    if not resource_dir:
+        return detect_limits()
+    os.makedirs(resource_dir, exist_ok=True)
+    with _locked(resource_dir):
+        return load_limits(resource_dir)
+
+
+@contextmanager
+def reserve(cpu=0, gpus=0, mem_gb=0, device=None, label="", gpu_mem_gb=0):
+    """
+    申请资源，阻塞直到满足；with 块结束时归还。
+
+    device: 指定 GPU 编号（None 或 "all" 表示任意 GPU）
+    gpu_mem_gb: 每块 GPU 需要的显存；分配的 GPU 空闲显存必须足够
+    yield:  实际使用的 GPU 编号（申请了 GPU 时），否则原样返回 device；
+            未启用资源池时直接返回 device
+    """
+    resource_dir = get_resource_dir()
+    if not resource_dir:
+        yield device
+        return
+
+    os.makedirs(resource_dir, exist_ok=True)
+    state_path = os.path.join(resource_dir, STATE_FILE)
+    lease_id = uuid.uuid4().hex
+    host = socket.gethostname()
+
+    with _locked(resource_dir):
+        limits = load_limits(resource_dir)
+        request = _normalize_request(limits, cpu, gpus, mem_gb, device, gpu_mem_gb)
+        state = _read_json(state_path, {"leases": {}, "waiters": {}})
+        state["waiters"][lease_id] = dict(request, pid=os.getpid(), host=host, label=label, since=time.time())
+        _write_json(state_path, state)
+
+    granted = None
+    announced = False
+    try:
+        while granted is None:
+            with _locked(resource_dir):
+                state = _read_json(state_path, {"leases": {}, "waiters": {}})
+                _reap(state)
+                state["waiters"].setdefault(lease_id, dict(request, pid=os.getpid(), host=host, label=label,
+                                                           since=time.time()))
+                gpu_ids = _try_grant(limits, state, lease_id)
+                if gpu_ids is not None:
+                    del state["waiters"][lease_id]
+                    state["leases"][lease_id] = {
+                        "cpu": request["cpu"], "mem_gb": request["mem_gb"], "gpu_ids": gpu_ids,
+                        "gpu_mem_gb": request["gpu_mem_gb"],
+                        "pid": os.getpid(), "host": host, "label": label, "since": time.time(),
+                    }
+                    granted = gpu_ids
+                _write_json(state_path, state)
+            if granted is None:
+                if not announced:
+                    print(f"[WAIT] {label or 'job'}: waiting for resources "
+                          f"(cpu={request['cpu']}, gpus={request['gpus']}, mem={request['mem_gb']:.0f}G, "
+                          f"gpu_mem={request['gpu_mem_gb']:.0f}G)")
+                    announced = True
+                time.sleep(POLL_SECONDS)
+    finally:
+        if granted is None:
+            with _locked(resource_dir):
+                state = _read_json(state_path, {"leases": {}, "waiters": {}})
+                state["waiters"].pop(lease_id, None)
+                _write_json(state_path, state)
+
+    try:
+        if request["gpus"]:
+            yield granted[0] if len(granted) == 1 else ",".join(granted)
+        else:
+            yield device
+    finally:
+        with _locked(resource_dir):
+            state = _read_json(state_path, {"leases": {}, "waiters": {}})
+            state["leases"].pop(lease_id, None)
+            _write_json(state_path, state)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or configure the shared CPU/GPU/memory resource pool")
+    parser.add_argument("command", choices=["status", "init"], help="status: show leases; init: set resource limits")
+    parser.add_argument("-r", "--resource_dir", default=os.environ.get(ENV_VAR),
+                        help=f"Resource pool directory (default: ${ENV_VAR})")
+    parser.add_argument("--cpus", type=int, default=None, help="CPU cores in the pool (init)")
+    parser.add_argument("--gpus", default=None, help="Comma-separated GPU IDs in the pool, or 'none' (init)")
+    parser.add_argument("--gpu_slots", type=int, default=1, help="Concurrent jobs allowed per GPU (init)")
+    parser.add_argument("--mem_gb", type=float, default=None, help="Host memory in the pool, in GB (init)")
+    parser.add_argument("--gpu_mem_gb", type=float, default=None, help="Memory of each GPU in the pool, in GB (init)")
+    args = parser.parse_args()
+
+    if not args.resource_dir:
+        print(f"[ERROR] --resource_dir or ${ENV_VAR} is required.")
+        sys.exit(1)
+    os.makedirs(args.resource_dir, exist_ok=True)
+
+    with _locked(args.resource_dir):
+        limits = load_limits(args.resource_dir)
+        if args.command == "init":
+            if args.cpus is not None:
+                limits["cpu"] = args.cpus
+            if args.mem_gb is not None:
+                limits["mem_gb"] = args.mem_gb
+            if args.gpus is not None:
+                ids = [] if args.gpus.lower() == "none" else [g.strip() for g in args.gpus.split(",") if g.strip()]
+                detected = limits.get("gpu_mem_gb", {})
+                limits["gpus"] = {gpu: args.gpu_slots for gpu in ids}
+                limits["gpu_mem_gb"] = {gpu: detected[gpu] for gpu in ids if gpu in detected}
+            if args.gpu_mem_gb is not None:
+                limits["gpu_mem_gb"] = {gpu: args.gpu_mem_gb for gpu in limits["gpus"]}
+            _write_json(os.path.join(args.resource_dir, LIMITS_FILE), limits)
+        state = _read_json(os.path.join(args.resource_dir, STATE_FILE), {"leases": {}, "waiters": {}})
+        _reap(state)
+
+    free = _free_pool(limits, state["leases"].values())
+    print(f"CPU\t{free['cpu']}/{limits['cpu']} free")
+    print(f"Memory\t{free['mem_gb']:.0f}/{limits['mem_gb']:.0f} GB free")
+    for gpu in sorted(limits["gpus"]):
+        mem_text = ""
+        if gpu in limits.get("gpu_mem_gb", {}):
+            mem_text = f", {free['gpu_mem_gb'][gpu]:.0f}/{limits['gpu_mem_gb'][gpu]:.0f} GB free"
+        print(f"GPU {gpu}\t{free['gpus'][gpu]}/{limits['gpus'][gpu]} slots free{mem_text}")
+    print(f"Leases\t{len(state['leases'])}\tWaiting\t{len(state['waiters'])}")
+    for lease in sorted(state["leases"].values(), key=lambda x: x["since"]):
+        gpu_text = ",".join(lease["gpu_ids"]) or "-"
+        print(f"  {lease['host']}:{lease['pid']}\tcpu={lease['cpu']}\tgpu={gpu_text}\t"
+              f"mem={lease['mem_gb']:.0f}G\tgpu_mem={lease.get('gpu_mem_gb', 0):.0f}G\t{lease['label']}")
+
+
+if __name__ == "__main__":
+    main()
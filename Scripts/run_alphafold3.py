@@ -4,32 +4,30 @@
 import os
 import argparse
 import json
-import subprocess
 import shutil
 import sys
+import threading
+from queue import Queue
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def parse_fasta(fasta_file):
-    sequences = {}
-    with open(fasta_file, "r") as file:
-        protein_id = None
-        sequence = []
-        for line in file:
-            line = line.strip()
-            if line.startswith(">"):
-                if protein_id:
-                    sequences[protein_id] = "".join(sequence)
-                protein_id = line[1:].split()[0]
-                sequence = []
-            else:
-                sequence.append(line)
-        if protein_id:
-            sequences[protein_id] = "".join(sequence)
-    return sequences
+from af3_worker import (af3_command, af3_cpus, data_file, make_scratch_dir, model_file, output_complete,
+                        parse_devices, publish_output, remove_scratch_dir, run_inference_workers)
+from cif2pdb import convert_cif_to_pdb
+from dedup import DEDUP_FILE, dedup, invert, link_file, link_output_dir, read_aliases, report, write_aliases
+from fasta import parse_fasta
+from job_scheduler import estimate_seconds, lpt_order, report_schedule
+from memory_model import AF3_UNIFIED_MEMORY_ENV, estimate_af3, is_large, split_large
+import cache
+import command_runner
+import job_ledger
+import resources
+
+MODEL_SEEDS = [1]
+CACHE_NAMESPACE = "af3_monomer"
 
 def convert_to_json_format(protein_id, sequence):
     return {
-        "modelSeeds": [1],
+        "modelSeeds": MODEL_SEEDS,
         "dialect": "alphafold3",
         "version": 1,
         "name": protein_id,
@@ -43,9 +41,32 @@ def convert_to_json_format(protein_id, sequence):
         ]
     }
 
-def run_docker_on_json(json_path, output_path, model_dir, db_dir, docker_image="alphafold3", step="Prediction", pdbs_dir=None):
+def ledger_job(step, protein_id, output_path):
+    """任务账本中的 (步骤名, 任务)：Msa 以 _data.json 为任务，Inference/Prediction 以 _model.cif 为任务"""
+    if step == "Msa":
+        return "af3_msa", data_file(output_path, protein_id)
+    return "af3_model", model_file(output_path, protein_id)
+
+def make_ledger_inputs(sequences, args):
+    """各任务的输入哈希：MSA 取决于序列和镜像，结构还取决于模型参数和随机种子"""
+    return {
+        "af3_msa": {pid: cache.make_key("af3_msa", seq, args.docker_image) for pid, seq in sequences.items() if seq},
+        "af3_model": {pid: monomer_cache_key(seq, args) for pid, seq in sequences.items() if seq},
+    }
+
+def job_done(step, protein_id, output_path, ledger_inputs):
+    """任务账本中已完成且输入未变；账本中没有记录时检查已有输出是否完整"""
+    ledger_step, job = ledger_job(step, protein_id, output_path)
+    return job_ledger.is_done(ledger_step, job, ledger_inputs[ledger_step].get(protein_id, ""),
+                              adopt=lambda: output_complete(output_path, protein_id, msa=step == "Msa"))
+
+def run_docker_on_json(json_path, output_path, model_dir, db_dir, docker_image="alphafold3", step="Prediction", pdbs_dir=None,
+                       device=None, tokens=0, aliases=(), ledger_inputs=None):
+    """运行一个 AlphaFold3 任务；输出完整地 rename 到 output_path 后返回 True"""
     json_name = os.path.basename(json_path)
     protein_id = json_name.replace("_data.json", "").replace(".json", "")
+    ledger_step, job = ledger_job(step, protein_id, output_path)
+    inputs = (ledger_inputs or {}).get(ledger_step, {}).get(protein_id, "")
 
     print(f"[INFO] Running AlphaFold3 ({step}) for {protein_id}...")
 
@@ -56,37 +77,213 @@ def run_docker_on_json(json_path, output_path, model_dir, db_dir, docker_image="
     elif step == "Inference":
         extra_args = "--norun_data_pipeline"
 
-    # 构建 docker 命令
-    cmd = f"""
-    docker run --rm {"--gpus all" if step != "Msa" else ""} \\
-        -v {os.path.abspath(json_path)}:/root/input.json \\
-        -v {os.path.abspath(output_path)}:/root/af_output \\
-        -v {os.path.abspath(model_dir)}:/root/models \\
-        -v {os.path.abspath(db_dir)}:/root/public_databases \\
-        {docker_image} \\
-        python run_alphafold.py \\
-        --json_path=/root/input.json \\
-        --model_dir=/root/models \\
-        --output_dir=/root/af_output \\
-        {extra_args}
-    """
-    subprocess.run(cmd, shell=True)
+    # 按序列长度估算内存；超过上限的输入开启统一内存
+    host_gb, gpu_gb = estimate_af3(tokens, data_pipeline=step != "Inference", inference=step != "Msa")
+    docker_env = AF3_UNIFIED_MEMORY_ENV if step != "Msa" and is_large(host_gb, gpu_gb) else ""
+
+    # 构建 docker 命令；运行前从资源池申请 CPU/GPU/内存，估算值放得下时才启动。
+    # 容器写入 output_path/.scratch/ 下的临时目录，输出完整时整体 rename 到 output_path
+    scratch = make_scratch_dir(output_path, protein_id)
+    try:
+        with job_ledger.track(ledger_step, job, inputs) as run:
+            with resources.reserve(cpu=af3_cpus(extra_args), gpus=0 if step == "Msa" else 1, mem_gb=host_gb,
+                                   gpu_mem_gb=gpu_gb, device=device, label=f"af3 {step} {protein_id}") as gpu:
+                name = command_runner.container_name(f"af3-{step}-{protein_id}")
+                cmd = af3_command(json_path, "--json_path", scratch, model_dir, db_dir, docker_image, gpu,
+                                  extra_args, docker_env, name, gpu=step != "Msa")
+                timeout = command_runner.af3_timeout(tokens, data_pipeline=step != "Inference",
+                                                     inference=step != "Msa")
+                run["exit_code"] = command_runner.run(cmd, f"AlphaFold3 ({step}) {protein_id}", timeout=timeout,
+                                                      cleanup=command_runner.docker_cleanup(name)).returncode
+            run["ok"] = run["exit_code"] == 0 and output_complete(scratch, protein_id, msa=step == "Msa")
+            if run["ok"]:
+                publish_output(scratch, output_path, protein_id)
+    finally:
+        remove_scratch_dir(output_path, scratch)
+    if not run["ok"]:
+        print(f"[ERROR] AlphaFold3 ({step}) failed for {protein_id} (return code {run['exit_code']})")
+        return False
 
     # 推理步骤才进行 cif → pdb 转换
     if step in ["Inference", "Prediction"]:
-        cif_file = os.path.join(output_path, f"{protein_id}/{protein_id}_model.cif")
-        if pdbs_dir:
-            os.makedirs(pdbs_dir, exist_ok=True)
-            pdb_file = os.path.join(pdbs_dir, f"{protein_id}.pdb")
-
-        if os.path.exists(cif_file):
-            pymol_cmd = f'pymol -c -q -d "load {cif_file}; save {pdb_file}; quit;"'
-            subprocess.run(pymol_cmd, shell=True)
+        convert_model_to_pdb(protein_id, output_path, pdbs_dir)
+    for alias in aliases:
+        link_alias(protein_id, alias, output_path, pdbs_dir)
+    return True
+
+def on_protein_done(protein_id, output_path, pdbs_dir, aliases=()):
+    """常驻 worker 的批次结束回调：CIF → PDB，并链接序列相同的 ID"""
+    convert_model_to_pdb(protein_id, output_path, pdbs_dir)
+    for alias in aliases:
+        link_alias(protein_id, alias, output_path, pdbs_dir)
+
+def link_alias(protein_id, alias, output_path, pdbs_dir):
+    """序列相同的 ID 直接链接代表 ID 的输出目录文件和 PDB"""
+    link_output_dir(output_path, protein_id, alias)
+    if pdbs_dir:
+        link_file(os.path.join(pdbs_dir, f"{protein_id}.pdb"), os.path.join(pdbs_dir, f"{alias}.pdb"))
+
+def convert_model_to_pdb(protein_id, output_path, pdbs_dir):
+    """将 output_path/<id>/<id>_model.cif 转换为 pdbs_dir/<id>.pdb"""
+    cif_file = os.path.join(output_path, f"{protein_id}/{protein_id}_model.cif")
+    if pdbs_dir:
+        os.makedirs(pdbs_dir, exist_ok=True)
+        pdb_file = os.path.join(pdbs_dir, f"{protein_id}.pdb")
+
+    if os.path.exists(cif_file):
+        try:
+            convert_cif_to_pdb(cif_file, pdb_file)
             print(f"[INFO] Converted {protein_id}_model.cif → {protein_id}.pdb")
+        except Exception as e:
+            print(f"[ERROR] Failed to convert {cif_file} to PDB: {e}")
+    else:
+        print(f"[WARNING] {cif_file} not found. Skipping PDB conversion.")
+
+def run_streaming(json_tasks, args, pdbs_dir, tokens, aliases_of, ledger_inputs):
+    """MSA 与推理流水线：CPU 线程池生成 *_data.json，GPU 消费者拿到后立即开始推理"""
+    msa_dir = os.path.join(args.json_dir, "msa")
+    os.makedirs(msa_dir, exist_ok=True)
+    devices = parse_devices(args.gpus) or [None]
+    n_inference = args.inference_workers or len(devices)
+    ready = Queue(maxsize=args.queue_depth)
+
+    def produce(path):
+        protein_id = os.path.basename(path).replace(".json", "")
+        data_json_path = data_file(msa_dir, protein_id)
+
+        if job_done("Prediction", protein_id, args.output_dir, ledger_inputs):
+            print(f"[SKIP] Result for {protein_id} already done. Skipping...")
+            return
+        msa_ready = job_done("Msa", protein_id, msa_dir, ledger_inputs)
+        if msa_ready:
+            print(f"[SKIP] MSA for {protein_id} already done. Skipping...")
         else:
-            print(f"[WARNING] {cif_file} not found. Skipping PDB conversion.")
+            msa_ready = run_docker_on_json(
+                json_path=path,
+                output_path=msa_dir,
+                model_dir=args.parameter_dir,
+                db_dir=args.database_dir,
+                docker_image=args.docker_image,
+                step="Msa",
+                tokens=tokens.get(protein_id, 0),
+                aliases=aliases_of.get(protein_id, []),
+                ledger_inputs=ledger_inputs
+            )
+        if msa_ready:
+            # 队列满时阻塞，避免 MSA 远远跑在推理前面
+            ready.put(data_json_path)
+        else:
+            print(f"[WARNING] MSA for {protein_id} failed. Skipping inference for {protein_id}.")
 
-def main():
+    def consume(device):
+        while True:
+            data_json_path = ready.get()
+            if data_json_path is None:
+                break
+            protein_id = os.path.basename(data_json_path).replace("_data.json", "")
+            try:
+                run_docker_on_json(
+                    json_path=data_json_path,
+                    output_path=args.output_dir,
+                    model_dir=args.parameter_dir,
+                    db_dir=args.database_dir,
+                    docker_image=args.docker_image,
+                    step="Inference",
+                    pdbs_dir=pdbs_dir,
+                    device=device,
+                    tokens=tokens.get(protein_id, 0),
+                    aliases=aliases_of.get(protein_id, []),
+                    ledger_inputs=ledger_inputs
+                )
+            except Exception as e:
+                print(f"[ERROR] Inference failed for {data_json_path}: {e}")
+
+    consumers = [
+        threading.Thread(target=consume, args=(devices[i % len(devices)],), daemon=True)
+        for i in range(n_inference)
+    ]
+    for thread in consumers:
+        thread.start()
+
+    print(f"[INFO] Streaming {len(json_tasks)} proteins: {args.num_workers} MSA workers, "
+          f"{n_inference} inference workers, queue depth {args.queue_depth}...")
+    try:
+        with ThreadPoolExecutor(max_workers=args.num_workers) as executor:
+            futures = [executor.submit(produce, path) for path in json_tasks]
+            for future in as_completed(futures):
+                future.result()
+    finally:
+        for _ in consumers:
+            ready.put(None)
+        for thread in consumers:
+            thread.join()
+
+def read_data_json_sequence(data_json_path):
+    """读取 _data.json 中第一条蛋白链的序列"""
+    with open(data_json_path, "r") as f:
+        data = json.load(f)
+    for entry in data.get("sequences", []):
+        if "protein" in entry:
+            return entry["protein"]["sequence"]
+    return None
+
+def monomer_cache_key(sequence, args):
+    """单体结构缓存 key：序列 + 镜像 + 模型参数文件 + 随机种子"""
+    params = sorted(os.listdir(args.parameter_dir)) if os.path.isdir(args.parameter_dir) else []
+    return cache.make_key(CACHE_NAMESPACE, sequence, args.docker_image, ",".join(params), MODEL_SEEDS)
+
+def monomer_cache_files(protein_id, output_dir, pdbs_dir):
+    """缓存条目内文件名 → 本次运行中的对应路径"""
+    base = os.path.join(output_dir, protein_id)
+    return {
+        "model.pdb": os.path.join(pdbs_dir, f"{protein_id}.pdb"),
+        "model.cif": os.path.join(base, f"{protein_id}_model.cif"),
+        "confidences.json": os.path.join(base, f"{protein_id}_confidences.json"),
+        "summary_confidences.json": os.path.join(base, f"{protein_id}_summary_confidences.json"),
+        "data.json": os.path.join(base, f"{protein_id}_data.json"),
+    }
+
+def resolve_from_cache(json_tasks, sequences, args, pdbs_dir, ledger_inputs):
+    """命中缓存的蛋白直接链接到输出目录并在任务账本中记为完成，返回仍需运行的任务"""
+    remaining = []
+    hits = 0
+    for path in json_tasks:
+        protein_id = os.path.basename(path).replace("_data.json", "").replace(".json", "")
+        sequence = sequences.get(protein_id)
+        if sequence and not job_done("Prediction", protein_id, args.output_dir, ledger_inputs):
+            key = ledger_inputs["af3_model"][protein_id]
+            entry = cache.lookup(args.cache_dir, CACHE_NAMESPACE, key)
+            # 条目可能在 lookup 之后被并发淘汰：模型文件没有就位时按未命中处理
+            hit = entry is not None and cache.materialize(
+                entry, monomer_cache_files(protein_id, args.output_dir, pdbs_dir), required=["model.cif"])
+            cache.count(CACHE_NAMESPACE, hit)
+            if hit:
+                job_ledger.record("af3_model", model_file(args.output_dir, protein_id), key)
+                print(f"[CACHE] {protein_id}: reused cached structure.")
+                hits += 1
+                continue
+        remaining.append(path)
+    print(f"[INFO] Structure cache: {hits}/{len(json_tasks)} hits.")
+    return remaining
+
+def store_in_cache(sequences, args, pdbs_dir):
+    """把本次得到的结构写入缓存（已有条目自动跳过）"""
+    for protein_id, sequence in sequences.items():
+        files = monomer_cache_files(protein_id, args.output_dir, pdbs_dir)
+        if not (os.path.exists(files["model.pdb"]) and os.path.exists(files["model.cif"])):
+            continue
+        try:
+            cache.insert(
+                args.cache_dir, CACHE_NAMESPACE, monomer_cache_key(sequence, args), files,
+                meta={"protein_id": protein_id, "length": len(sequence), "docker_image": args.docker_image}
+            )
+        except OSError as e:
+            print(f"[WARNING] Failed to cache structure for {protein_id}: {e}")
+    cache.flush_stats(args.cache_dir)
+    if args.cache_max_gb:
+        cache.evict(args.cache_dir, int(args.cache_max_gb * 1024 ** 3))
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Run AlphaFold3 in MSA/Inference/Prediction mode.")
     parser.add_argument("-s","--step", required=True, choices=["Msa", "Inference", "Prediction"], help="Execution step: Msa, Inference, or Prediction.")
     parser.add_argument("-fa","--fasta", help="Input protein FASTA file (required for Msa and Prediction)")
@@ -95,18 +292,53 @@ def main():
     parser.add_argument("-p","--parameter_dir", required=True, help="AlphaFold3 model parameter directory")
     parser.add_argument("-d","--database_dir", required=True, help="AlphaFold3 public database directory")
     parser.add_argument("-i","--docker_image", default="alphafold3", help="Docker image name")
-    parser.add_argument("-n","--num_workers", type=int, default=6, help="Number of concurrent MSA jobs (Msa step only)")
+    parser.add_argument("-n","--num_workers", type=int, default=6, help="Number of concurrent MSA jobs (Msa step, or Prediction with --stream)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Prediction: overlap MSA (CPU) and inference (GPU), starting inference as soon as each MSA is ready")
+    parser.add_argument("--inference_workers", type=int, default=None,
+                        help="Concurrent inference jobs with --stream (default: number of --gpus, or 1)")
+    parser.add_argument("--queue_depth", type=int, default=4,
+                        help="Max finished MSAs waiting for inference with --stream (default: 4)")
+    parser.add_argument("--persistent_worker", action="store_true",
+                        help="Inference/Prediction: run one long-lived AlphaFold3 container per GPU over a queue directory")
+    parser.add_argument("--gpus", default=None,
+                        help="Comma-separated GPU IDs for persistent/stream workers, e.g. 0,1 (default: one worker using all GPUs)")
+    parser.add_argument("--batch_size", type=int, default=0,
+                        help="Inputs handed to a persistent worker at a time; 0 splits all inputs across GPUs up front")
+    parser.add_argument("--cache_dir", default=None,
+                        help="Shared monomer structure cache checked before running Inference/Prediction")
+    parser.add_argument("--cache_max_gb", type=float, default=0,
+                        help="Evict least recently used cache entries above this size (default: no limit)")
+    parser.add_argument("--resource_dir", default=None,
+                        help="Shared CPU/GPU/memory pool directory; jobs wait for free resources (default: $PPI_RESOURCE_DIR)")
+    parser.add_argument("--no_dedup", action="store_true",
+                        help="Fold every FASTA ID even when several IDs share the same sequence")
+    parser.add_argument("--job_ledger", default=None,
+                        help="SQLite job ledger consulted before each job (default: $PPI_JOB_LEDGER, "
+                             "or OUTPUT_DIR/jobs.sqlite)")
+    parser.add_argument("--timeout_scale", type=float, default=None,
+                        help="Multiply the per-command wall-clock timeouts (scaled by sequence length); 0 disables "
+                             "them (default: $PPI_TIMEOUT_SCALE or 1)")
+    parser.add_argument("--retries", type=int, default=None,
+                        help="Retries for timed-out or transiently failed commands, with exponential backoff "
+                             "(default: $PPI_RETRIES or 0)")
+    return parser
 
-    args = parser.parse_args()
+def run(args, sequences=None):
+    """
+    执行单蛋白 AlphaFold3 步骤；参数不合法时抛出 ValueError，常驻 worker 异常退出时抛出 RuntimeError。
+    sequences: 已读取的 {ID: 序列}（Msa、Prediction），省略时读取 args.fasta
+    """
+    resources.configure(args.resource_dir)
+    command_runner.configure(args.timeout_scale, args.retries)
+    job_ledger.configure(args.job_ledger, default_dir=args.output_dir)
 
     # 参数验证
-    if args.step in ["Msa", "Prediction"] and not args.fasta:
-        print("[ERROR] --fasta is required for step Msa or Prediction.")
-        sys.exit(1)
+    if args.step in ["Msa", "Prediction"] and not args.fasta and sequences is None:
+        raise ValueError("--fasta is required for step Msa or Prediction.")
 
-    if args.step != "Msa" and any(arg.startswith("--num_workers") for arg in sys.argv):
-        print("[ERROR] --num_workers can only be specified with --step Msa.")
-        sys.exit(1)
+    if args.stream and args.step != "Prediction":
+        raise ValueError("--stream can only be used with --step Prediction.")
 
     os.makedirs(args.json_dir, exist_ok=True)
     os.makedirs(args.output_dir, exist_ok=True)
@@ -115,31 +347,60 @@ def main():
     if args.step in ["Prediction", "Inference"]:
         os.makedirs(pdbs_dir, exist_ok=True)
 
-    # FASTA → JSON（Msa, Prediction）
+    # FASTA → JSON（Msa, Prediction）；序列相同的 ID 只为第一个 ID 生成任务
+    aliases = {}
     if args.step in ["Msa", "Prediction"]:
-        sequences = parse_fasta(args.fasta)
-        for pid, seq in sequences.items():
-            json_obj = convert_to_json_format(pid, seq)
+        if sequences is None:
+            sequences = parse_fasta(args.fasta)
+        unique_ids = list(sequences)
+        if not args.no_dedup:
+            unique_ids, aliases, _ = dedup(unique_ids, key_fn=sequences.get)
+            write_aliases(os.path.join(args.output_dir, DEDUP_FILE), aliases)
+            seconds = {pid: estimate_seconds(len(seq)) for pid, seq in sequences.items()}
+            report("AlphaFold3 monomers", len(sequences), len(unique_ids),
+                   sum(seconds.values()), sum(seconds[alias] for alias in aliases))
+        for pid in unique_ids:
+            json_obj = convert_to_json_format(pid, sequences[pid])
             json_path = os.path.join(args.json_dir, f"{pid}.json")
             with open(json_path, 'w') as f:
                 json.dump(json_obj, f, indent=2)
 
         json_tasks = [
-            os.path.join(args.json_dir, f"{pid}.json") for pid in sequences
+            os.path.join(args.json_dir, f"{pid}.json") for pid in unique_ids
         ]
     else:
-        # Inference 阶段：查找 json_dir/*/*_data.json
+        # Inference 阶段：查找 json_dir/*/*_data.json；Msa 步骤的别名表中的 ID 由代表 ID 的结果链接得到
+        if not args.no_dedup:
+            aliases = read_aliases(os.path.join(args.json_dir, DEDUP_FILE))
         json_tasks = []
         for entry in os.listdir(args.json_dir):
             subdir = os.path.join(args.json_dir, entry)
-            if os.path.isdir(subdir):
+            if os.path.isdir(subdir) and entry not in aliases:
                 data_json_path = os.path.join(subdir, f"{entry}_data.json")
                 if os.path.isfile(data_json_path):
                     json_tasks.append(data_json_path)
 
         if not json_tasks:
-            print("[ERROR] No *_data.json files found in output_dir for Inference step.")
-            sys.exit(1)
+            raise ValueError("No *_data.json files found in output_dir for Inference step.")
+
+        sequences = {
+            os.path.basename(path).replace("_data.json", ""): read_data_json_sequence(path)
+            for path in json_tasks
+        }
+
+    ledger_inputs = make_ledger_inputs(sequences, args)
+    use_cache = args.cache_dir and args.step in ["Inference", "Prediction"]
+    if use_cache:
+        json_tasks = resolve_from_cache(json_tasks, sequences, args, pdbs_dir, ledger_inputs)
+
+    aliases_of = invert(aliases)
+
+    # 最长优先、同一 token 桶相邻；顺序只取决于序列长度和 ID
+    tokens = {pid: len(seq) for pid, seq in sequences.items() if seq}
+    json_tasks = [path for _, path in lpt_order(
+        [(os.path.basename(path).replace("_data.json", "").replace(".json", ""), path) for path in json_tasks],
+        tokens
+    )]
 
     # 执行任务
     if args.step == "Msa":
@@ -149,10 +410,9 @@ def main():
             for path in json_tasks:
                 json_name = os.path.basename(path)
                 protein_id = json_name.replace(".json", "")
-                data_json_path = os.path.join(args.output_dir, f"{protein_id}/{protein_id}_data.json")
 
-                if os.path.exists(data_json_path):
-                    print(f"[SKIP] MSA for {protein_id} already exists. Skipping...")
+                if job_done("Msa", protein_id, args.output_dir, ledger_inputs):
+                    print(f"[SKIP] MSA for {protein_id} already done. Skipping...")
                     continue
 
                 futures.append(
@@ -163,19 +423,74 @@ def main():
                         model_dir=args.parameter_dir,
                         db_dir=args.database_dir,
                         docker_image=args.docker_image,
-                        step=args.step
+                        step=args.step,
+                        tokens=tokens.get(protein_id, 0),
+                        aliases=aliases_of.get(protein_id, []),
+                        ledger_inputs=ledger_inputs
                     )
                 )
             for future in as_completed(futures):
                 future.result()
-    else:
+    elif args.stream:
+        # 大任务不进入流水线，普通任务完成后逐个运行
+        named = [(os.path.basename(path).replace(".json", ""), path) for path in json_tasks]
+        normal, large = split_large(named, lambda job: estimate_af3(tokens.get(job[0], 0)), "AlphaFold3")
+        report_schedule(normal, tokens, args.inference_workers or len(parse_devices(args.gpus) or [None]))
+        run_streaming([path for _, path in normal], args, pdbs_dir, tokens, aliases_of, ledger_inputs)
+        for protein_id, path in large:
+            if job_done("Prediction", protein_id, args.output_dir, ledger_inputs):
+                print(f"[SKIP] Result for {protein_id} already done. Skipping...")
+                continue
+            run_docker_on_json(
+                json_path=path,
+                output_path=args.output_dir,
+                model_dir=args.parameter_dir,
+                db_dir=args.database_dir,
+                docker_image=args.docker_image,
+                step="Prediction",
+                pdbs_dir=pdbs_dir,
+                tokens=tokens.get(protein_id, 0),
+                aliases=aliases_of.get(protein_id, []),
+                ledger_inputs=ledger_inputs
+            )
+    elif args.persistent_worker:
+        pending = []
         for path in json_tasks:
             json_name = os.path.basename(path)
             protein_id = json_name.replace("_data.json", "").replace(".json", "")
-            cif_file = os.path.join(args.output_dir, f"{protein_id}/{protein_id}_model.cif")
 
-            if os.path.exists(cif_file):
-                print(f"[SKIP] Result for {protein_id} already exists. Skipping...")
+            if job_done(args.step, protein_id, args.output_dir, ledger_inputs):
+                print(f"[SKIP] Result for {protein_id} already done. Skipping...")
+                continue
+            pending.append((protein_id, path))
+
+        run_inference_workers(
+            pending,
+            output_dir=args.output_dir,
+            model_dir=args.parameter_dir,
+            db_dir=args.database_dir,
+            docker_image=args.docker_image,
+            queue_dir=os.path.join(args.json_dir, "queue"),
+            devices=parse_devices(args.gpus),
+            batch_size=args.batch_size,
+            extra_args="--norun_data_pipeline" if args.step == "Inference" else "",
+            on_done=lambda pid: on_protein_done(pid, args.output_dir, pdbs_dir, aliases_of.get(pid, [])),
+            tokens=tokens,
+            job_inputs=ledger_inputs["af3_model"],
+        )
+    else:
+        # 大任务排到最后
+        named = [(os.path.basename(path).replace("_data.json", "").replace(".json", ""), path) for path in json_tasks]
+        normal, large = split_large(
+            named, lambda job: estimate_af3(tokens.get(job[0], 0), data_pipeline=args.step == "Prediction"),
+            "AlphaFold3"
+        )
+        for _, path in normal + large:
+            json_name = os.path.basename(path)
+            protein_id = json_name.replace("_data.json", "").replace(".json", "")
+
+            if job_done(args.step, protein_id, args.output_dir, ledger_inputs):
+                print(f"[SKIP] Result for {protein_id} already done. Skipping...")
                 continue
 
             run_docker_on_json(
@@ -185,10 +500,32 @@ def main():
                 db_dir=args.database_dir,
                 docker_image=args.docker_image,
                 step=args.step,
-                pdbs_dir=pdbs_dir
+                pdbs_dir=pdbs_dir,
+                tokens=tokens.get(protein_id, 0),
+                aliases=aliases_of.get(protein_id, []),
+                ledger_inputs=ledger_inputs
             )
 
+    # 跳过或命中缓存的代表 ID 没有经过上面的链接步骤，这里补齐所有别名
+    for alias, protein_id in aliases.items():
+        link_alias(protein_id, alias, args.output_dir, pdbs_dir if args.step != "Msa" else None)
+
+    if use_cache:
+        store_in_cache(sequences, args, pdbs_dir)
+
     print(f"[DONE] AlphaFold3 step `{args.step}` completed.")
 
+def main():
+    args = build_parser().parse_args()
+    if args.step != "Msa" and not args.stream and any(arg.startswith("--num_workers") for arg in sys.argv):
+        print("[ERROR] --num_workers can only be specified with --step Msa or --stream.")
+        sys.exit(1)
+    command_runner.install_signal_handlers()
+    try:
+        run(args)
+    except (RuntimeError, ValueError) as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+
 if __name__ == "__main__":
     main()
@@ -2,86 +2,146 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import json
 import argparse
-import subprocess
-
-def parse_fasta(fasta_file):
-    sequences = {}
-    with open(fasta_file, "r") as file:
-        protein_id = None
-        sequence = []
-        for line in file:
-            line = line.strip()
-            if line.startswith(">"):
-                if protein_id:
-                    sequences[protein_id] = "".join(sequence)
-                protein_id = line[1:].split()[0]
-                sequence = []
-            else:
-                sequence.append(line)
-        if protein_id:
-            sequences[protein_id] = "".join(sequence)
-    return sequences
-
-
-def convert_complex_to_json(protein_id1, protein_id2, seq1, seq2):
+
+from af3_worker import (af3_command, af3_cpus, make_scratch_dir, model_file, output_complete, parse_devices,
+                        publish_output, remove_scratch_dir, run_inference_workers)
+from cif2pdb import convert_cif_to_pdb
+from dedup import link_file, link_output_dir, report
+from fasta import open_fasta
+from job_scheduler import estimate_seconds, lpt_order
+from memory_model import AF3_UNIFIED_MEMORY_ENV, estimate_af3, is_large, split_large
+from pair_list import read_pair_list, select_known
+import cache
+import command_runner
+import job_ledger
+import ledger
+import resources
+
+LEDGER_STEP = "af3_complex"
+RESULT_HEADER = "Pair\tPTM\tIPTM"
+MODEL_SEEDS = [1]
+
+def find_monomer_data_json(protein_id, msa_dirs):
+    """在单蛋白输出目录中查找 <id>/<id>_data.json（AlphaFold3 输出目录名为小写）"""
+    for msa_dir in msa_dirs or []:
+        for name in (protein_id.lower(), protein_id):
+            path = os.path.join(msa_dir, name, f"{name}_data.json")
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def load_monomer_chain(data_json_path, sequence):
+    """读取单蛋白 _data.json 中的 MSA 和模板；序列不一致时返回 None"""
+    with open(data_json_path, "r") as f:
+        data = json.load(f)
+    for entry in data.get("sequences", []):
+        protein = entry.get("protein")
+        if protein and protein.get("sequence") == sequence:
+            return {
+                "modifications": protein.get("modifications", []),
+                "unpairedMsa": protein.get("unpairedMsa", ""),
+                "pairedMsa": protein.get("pairedMsa", ""),
+                "templates": protein.get("templates", []),
+            }
+    return None
+
+
+def convert_complex_to_json(protein_id1, protein_id2, seq1, seq2, chain1=None, chain2=None):
+    """chain1/chain2 为单蛋白的 MSA 和模板，两条链都提供时可跳过数据流程直接推理"""
+    protein1 = {"id": ["A"], "sequence": seq1}
+    protein2 = {"id": ["B"], "sequence": seq2}
+    if chain1 is not None and chain2 is not None:
+        protein1.update(chain1)
+        protein2.update(chain2)
     return {
-        "modelSeeds": [1],
+        "modelSeeds": MODEL_SEEDS,
         "dialect": "alphafold3",
         "version": 1,
         "name": f"{protein_id1}-{protein_id2}",
         "sequences": [
-            {"protein": {"id": ["A"], "sequence": seq1}},
-            {"protein": {"id": ["B"], "sequence": seq2}},
+            {"protein": protein1},
+            {"protein": protein2},
         ],
     }
 
 
-def run_docker_prediction(json_path, output_dir, model_dir, db_dir, docker_image, pdbs_dir=None):
+def complex_inputs(seq1, seq2, docker_image):
+    """任务账本中的输入哈希：两条链的序列（不计顺序）+ 镜像 + 随机种子"""
+    return cache.make_key(LEDGER_STEP, *sorted((seq1, seq2)), docker_image, MODEL_SEEDS)
+
+
+def prediction_done(pair_name, output_dir, inputs):
+    """任务账本中已完成且输入未变；账本中没有记录时检查已有输出是否完整"""
+    return job_ledger.is_done(LEDGER_STEP, model_file(output_dir, pair_name), inputs,
+                              adopt=lambda: output_complete(output_dir, pair_name))
+
+
+def run_docker_prediction(json_path, output_dir, model_dir, db_dir, docker_image, pdbs_dir=None, extra_args="",
+                          tokens=0, inputs=""):
     pair_name = os.path.basename(json_path).replace(".json", "")
-    lower_pair_name = pair_name.lower()
-    pair_out_dir = os.path.join(output_dir, lower_pair_name)
-    os.makedirs(pair_out_dir, exist_ok=True)
-    cif_file = os.path.join(pair_out_dir, f"{lower_pair_name}_model.cif")
 
-    if os.path.exists(cif_file):
-        print(f"[SKIP] Prediction already exists for {pair_name}. Skipping...")
+    if prediction_done(pair_name, output_dir, inputs):
+        print(f"[SKIP] Prediction already done for {pair_name}. Skipping...")
         return
 
     print(f"[INFO] Predicting complex: {pair_name}...")
 
-    cmd = f"""
-    docker run --rm --gpus all \\
-        -v {os.path.abspath(json_path)}:/root/input.json \\
-        -v {os.path.abspath(output_dir)}:/root/af_output \\
-        -v {os.path.abspath(model_dir)}:/root/models \\
-        -v {os.path.abspath(db_dir)}:/root/public_databases \\
-        {docker_image} \\
-        python run_alphafold.py \\
-        --json_path=/root/input.json \\
-        --model_dir=/root/models \\
-        --output_dir=/root/af_output
-    """
-    subprocess.run(cmd, shell=True)
-
-    if pdbs_dir:
-        os.makedirs(pdbs_dir, exist_ok=True)
-        pdb_file = os.path.join(pdbs_dir, f"{pair_name}.pdb")
-        if os.path.exists(cif_file):
-            pymol_cmd = f'pymol -c -q -d "load {cif_file}; save {pdb_file}; quit;"'
-            subprocess.run(pymol_cmd, shell=True)
+    # seq1 + seq2 的 token 数决定内存估算；超过上限时开启统一内存
+    host_gb, gpu_gb = estimate_af3(tokens, data_pipeline="--norun_data_pipeline" not in extra_args)
+    docker_env = AF3_UNIFIED_MEMORY_ENV if is_large(host_gb, gpu_gb) else ""
+
+    # 容器写入 output_dir/.scratch/ 下的临时目录，输出完整时整体 rename 到 output_dir
+    scratch = make_scratch_dir(output_dir, pair_name)
+    try:
+        with job_ledger.track(LEDGER_STEP, model_file(output_dir, pair_name), inputs) as run:
+            with resources.reserve(cpu=af3_cpus(extra_args), gpus=1, mem_gb=host_gb, gpu_mem_gb=gpu_gb,
+                                   label=f"af3 complex {pair_name}") as gpu:
+                name = command_runner.container_name(f"af3-complex-{pair_name}")
+                cmd = af3_command(json_path, "--json_path", scratch, model_dir, db_dir, docker_image, gpu, extra_args,
+                                  docker_env, name)
+                timeout = command_runner.af3_timeout(tokens, data_pipeline="--norun_data_pipeline" not in extra_args)
+                run["exit_code"] = command_runner.run(cmd, f"AlphaFold3 complex {pair_name}", timeout=timeout,
+                                                      cleanup=command_runner.docker_cleanup(name)).returncode
+            run["ok"] = run["exit_code"] == 0 and output_complete(scratch, pair_name)
+            if run["ok"]:
+                publish_output(scratch, output_dir, pair_name)
+    finally:
+        remove_scratch_dir(output_dir, scratch)
+    if not run["ok"]:
+        print(f"[ERROR] AlphaFold3 complex prediction failed for {pair_name} (return code {run['exit_code']})")
+        return
+
+    convert_complex_to_pdb(pair_name, output_dir, pdbs_dir)
+
+
+def convert_complex_to_pdb(pair_name, output_dir, pdbs_dir):
+    """将复合物预测的 CIF 转换为 pdbs_dir/<pair>.pdb"""
+    if not pdbs_dir:
+        return
+    lower_pair_name = pair_name.lower()
+    cif_file = os.path.join(output_dir, lower_pair_name, f"{lower_pair_name}_model.cif")
+    os.makedirs(pdbs_dir, exist_ok=True)
+    pdb_file = os.path.join(pdbs_dir, f"{pair_name}.pdb")
+    if os.path.exists(cif_file):
+        try:
+            convert_cif_to_pdb(cif_file, pdb_file)
             print(f"[INFO] Converted {pair_name}_model.cif → {pair_name}.pdb")
-        else:
-            print(f"[WARNING] Missing CIF file for {pair_name}. Cannot convert to PDB.")
+        except Exception as e:
+            print(f"[ERROR] Failed to convert {cif_file} to PDB: {e}")
+    else:
+        print(f"[WARNING] Missing CIF file for {pair_name}. Cannot convert to PDB.")
 
 
-def extract_confidence(pair_name, output_dir, outfile):
-    """提取每个结果目录下的 ptm 和 iptm 值"""
+def extract_confidence(pair_name, output_dir):
+    """提取结果目录下的 ptm 和 iptm 值，返回结果表的一行；缺失或无法解析时返回 None"""
     summary_path = os.path.join(output_dir, pair_name.lower(), f"{pair_name.lower()}_summary_confidences.json")
     if not os.path.exists(summary_path):
         print(f"[WARNING] Missing summary file: {summary_path}")
-        return
+        return None
 
     try:
         with open(summary_path, "r") as f:
@@ -90,18 +150,33 @@ def extract_confidence(pair_name, output_dir, outfile):
             iptm = data.get("iptm", None)
             if ptm is None or iptm is None:
                 print(f"[WARNING] Missing ptm/iptm in {pair_name}")
-                return
-
-        with open(outfile, "a") as fout:
-            fout.write(f"{pair_name}\t{ptm}\t{iptm}\n")
+                return None
 
         print(f"[INFO] Recorded ptm/iptm for {pair_name}: PTM={ptm}, IPTM={iptm}")
+        return f"{pair_name}\t{ptm}\t{iptm}"
 
     except Exception as e:
         print(f"[ERROR] Failed to parse {summary_path}: {e}")
+        return None
 
 
-def main():
+def write_results(rows, completed, outfile, append=False):
+    """
+    写出结果表，中断的运行不会留下半张表：先写入 OUTFILE.part 再 rename；
+    append 且已有结果时在最后一次性追加，并把 completed 中的 pair 记入账本
+    """
+    if append and os.path.exists(outfile) and os.path.getsize(outfile) > 0:
+        ledger.append_lines(outfile, rows)
+        ledger.record(outfile, completed)
+        return
+    part = f"{outfile}.part"
+    with open(part, "w") as f:
+        f.writelines(f"{row}\n" for row in [RESULT_HEADER] + rows)
+    os.replace(part, outfile)
+    ledger.reset(outfile)
+
+
+def build_parser():
     parser = argparse.ArgumentParser(description="AlphaFold3 Complex Prediction (pair-based)")
     parser.add_argument("-l", "--pair_list", required=True, help="Protein pair list file")
     parser.add_argument("-fa", "--fasta", required=True, help="FASTA file containing all protein sequences")
@@ -110,37 +185,150 @@ def main():
     parser.add_argument("-p", "--model_dir", required=True, help="AlphaFold3 model parameter directory")
     parser.add_argument("-d", "--database_dir", required=True, help="AlphaFold3 public database directory")
     parser.add_argument("-i", "--docker_image", default="alphafold3", help="Docker image name")
-    parser.add_argument("--convert_pdb", action="store_true", help="Convert CIF to PDB using PyMOL")
+    parser.add_argument("--convert_pdb", action="store_true", help="Convert CIF to PDB (native converter, PyMOL only as fallback)")
     parser.add_argument("-o", "--outfile", required=True, help="Output file to save ptm and iptm results")
-    args = parser.parse_args()
+    parser.add_argument("--msa_dir", action="append", default=[],
+                        help="Single-protein AlphaFold3 output directory holding <id>/<id>_data.json; "
+                             "pairs whose two chains both have cached MSAs skip the data pipeline (repeatable)")
+    parser.add_argument("--persistent_worker", action="store_true",
+                        help="Run one long-lived AlphaFold3 container per GPU over a queue directory")
+    parser.add_argument("--gpus", default=None,
+                        help="Comma-separated GPU IDs for persistent workers, e.g. 0,1 (default: one worker using all GPUs)")
+    parser.add_argument("--batch_size", type=int, default=0,
+                        help="Inputs handed to a persistent worker at a time; 0 splits all inputs across GPUs up front")
+    parser.add_argument("--resource_dir", default=None,
+                        help="Shared CPU/GPU/memory pool directory; jobs wait for free resources (default: $PPI_RESOURCE_DIR)")
+    parser.add_argument("--no_dedup", action="store_true",
+                        help="Predict every pair even when two pairs have the same pair of chain sequences")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only predict pairs missing from the outfile's ledger and append their ptm/iptm")
+    parser.add_argument("--job_ledger", default=None,
+                        help="SQLite job ledger consulted before each prediction (default: $PPI_JOB_LEDGER, "
+                             "or OUTPUT_DIR/jobs.sqlite)")
+    parser.add_argument("--timeout_scale", type=float, default=None,
+                        help="Multiply the per-command wall-clock timeouts (scaled by sequence length); 0 disables "
+                             "them (default: $PPI_TIMEOUT_SCALE or 1)")
+    parser.add_argument("--retries", type=int, default=None,
+                        help="Retries for timed-out or transiently failed commands, with exponential backoff "
+                             "(default: $PPI_RETRIES or 0)")
+    return parser
+
+
+def run(args, sequences=None, pairs=None):
+    """
+    执行复合物预测步骤；常驻 worker 异常退出时抛出 RuntimeError。
+    sequences: {ID: 序列} 的映射（dict 或 fasta.FastaIndex），省略时打开 args.fasta 的索引；
+               只读取 pair 列表中出现的序列
+    pairs:     已读取的规范化 pair 列表，省略时读取 args.pair_list；序列缺失的 pair 被跳过
+    """
+    resources.configure(args.resource_dir)
+    command_runner.configure(args.timeout_scale, args.retries)
+    job_ledger.configure(args.job_ledger, default_dir=args.output_dir)
 
     os.makedirs(args.json_dir, exist_ok=True)
     os.makedirs(args.output_dir, exist_ok=True)
     pdbs_dir = os.path.join(args.output_dir, "pdbs") if args.convert_pdb else None
 
-    sequences = parse_fasta(args.fasta)
+    # pair 名与对接步骤一致：小写、两个 ID 按字母顺序排列；校验 ID 只需索引，不读取序列
+    if sequences is None:
+        sequences = open_fasta(args.fasta)
+    id_of = {pid.lower(): pid for pid in sequences}
 
-    # 初始化输出文件
-    with open(args.outfile, "w") as f:
-        f.write("Pair\tPTM\tIPTM\n")
+    pair_jobs = []
+    tokens = {}  # 复合物 token 数 = 两条链长度之和
+    job_inputs = {}  # 任务账本中的输入哈希
+    # 两条链序列相同（不计顺序）的 pair 只预测一次：{别名 pair: 代表 pair}
+    aliases = {}
+    representative = {}
+    if pairs is None:
+        pairs = read_pair_list(args.pair_list, known_ids=id_of)
+    else:
+        pairs = select_known(pairs, id_of)
+    if args.incremental:
+        pairs = ledger.select_pending(pairs, ledger.read_ledger(args.outfile, joined=True), "AlphaFold3 complexes")
+    # 只取本次要预测的 pair 用到的序列
+    needed = {pid for pair in pairs for pid in pair}
+    if hasattr(sequences, "fetch"):
+        fetched = sequences.fetch(id_of[pid] for pid in needed)
+    else:
+        fetched = {id_of[pid]: sequences[id_of[pid]] for pid in needed}
+    sequences = {pid: fetched[id_of[pid]] for pid in needed}
+    pair_of = {f"{p1}-{p2}": (p1, p2) for p1, p2 in pairs}
+    # 结果表的行在全部预测结束后一次写出（write_results）
+    rows = []
+    completed = []
 
-    with open(args.pair_list) as f:
-        for line in f:
-            parts = line.strip().split()
-            if len(parts) < 2:
-                continue
-            p1, p2 = parts[0], parts[1]
+    def collect(pair_name):
+        row = extract_confidence(pair_name, args.output_dir)
+        if row is not None:
+            rows.append(row)
+            completed.append(pair_of[pair_name])
+    for p1, p2 in pairs:
+        key = tuple(sorted((sequences[p1], sequences[p2])))
+        if not args.no_dedup and key in representative:
+            aliases[f"{p1}-{p2}"] = representative[key]
+            continue
+        representative[key] = f"{p1}-{p2}"
 
-            if p1 not in sequences or p2 not in sequences:
-                print(f"[WARNING] Sequence missing for {p1} or {p2}, skipping...")
-                continue
+        chains = []
+        for pid in (p1, p2):
+            data_json_path = find_monomer_data_json(pid, args.msa_dir)
+            chains.append(load_monomer_chain(data_json_path, sequences[pid]) if data_json_path else None)
+        reuse_msa = chains[0] is not None and chains[1] is not None
+
+        json_obj = convert_complex_to_json(p1, p2, sequences[p1], sequences[p2], *chains)
+        json_path = os.path.join(args.json_dir, f"{p1}-{p2}.json")
+
+        with open(json_path, "w") as fjson:
+            json.dump(json_obj, fjson, indent=2)
 
-            json_obj = convert_complex_to_json(p1, p2, sequences[p1], sequences[p2])
-            json_path = os.path.join(args.json_dir, f"{p1}-{p2}.json")
+        pair_jobs.append((f"{p1}-{p2}", json_path, reuse_msa))
+        tokens[f"{p1}-{p2}"] = len(sequences[p1]) + len(sequences[p2])
+        job_inputs[f"{p1}-{p2}"] = complex_inputs(sequences[p1], sequences[p2], args.docker_image)
 
-            with open(json_path, "w") as fjson:
-                json.dump(json_obj, fjson, indent=2)
+    if not args.no_dedup:
+        seconds = sum(estimate_seconds(n) for n in tokens.values())
+        saved = sum(estimate_seconds(tokens[rep]) for rep in aliases.values())
+        report("AlphaFold3 complexes", len(pairs), len(pair_jobs), seconds + saved, saved)
 
+    # 最长优先、同一 token 桶相邻，顺序与 pair 列表顺序无关
+    pair_jobs = lpt_order(pair_jobs, tokens)
+
+    if args.msa_dir:
+        n_reused = sum(1 for job in pair_jobs if job[2])
+        print(f"[INFO] Reusing monomer MSAs for {n_reused}/{len(pair_jobs)} pairs (data pipeline skipped).")
+
+    if args.persistent_worker:
+        pending = []
+        for pair_name, json_path, reuse_msa in pair_jobs:
+            if prediction_done(pair_name, args.output_dir, job_inputs[pair_name]):
+                print(f"[SKIP] Prediction already done for {pair_name}. Skipping...")
+                continue
+            pending.append((pair_name, json_path, reuse_msa))
+
+        # 已有 MSA 的输入与需要完整数据流程的输入分开交给 worker
+        for reuse_msa in (True, False):
+            run_inference_workers(
+                [(name, path) for name, path, reuse in pending if reuse == reuse_msa],
+                output_dir=args.output_dir,
+                model_dir=args.model_dir,
+                db_dir=args.database_dir,
+                docker_image=args.docker_image,
+                queue_dir=os.path.join(args.json_dir, "queue"),
+                devices=parse_devices(args.gpus),
+                batch_size=args.batch_size,
+                extra_args="--norun_data_pipeline" if reuse_msa else "",
+                on_done=lambda name: convert_complex_to_pdb(name, args.output_dir, pdbs_dir),
+                tokens=tokens,
+                ledger_step=LEDGER_STEP,
+                job_inputs=job_inputs,
+            )
+    else:
+        # 大任务排到最后，普通任务完成后逐个运行
+        normal, large = split_large(
+            pair_jobs, lambda job: estimate_af3(tokens[job[0]], data_pipeline=not job[2]), "AlphaFold3"
+        )
+        for pair_name, json_path, reuse_msa in normal + large:
             run_docker_prediction(
                 json_path=json_path,
                 output_dir=args.output_dir,
@@ -148,13 +336,39 @@ def main():
                 db_dir=args.database_dir,
                 docker_image=args.docker_image,
                 pdbs_dir=pdbs_dir,
+                extra_args="--norun_data_pipeline" if reuse_msa else "",
+                tokens=tokens[pair_name],
+                inputs=job_inputs[pair_name],
             )
 
             # 新增提取 ptm/iptm
-            extract_confidence(f"{p1}-{p2}", args.output_dir, args.outfile)
+            collect(pair_name)
+
+    if args.persistent_worker:
+        for pair_name, _, _ in pair_jobs:
+            collect(pair_name)
+
+    # 重复的 pair 链接代表 pair 的输出
+    for alias, rep in aliases.items():
+        link_output_dir(args.output_dir, rep.lower(), alias.lower())
+        if pdbs_dir:
+            link_file(os.path.join(pdbs_dir, f"{rep}.pdb"), os.path.join(pdbs_dir, f"{alias}.pdb"))
+        collect(alias)
+
+    write_results(rows, completed, args.outfile, append=args.incremental)
 
     print(f"[DONE] Complex structure prediction completed. Summary saved to {args.outfile}")
 
 
+def main():
+    args = build_parser().parse_args()
+    command_runner.install_signal_handlers()
+    try:
+        run(args)
+    except RuntimeError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     main()
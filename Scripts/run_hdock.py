@@ -1,118 +1,230 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-# Hongxiang Li, 2025/07/09 (Modified: add pdbs symlink + parallel support + lowercase pair list)
+# Hongxiang Li, 2025/07/09 (Modified: per-task scratch dirs + job ledger + thread/process parallel support + lowercase pair list + result cache
+#                            + scores read from .out, createpl only on demand)
 
 import os
+import uuid
+import shutil
 import argparse
 import subprocess
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
+from hdock_score import read_top_scores
+from dedup import dedup_pairs
+from memory_model import estimate_hdock, split_large
+from pair_list import canonical_pair, read_pair_list
+from structure_index import build_index, choose_receptor_ligand
+import cache
+import command_runner
+import job_ledger
+import ledger
+import resources
 
-def get_pdb_length(pdb_file):
-    """统计PDB中CA原子的数量"""
-    count = 0
-    with open(pdb_file, "r") as f:
+CACHE_NAMESPACE = "hdock"
+# 任务账本中的步骤名：对接（.out）和 createpl 复合物模型（.out.pdb）
+LEDGER_STEP = "hdock"
+MODEL_LEDGER_STEP = "hdock_model"
+# 资源池申请量：hdock 为单线程程序，每个任务占 1 个 CPU；内存按原子数估算（memory_model.py）
+HDOCK_SPACING = "1.2"
+HDOCK_ANGLE = "15"
+# 每个任务的临时工作目录放在 output_dir 下，保证与最终输出位于同一文件系统
+SCRATCH_DIR = ".scratch"
+
+
+def hdock_cache_key(r_sha256, l_sha256):
+    """对接结果缓存 key：受体/配体 PDB 内容哈希（来自结构索引）+ HDOCK 参数"""
+    return cache.make_key(CACHE_NAMESPACE, r_sha256, l_sha256, f"spacing={HDOCK_SPACING}", f"angle={HDOCK_ANGLE}")
+
+
+def read_hdock_score(out_pdb):
+    """从 createpl 生成的复合物 PDB 中读取 REMARK Score（只有 PDB、没有 .out 的旧结果）"""
+    with open(out_pdb) as f:
         for line in f:
-            if line.startswith("ATOM") and " CA " in line:
-                count += 1
-    return count
+            if line.startswith("REMARK Score:"):
+                return float(line.strip().replace("REMARK Score: ", ""))
+    return None
+
+
+def make_scratch_dir(output_dir, pair_name, pdb_dir):
+    """
+    每个任务独立的临时工作目录（与 output_dir 同一文件系统，完成后可原子 rename）。
+    目录内建立 pdbs -> pdb_dir 软链接，HDOCK 的输入路径保持简短。
+    """
+    scratch = os.path.join(output_dir, SCRATCH_DIR, f"{pair_name}.{os.getpid()}.{uuid.uuid4().hex[:8]}")
+    os.makedirs(scratch)
+    os.symlink(pdb_dir, os.path.join(scratch, "pdbs"))
+    return scratch
 
 
-def run_hdock_on_pair(id1, id2, pdb_dir, output_dir, hdock_path=None):
-    pdb1 = os.path.join(pdb_dir, f"{id1}.pdb")
-    pdb2 = os.path.join(pdb_dir, f"{id2}.pdb")
+def run_hdock_on_pair(id1, id2, pdb_dir, output_dir, hdock_path=None, cache_dir=None, structures=None,
+                      top_k=1, model_threshold=None, build_model=False):
+    """
+    对接一个 pair，返回 (R, L, 最优得分, 前 top_k 个得分)。
 
-    if not os.path.exists(pdb1) or not os.path.exists(pdb2):
+    得分直接从 .out 读取；只有 build_model=True 或最优得分 <= model_threshold 时
+    才运行 createpl 生成复合物 PDB（R-L.out.pdb）。
+    """
+    # 按结构索引中的残基数决定谁是 R/L
+    chosen = choose_receptor_ligand(structures if structures is not None else {}, pdb_dir, id1, id2)
+    if chosen is None:
         print(f"[WARNING] Missing PDB file for {id1} or {id2}")
         return None
-
-    # 判断长度，决定谁是 R/L
-    len1 = get_pdb_length(pdb1)
-    len2 = get_pdb_length(pdb2)
-    R, L = (id1, id2) if len1 >= len2 else (id2, id1)
+    R, L, r_entry, l_entry = chosen
+    pair_name = f"{R}-{L}"
 
     # 输出文件名
-    out_name = os.path.join(output_dir, f"{R}-{L}.out")
-    out_pdb = os.path.join(output_dir, f"{R}-{L}.out.pdb")
+    out_name = os.path.join(output_dir, f"{pair_name}.out")
+    out_pdb = os.path.join(output_dir, f"{pair_name}.out.pdb")
 
     # 准备命令路径
     hdock_cmd = f"{hdock_path}/hdock" if hdock_path else "hdock"
     createpl_cmd = f"{hdock_path}/createpl" if hdock_path else "createpl"
 
-    cwd = os.getcwd()
     os.makedirs(output_dir, exist_ok=True)
 
-    # 创建软链接到 pdb_dir
-    symlink_path = os.path.join(output_dir, "pdbs")
-    if not os.path.exists(symlink_path):
-        try:
-            os.symlink(pdb_dir, symlink_path)
-            print(f"[INFO] Linked pdbs -> {pdb_dir}")
-        except FileExistsError:
-            pass
+    # 任务账本：输入（两个 PDB 的内容哈希 + HDOCK 参数）未变且已完成的步骤直接跳过
+    inputs = hdock_cache_key(r_entry["sha256"], l_entry["sha256"])
+    docked = job_ledger.is_done(LEDGER_STEP, out_name, inputs, adopt=lambda: bool(read_top_scores(out_name)))
 
-    os.chdir(output_dir)
+    def model_done():
+        return job_ledger.is_done(MODEL_LEDGER_STEP, out_pdb, inputs,
+                                  adopt=lambda: read_hdock_score(out_pdb) is not None)
 
-    try:
-        # === 跳过逻辑 ===
-        if os.path.exists(out_pdb):
-            print(f"[SKIP] {R}-{L}: Final PDB exists, skip all.")
-            # 直接提取得分
-            with open(out_pdb) as f:
-                for line in f:
-                    if line.startswith("REMARK Score:"):
-                        score = line.strip().replace("REMARK Score: ", "")
-                        return R, L, float(score)
-            return None
+    if not docked and cache_dir:
+        entry = cache.lookup(cache_dir, CACHE_NAMESPACE, inputs)
+        targets = {"result.out": out_name}
+        if entry and build_model and os.path.exists(os.path.join(entry, "result.out.pdb")):
+            targets["result.out.pdb"] = out_pdb
+        # 条目可能在 lookup 之后被并发淘汰：文件没有全部就位时按未命中处理
+        hit = entry is not None and cache.materialize(entry, targets)
+        cache.count(CACHE_NAMESPACE, hit)
+        if hit:
+            job_ledger.record(LEDGER_STEP, out_name, inputs)
+            if "result.out.pdb" in targets:
+                job_ledger.record(MODEL_LEDGER_STEP, out_pdb, inputs)
+            print(f"[CACHE] {pair_name}: reused cached docking output.")
+            docked = True
 
-        elif os.path.exists(out_name):
-            print(f"[RESUME] {R}-{L}: Out file exists, run createpl only.")
-            subprocess.run([
-                createpl_cmd,
-                f"{R}-{L}.out",
-                f"{R}-{L}.out.pdb",
-                "-nmax", "1",
-                "-complex"
-            ], check=True)
+    # 旧版本的输出目录中可能只保留了复合物 PDB
+    if not docked and model_done():
+        print(f"[SKIP] {pair_name}: Final PDB done, skip all.")
+        score = read_hdock_score(out_pdb)
+        return (R, L, score, [score]) if score is not None else None
 
+    # 所有命令都在私有临时目录中执行（cwd=），完成后 rename 到 output_dir，不修改进程的工作目录
+    scratch = make_scratch_dir(output_dir, pair_name, pdb_dir)
+    residues = r_entry["residues"] + l_entry["residues"]
+    scratch_out = os.path.join(scratch, f"{pair_name}.out")
+    scratch_pdb = os.path.join(scratch, f"{pair_name}.out.pdb")
+    try:
+        # === 跳过逻辑 ===
+        if docked:
+            print(f"[SKIP] {pair_name}: Docking done, skip docking.")
         else:
-            print(f"[RUN] {R}-{L}: Running hdock + createpl.")
-            subprocess.run([
-                hdock_cmd,
-                f"pdbs/{R}.pdb",
-                f"pdbs/{L}.pdb",
-                "-spacing", "1.2",
-                "-angle", "15",
-                "-out", f"{R}-{L}.out"
-            ], check=True, text=True)
-
-            subprocess.run([
-                createpl_cmd,
-                f"{R}-{L}.out",
-                f"{R}-{L}.out.pdb",
-                "-nmax", "1",
-                "-complex"
-            ], check=True)
+            with job_ledger.track(LEDGER_STEP, out_name, inputs) as run:
+                with resources.reserve(cpu=1, mem_gb=estimate_hdock(r_entry, l_entry)[0], label=f"hdock {pair_name}"):
+                    print(f"[RUN] {pair_name}: Running hdock.")
+                    ret = command_runner.run([
+                        hdock_cmd,
+                        f"pdbs/{R}.pdb",
+                        f"pdbs/{L}.pdb",
+                        "-spacing", HDOCK_SPACING,
+                        "-angle", HDOCK_ANGLE,
+                        "-out", f"{pair_name}.out"
+                    ], f"hdock {pair_name}", timeout=command_runner.timeout_for("hdock", residues),
+                        cwd=scratch, check=True)
+                os.replace(scratch_out, out_name)
+                run["exit_code"] = ret.returncode
+
+            if cache_dir:
+                try:
+                    cache.insert(cache_dir, CACHE_NAMESPACE, inputs, {"result.out": out_name},
+                                 meta={"receptor": R, "ligand": L, "spacing": HDOCK_SPACING, "angle": HDOCK_ANGLE})
+                except OSError as e:
+                    print(f"[WARNING] Failed to cache HDOCK output for {pair_name}: {e}")
 
         # 提取得分
-        if os.path.exists(f"{R}-{L}.out.pdb"):
-            with open(f"{R}-{L}.out.pdb") as f:
-                for line in f:
-                    if line.startswith("REMARK Score:"):
-                        score = line.strip().replace("REMARK Score: ", "")
-                        return R, L, float(score)
+        top_scores = read_top_scores(out_name, top_k)
+        if not top_scores:
+            print(f"[WARNING] No decoys in {pair_name}.out")
+            return None
+        score = top_scores[0]
+
+        # 只为需要的 pair 生成复合物模型
+        wanted = build_model or (model_threshold is not None and score <= model_threshold)
+        if wanted and not model_done():
+            print(f"[MODEL] {pair_name}: Running createpl (score {score:.2f}).")
+            cache.link_or_copy(out_name, scratch_out)
+            with job_ledger.track(MODEL_LEDGER_STEP, out_pdb, inputs) as run:
+                with resources.reserve(cpu=1, mem_gb=estimate_hdock(r_entry, l_entry)[0], label=f"createpl {pair_name}"):
+                    ret = command_runner.run([
+                        createpl_cmd,
+                        f"{pair_name}.out",
+                        f"{pair_name}.out.pdb",
+                        "-nmax", "1",
+                        "-complex"
+                    ], f"createpl {pair_name}", timeout=command_runner.timeout_for("createpl"),
+                        cwd=scratch, check=True)
+                os.replace(scratch_pdb, out_pdb)
+                run["exit_code"] = ret.returncode
+
+        return R, L, score, top_scores
 
     except subprocess.CalledProcessError as e:
-        print(f"[ERROR] Failed for {R}-{L}: {e}")
+        print(f"[ERROR] Failed for {pair_name}: {e}")
     except Exception as e:
-        print(f"[ERROR] Unexpected error for {R}-{L}: {e}")
+        print(f"[ERROR] Unexpected error for {pair_name}: {e}")
     finally:
-        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
 
     return None
 
 
-def main():
+def run_hdock_task(*args, cache_dir=None, **kwargs):
+    """进程池入口：子进程中的缓存命中统计在任务结束时直接写入 stats.tsv"""
+    try:
+        return run_hdock_on_pair(*args, cache_dir=cache_dir, **kwargs)
+    finally:
+        if cache_dir:
+            cache.flush_stats(cache_dir)
+
+
+def write_atomic(path, rows):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as out:
+        out.writelines(f"{row}\n" for row in rows)
+    os.replace(tmp, path)
+
+
+def write_results(results, result_file, top_k=1, append=False):
+    """
+    按得分排序写出 R, L, score；top_k > 1 时另写 RESULT_FILE_topK.tsv。
+    append 时排序后追加到已有结果之后，并把这些 pair 记入账本
+    """
+    results = sorted(results, key=lambda x: x[2], reverse=True)
+    rows = [f"{R}\t{L}\t{score:.4f}" for R, L, score, _ in results]
+    if append:
+        ledger.append_lines(result_file, rows)
+    else:
+        write_atomic(result_file, rows)
+
+    if top_k > 1:
+        top_k_file = f"{os.path.splitext(result_file)[0]}_top{top_k}.tsv"
+        top_rows = [f"{R}\t{L}\t{','.join(f'{s:.4f}' for s in top_scores)}" for R, L, _, top_scores in results]
+        if append:
+            ledger.append_lines(top_k_file, top_rows)
+        else:
+            write_atomic(top_k_file, top_rows)
+        print(f"[INFO] Top {top_k} scores per pair saved to {top_k_file}")
+
+    if append:
+        ledger.record(result_file, [canonical_pair(R, L) for R, L, _, _ in results])
+    else:
+        ledger.reset(result_file)
+
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Run HDOCK for protein pairs in parallel")
     parser.add_argument("-l","--pair_list", required=True, help="Protein pair list file")
     parser.add_argument("-d","--pdb_dir", required=True, help="Directory with PDB files")
@@ -120,52 +232,149 @@ def main():
     parser.add_argument("-p","--hdock_path", default=None, help="Optional path to HDOCK executables")
     parser.add_argument("-r","--result_file", default="hdock_result.txt", help="Output result file")
     parser.add_argument("-t", "--threads", type=int, default=8, help="Number of parallel HDOCK tasks (default: 8)")
-    args = parser.parse_args()
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread",
+                        help="Run parallel HDOCK tasks in a thread pool or a process pool (default: thread)")
+    parser.add_argument("--cache_dir", default=None,
+                        help="Shared docking result cache keyed by PDB content and HDOCK parameters")
+    parser.add_argument("--cache_max_gb", type=float, default=0,
+                        help="Evict least recently used cache entries above this size (default: no limit)")
+    parser.add_argument("--structure_index", default=None,
+                        help="Structure index file (TSV) reused across runs; only changed PDBs are re-parsed")
+    parser.add_argument("-k", "--top_k", type=int, default=1,
+                        help="Also write the top K decoy scores per pair to RESULT_FILE_topK.tsv (default: 1, off)")
+    parser.add_argument("--model_threshold", type=float, default=None,
+                        help="Build the complex PDB with createpl only for pairs whose best score is <= this value")
+    parser.add_argument("--model_pairs", default=None,
+                        help="Pair list file; build complex PDBs for these pairs regardless of score")
+    parser.add_argument("--all_models", action="store_true",
+                        help="Build complex PDBs for every pair (previous default behaviour)")
+    parser.add_argument("--resource_dir", default=None,
+                        help="Shared CPU/GPU/memory pool directory; jobs wait for free resources (default: $PPI_RESOURCE_DIR)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only dock pairs missing from the result file's ledger and append their scores")
+    parser.add_argument("--job_ledger", default=None,
+                        help="SQLite job ledger consulted before each docking (default: $PPI_JOB_LEDGER, "
+                             "or OUTPUT_DIR/jobs.sqlite)")
+    parser.add_argument("--timeout_scale", type=float, default=None,
+                        help="Multiply the per-command wall-clock timeouts (scaled by sequence length); 0 disables "
+                             "them (default: $PPI_TIMEOUT_SCALE or 1)")
+    parser.add_argument("--retries", type=int, default=None,
+                        help="Retries for timed-out or transiently failed commands, with exponential backoff "
+                             "(default: $PPI_RETRIES or 0)")
+    return parser
+
+
+def run(args, pairs=None, structures=None):
+    """
+    执行 HDOCK 步骤。
+    pairs:      已读取的规范化 pair 列表，省略时读取 args.pair_list
+    structures: args.pdb_dir 的结构索引（structure_index.build_index），省略时重新建立
+    """
+    resources.configure(args.resource_dir)
+    command_runner.configure(args.timeout_scale, args.retries)
+    job_ledger.configure(args.job_ledger, default_dir=args.output_dir)
 
     args.output_dir = os.path.abspath(args.output_dir)
     args.pdb_dir = os.path.abspath(args.pdb_dir)
     args.result_file = os.path.abspath(args.result_file)
     args.hdock_path = os.path.abspath(args.hdock_path) if args.hdock_path else None
+    args.cache_dir = os.path.abspath(args.cache_dir) if args.cache_dir else None
     
-    # ✅ 读取所有配对，并将字母转为小写
-    pairs = []
-    with open(args.pair_list, "r") as f:
-        for line in f:
-            if line.strip() and not line.startswith("ID"):
-                id1, id2 = line.strip().split()
-                id1, id2 = id1.lower(), id2.lower()   # ✅ 转为小写
-                pairs.append((id1, id2))
+    # 规范化、去重后的 pair 列表（小写，A B 与 B A 只保留一个）
+    if pairs is None:
+        pairs = read_pair_list(args.pair_list)
+    if args.incremental:
+        pairs = ledger.select_pending(pairs, ledger.read_ledger(args.result_file), "HDOCK")
+
+    print(f"[INFO] Loaded {len(pairs)} pairs. Running with {args.threads} {args.executor} workers...")
 
-    print(f"[INFO] Loaded {len(pairs)} pairs. Running with {args.threads} threads...")
+    if structures is None:
+        structures = build_index(args.pdb_dir, args.structure_index)
 
     results = []
 
-    # 并行运行 HDOCK
-    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+    model_pairs = set(read_pair_list(args.model_pairs)) if args.model_pairs else set()
+
+    def task_kwargs(id1, id2):
+        # 只传递本 pair 的两条索引记录，进程池下不必每个任务都序列化整个索引
+        return dict(cache_dir=args.cache_dir,
+                    structures={pid: structures[pid] for pid in (id1, id2) if pid in structures},
+                    top_k=args.top_k,
+                    model_threshold=args.model_threshold,
+                    build_model=args.all_models or (id1, id2) in model_pairs)
+
+    rep_results = {}
+
+    def collect(pair, result):
+        if result:
+            results.append(result)
+            rep_results[pair] = result
+            R, L, score, _ = result
+            print(f"[OK] {R}-{L}: Score={score:.3f}")
+
+    # 受体、配体 PDB 内容相同的 pair 只对接一次
+    unique_pairs, aliases = dedup_pairs(pairs, structures, "HDOCK pairs")
+
+    # 估算内存超过上限的 pair 放入大任务队列，其余 pair 完成后逐个运行
+    normal_pairs, large_pairs = split_large(
+        unique_pairs,
+        lambda pair: estimate_hdock(structures[pair[0]], structures[pair[1]])
+        if pair[0] in structures and pair[1] in structures else (0, 0),
+        "HDOCK", name_fn="-".join
+    )
+
+    # 并行运行 HDOCK；各任务在独立的临时目录中执行，可安全地并发
+    executor_cls = ProcessPoolExecutor if args.executor == "process" else ThreadPoolExecutor
+    task = run_hdock_task if args.executor == "process" else run_hdock_on_pair
+    with executor_cls(max_workers=args.threads) as executor:
         future_to_pair = {
-            executor.submit(run_hdock_on_pair, id1, id2, args.pdb_dir, args.output_dir, args.hdock_path): (id1, id2)
-            for id1, id2 in pairs
+            executor.submit(task, id1, id2, args.pdb_dir, args.output_dir, args.hdock_path,
+                            **task_kwargs(id1, id2)): (id1, id2)
+            for id1, id2 in normal_pairs
         }
 
         for future in as_completed(future_to_pair):
             pair = future_to_pair[future]
             try:
-                result = future.result()
-                if result:
-                    results.append(result)
-                    R, L, score = result
-                    print(f"[OK] {R}-{L}: Score={score:.3f}")
+                collect(pair, future.result())
             except Exception as e:
                 print(f"[ERROR] Exception in {pair}: {e}")
 
+    for id1, id2 in large_pairs:
+        try:
+            collect((id1, id2), run_hdock_on_pair(id1, id2, args.pdb_dir, args.output_dir, args.hdock_path,
+                                      **task_kwargs(id1, id2)))
+        except Exception as e:
+            print(f"[ERROR] Exception in {(id1, id2)}: {e}")
+
+    # 其他进程可能仍在使用同一 output_dir，只删除空的临时目录
+    try:
+        os.rmdir(os.path.join(args.output_dir, SCRATCH_DIR))
+    except OSError:
+        pass
+
+    if args.cache_dir:
+        cache.flush_stats(args.cache_dir)
+        if args.cache_max_gb:
+            cache.evict(args.cache_dir, int(args.cache_max_gb * 1024 ** 3))
+
+    # 重复的 pair 复用代表 pair 的得分
+    for alias, rep in aliases.items():
+        chosen = choose_receptor_ligand(structures, args.pdb_dir, *alias)
+        if rep in rep_results and chosen:
+            results.append(chosen[:2] + rep_results[rep][2:])
+
     # 排序并写出结果
-    results.sort(key=lambda x: x[2], reverse=True)
-    with open(args.result_file, "w") as out:
-        for R, L, score in results:
-            out.write(f"{R}\t{L}\t{score:.4f}\n")
+    write_results(results, args.result_file, args.top_k, append=args.incremental)
 
     print(f"[DONE] All {len(pairs)} pairs processed. Results saved to {args.result_file}")
 
 
+def main():
+    args = build_parser().parse_args()
+    command_runner.install_signal_handlers()
+    run(args)
+
+
 if __name__ == "__main__":
     main()
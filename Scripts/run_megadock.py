@@ -1,75 +1,196 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-# Hongxiang Li, 2025/07/09 (modified: added .out existence check)
+# Hongxiang Li, 2025/07/09 (modified: job ledger instead of .out existence check, multi-device worker pool, persistent containers)
 
 import os
 import argparse
 import subprocess
 import sys
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def get_pdb_length(pdb_file):
-    """计算PDB中氨基酸的数量（CA原子行数）"""
-    count = 0
-    with open(pdb_file, "r") as f:
-        for line in f:
-            if line.startswith("ATOM") and " CA " in line:
-                count += 1
-    return count
-
-def run_megadock(pdb1, pdb2, output_dir, pdb_dir, docker_image, n_decoys, t, cpu_cores):
-    """执行 MEGADOCK 对接和得分计算"""
+from dedup import dedup_pairs
+from megadock_score import ppi_score, read_decoy_scores
+from memory_model import estimate_megadock, split_large
+from pair_list import read_pair_list
+from structure_index import build_index, choose_receptor_ligand
+import cache
+import command_runner
+import job_ledger
+import ledger
+import resources
+
+CACHE_NAMESPACE = "megadock"
+LEDGER_STEP = "megadock"
+
+def parse_devices(devices):
+    """解析 --devices 参数，返回 GPU 编号列表；None 表示使用全部 GPU"""
+    if not devices or devices.strip().lower() == "all":
+        return None
+    return [d.strip() for d in devices.split(",") if d.strip()]
+
+
+def build_device_slots(workers, devices):
+    """为每个 worker 分配一个设备槽位，GPU 编号轮流分配"""
+    if not devices:
+        return [None] * workers
+    return [devices[i % len(devices)] for i in range(workers)]
+
+
+def gpu_option(device):
+    """生成 docker 的 --gpus 参数，指定设备时容器内只可见该 GPU"""
+    if device is None:
+        return ["--gpus", "all"]
+    return ["--gpus", f'"device={device}"']
+
+
+def start_megadock_container(name, pdb_dir, output_dir, docker_image, cpu_cores, device=None):
+    """启动常驻 MEGADOCK 容器，之后的对接和 ppiscore 都通过 docker exec 在其中执行"""
+    os.makedirs(output_dir, exist_ok=True)
+    cmd = (
+        ["docker", "run", "-d", "--rm", "--name", name] + gpu_option(device) +
+        ["-e", f"OMP_NUM_THREADS={cpu_cores}",
+         "-v", f"{os.path.abspath(pdb_dir)}:/opt/MEGADOCK/data",
+         "-v", f"{os.path.abspath(output_dir)}:/opt/MEGADOCK/out",
+         "--entrypoint", "sleep", docker_image, "infinity"]
+    )
+    print(f"[INFO] Starting persistent MEGADOCK container {name}" + (f" on GPU {device}" if device is not None else ""))
+    command_runner.run(cmd, f"start MEGADOCK container {name}", timeout=command_runner.timeout_for("docker"),
+                       capture=True, check=True, cleanup=command_runner.docker_cleanup(name))
+    return name
+
+
+def stop_megadock_container(name):
+    """停止并删除常驻容器"""
+    command_runner.run(["docker", "rm", "-f", name], f"stop MEGADOCK container {name}",
+                       timeout=command_runner.timeout_for("docker"), capture=True)
+    print(f"[INFO] Stopped persistent MEGADOCK container {name}")
+
+
+def megadock_cache_key(r_sha256, l_sha256, n_decoys, t):
+    """对接结果缓存 key：受体/配体 PDB 内容哈希（来自结构索引）+ MEGADOCK 参数"""
+    return cache.make_key(CACHE_NAMESPACE, r_sha256, l_sha256, f"N={n_decoys}", f"t={t}")
+
+
+def out_complete(out_path, n_decoys):
+    """账本中没有记录的旧 .out：decoy 数达到 -N 才视为完整"""
+    return len(read_decoy_scores(out_path, n_decoys)) == n_decoys
+
+
+def materialize_cached(cache_dir, cache_key, out_path):
+    """缓存命中时把 .out 链接到输出目录，返回是否命中；条目被并发淘汰、.out 没有就位时按未命中处理"""
+    entry = cache.lookup(cache_dir, CACHE_NAMESPACE, cache_key)
+    hit = entry is not None and cache.materialize(entry, {"result.out": out_path})
+    cache.count(CACHE_NAMESPACE, hit)
+    return hit
+
+
+def run_megadock(pdb1, pdb2, output_dir, pdb_dir, docker_image, n_decoys, t, cpu_cores, device=None, container=None,
+                 score_mode="native", cache_dir=None, structures=None):
+    """执行 MEGADOCK 对接和得分计算；指定 container 时在常驻容器中执行"""
     id1 = os.path.basename(pdb1).replace(".pdb", "")
     id2 = os.path.basename(pdb2).replace(".pdb", "")
 
-    # 判断长短，决定 -R -L
-    len1 = get_pdb_length(pdb1)
-    len2 = get_pdb_length(pdb2)
-
-    if len1 >= len2:
-        R, L = id1, id2
-    else:
-        R, L = id2, id1
+    # 按结构索引中的残基数决定 -R -L
+    chosen = choose_receptor_ligand(structures if structures is not None else {}, pdb_dir, id1, id2)
+    if chosen is None:
+        print(f"[WARNING] Missing PDB file for pair: {id1}, {id2}")
+        return id1, id2, None
+    R, L, r_entry, l_entry = chosen
 
     # 准备文件路径
     os.makedirs(output_dir, exist_ok=True)
     out_basename = f"{R}-{L}.out"
     out_path_host = os.path.abspath(os.path.join(output_dir, out_basename))
 
-    # 如果 .out 已存在，跳过对接
-    if os.path.exists(out_path_host):
-        print(f"[INFO] Output {out_basename} already exists, skipping docking step.")
+    # 任务账本：输入（两个 PDB 的内容哈希 + MEGADOCK 参数）未变且已完成时跳过对接
+    inputs = megadock_cache_key(r_entry["sha256"], l_entry["sha256"], n_decoys, t)
+    if job_ledger.is_done(LEDGER_STEP, out_path_host, inputs, adopt=lambda: out_complete(out_path_host, n_decoys)):
+        print(f"[INFO] Output {out_basename} already done, skipping docking step.")
+    elif cache_dir and materialize_cached(cache_dir, inputs, out_path_host):
+        job_ledger.record(LEDGER_STEP, out_path_host, inputs)
+        print(f"[CACHE] {R} vs {L}: reused cached docking output.")
     else:
-        # MEGADOCK 对接命令
-        dock_cmd = (
-            "docker run --rm --gpus all "
-            f"-e OMP_NUM_THREADS={cpu_cores} "
-            f"-v {os.path.abspath(pdb_dir)}:/opt/MEGADOCK/data "
-            f"-v {os.path.abspath(output_dir)}:/opt/MEGADOCK/out "
-            f"{docker_image} "
-            "megadock-gpu "
-            f"-R /opt/MEGADOCK/data/{R}.pdb "
-            f"-L /opt/MEGADOCK/data/{L}.pdb "
-            f"-o /opt/MEGADOCK/out/{out_basename} "
-            f"-N {n_decoys} -t {t}"
-        )
-        print(f"[INFO] Running MEGADOCK for {R} vs {L}") 
-        ret = subprocess.run(dock_cmd, shell=True)
-        if ret.returncode != 0:
+        # MEGADOCK 写入同目录下的临时文件，成功后 rename 为 .out，被 kill 的任务不会留下半个 .out
+        partial_host = job_ledger.partial_path(out_path_host)
+        # MEGADOCK 对接命令；运行前按 FFT 网格大小估算内存，从资源池申请 CPU/GPU/内存
+        # （常驻容器已固定设备，只做计数）
+        host_gb, gpu_gb = estimate_megadock(r_entry, l_entry)
+        try:
+            with job_ledger.track(LEDGER_STEP, out_path_host, inputs) as run:
+                with resources.reserve(cpu=cpu_cores, gpus=1, mem_gb=host_gb, gpu_mem_gb=gpu_gb, device=device,
+                                       label=f"megadock {R}-{L}") as gpu:
+                    # 超时按两条链的残基数估算；超时或取消时删除 docker run 启动的容器
+                    # （常驻容器中 docker exec 的进程无法单独删除，只终止客户端）
+                    cleanup = []
+                    if container:
+                        docker_prefix = ["docker", "exec", container]
+                    else:
+                        device = gpu
+                        name = command_runner.container_name(f"megadock-{R}-{L}")
+                        cleanup = command_runner.docker_cleanup(name)
+                        docker_prefix = (
+                            ["docker", "run", "--rm", "--name", name] + gpu_option(device) +
+                            ["-e", f"OMP_NUM_THREADS={cpu_cores}",
+                             "-v", f"{os.path.abspath(pdb_dir)}:/opt/MEGADOCK/data",
+                             "-v", f"{os.path.abspath(output_dir)}:/opt/MEGADOCK/out",
+                             docker_image]
+                        )
+                    dock_cmd = docker_prefix + [
+                        "megadock-gpu",
+                        "-R", f"/opt/MEGADOCK/data/{R}.pdb",
+                        "-L", f"/opt/MEGADOCK/data/{L}.pdb",
+                        "-o", f"/opt/MEGADOCK/out/{os.path.basename(partial_host)}",
+                        "-N", n_decoys, "-t", t,
+                    ]
+                    print(f"[INFO] Running MEGADOCK for {R} vs {L}" + (f" on GPU {device}" if device is not None else ""))
+                    timeout = command_runner.timeout_for("megadock", r_entry["residues"] + l_entry["residues"])
+                    ret = command_runner.run(dock_cmd, f"MEGADOCK {R} vs {L}", timeout=timeout, cleanup=cleanup)
+                run["exit_code"] = ret.returncode
+                run["ok"] = ret.returncode == 0 and os.path.exists(partial_host)
+                if run["ok"]:
+                    os.replace(partial_host, out_path_host)
+        finally:
+            if os.path.exists(partial_host):
+                os.remove(partial_host)
+        if not run["ok"]:
             print(f"[ERROR] MEGADOCK docking failed for {R} vs {L} (return code {ret.returncode})")
             return R, L, None
+        if cache_dir:
+            try:
+                cache.insert(cache_dir, CACHE_NAMESPACE, inputs, {"result.out": out_path_host},
+                             meta={"receptor": R, "ligand": L, "N": n_decoys, "t": t})
+            except OSError as e:
+                print(f"[WARNING] Failed to cache MEGADOCK output for {R} vs {L}: {e}")
 
-    # 获取得分
-    ppiscore_cmd = (
-        "docker run --rm "
-        f"-v {os.path.abspath(output_dir)}:/opt/MEGADOCK/out "
-        f"{docker_image} "
-        f"ppiscore out/{out_basename} {n_decoys}"
-    )
+    # 获取得分：默认直接解析 .out 文件，docker 模式下调用容器内的 ppiscore
+    if score_mode == "native":
+        try:
+            return R, L, ppi_score(out_path_host, n_decoys)
+        except Exception as e:
+            print(f"[ERROR] Failed to score {out_basename} for {R} vs {L}: {e}")
+            return R, L, None
+
+    cleanup = []
+    if container:
+        ppiscore_cmd = ["docker", "exec", container]
+    else:
+        name = command_runner.container_name(f"ppiscore-{R}-{L}")
+        cleanup = command_runner.docker_cleanup(name)
+        ppiscore_cmd = [
+            "docker", "run", "--rm", "--name", name,
+            "-v", f"{os.path.abspath(output_dir)}:/opt/MEGADOCK/out",
+            docker_image,
+        ]
+    ppiscore_cmd += ["ppiscore", f"out/{out_basename}", n_decoys]
     try:
-        result = subprocess.check_output(ppiscore_cmd, shell=True, stderr=subprocess.STDOUT).decode()
+        with resources.reserve(cpu=1, label=f"ppiscore {R}-{L}"):
+            result = command_runner.run(ppiscore_cmd, f"ppiscore {R} vs {L}",
+                                        timeout=command_runner.timeout_for("ppiscore"), capture=True, check=True,
+                                        cleanup=cleanup).stdout.decode()
     except subprocess.CalledProcessError as e:
-        print(f"[ERROR] ppiscore failed for {R} vs {L}: {e.output.decode().strip()}")
+        print(f"[ERROR] ppiscore failed for {R} vs {L}: {e.stderr.strip()}")
         return R, L, None
 
     # 提取得分
@@ -89,7 +210,30 @@ def run_megadock(pdb1, pdb2, output_dir, pdb_dir, docker_image, n_decoys, t, cpu
     print(f"[WARNING] No score parsed for {R} vs {L} (ppiscore output did not contain expected pattern)")
     return R, L, None
 
-def main():
+def run_megadock_in_slot(slots, pdb1, pdb2, **kwargs):
+    """从槽位队列中取得一个 (设备, 常驻容器)，执行完成后归还"""
+    device, container = slots.get()
+    try:
+        return run_megadock(pdb1, pdb2, device=device, container=container, **kwargs)
+    finally:
+        slots.put((device, container))
+
+
+def write_results(results, result_file, append=False):
+    """按得分从大到小排序后写出；results 为 "R\tL\tscore" 行。append 时排序后追加到已有结果之后"""
+    results_sorted = sorted(results, key=lambda x: float(x.strip().split("\t")[2]), reverse=True)
+    if append:
+        ledger.append_lines(result_file, results_sorted)
+        ledger.record(result_file, [ledger.pair_from_row(row) for row in results_sorted])
+        return
+    tmp = f"{result_file}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as out:
+        out.write("\n".join(results_sorted))
+    os.replace(tmp, result_file)
+    ledger.reset(result_file)
+
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Run MEGADOCK for PPI prediction")
     parser.add_argument("-l","--pair_list", required=True, help="Protein pair list file (ID1 ID2)")
     parser.add_argument("-d","--pdb_dir", required=True, help="Directory containing PDB files")
@@ -99,54 +243,170 @@ def main():
     parser.add_argument("-N", type=int, default=10800, help="Number of decoys, default 10800")
     parser.add_argument("-t", type=int, default=3, help="Thread number for FFT, default 3")
     parser.add_argument("-e", type=int, default=32, help="Number of CPU cores (OMP_NUM_THREADS), default 32")
+    parser.add_argument("-w","--workers", type=int, default=None,
+                        help="Number of concurrent MEGADOCK jobs (default: number of --devices, or 1)")
+    parser.add_argument("--devices", default=None,
+                        help="Comma-separated GPU IDs assigned to workers in turn, e.g. 0,1,2,3 (default: all GPUs)")
+    parser.add_argument("--score_mode", choices=["native", "docker"], default="native",
+                        help="Compute the PPI score from the .out file in Python (native) or with ppiscore in the container")
+    parser.add_argument("--persistent", action="store_true",
+                        help="Start one long-lived container per worker and run all dockings/ppiscore via docker exec")
+    parser.add_argument("--cache_dir", default=None,
+                        help="Shared docking result cache keyed by PDB content and MEGADOCK parameters")
+    parser.add_argument("--cache_max_gb", type=float, default=0,
+                        help="Evict least recently used cache entries above this size (default: no limit)")
+    parser.add_argument("--structure_index", default=None,
+                        help="Structure index file (TSV) reused across runs; only changed PDBs are re-parsed")
+    parser.add_argument("--resource_dir", default=None,
+                        help="Shared CPU/GPU/memory pool directory; jobs wait for free resources (default: $PPI_RESOURCE_DIR)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only dock pairs missing from the result file's ledger and append their scores")
+    parser.add_argument("--job_ledger", default=None,
+                        help="SQLite job ledger consulted before each docking (default: $PPI_JOB_LEDGER, "
+                             "or OUTPUT_DIR/jobs.sqlite)")
+    parser.add_argument("--timeout_scale", type=float, default=None,
+                        help="Multiply the per-command wall-clock timeouts (scaled by sequence length); 0 disables "
+                             "them (default: $PPI_TIMEOUT_SCALE or 1)")
+    parser.add_argument("--retries", type=int, default=None,
+                        help="Retries for timed-out or transiently failed commands, with exponential backoff "
+                             "(default: $PPI_RETRIES or 0)")
+    return parser
+
+
+def run(args, pairs=None, structures=None):
+    """
+    执行 MEGADOCK 步骤；参数不合法、常驻容器启动失败或结果写入失败时抛出 RuntimeError / ValueError。
+    pairs:      已读取的规范化 pair 列表，省略时读取 args.pair_list
+    structures: args.pdb_dir 的结构索引（structure_index.build_index），省略时重新建立
+    """
+    resources.configure(args.resource_dir)
+    command_runner.configure(args.timeout_scale, args.retries)
+    job_ledger.configure(args.job_ledger, default_dir=args.output_dir)
 
-    args = parser.parse_args()
+    devices = parse_devices(args.devices)
+    workers = args.workers if args.workers is not None else (len(devices) if devices else 1)
+    if workers < 1:
+        raise ValueError("--workers must be at least 1")
+    # 并发任务之间平分 OMP 线程
+    omp_threads = max(1, args.e // workers)
 
     results = []
 
-    if not os.path.isfile(args.pair_list):
-        print(f"[ERROR] Pair list file not found: {args.pair_list}")
-        sys.exit(1)
+    if pairs is None and not os.path.isfile(args.pair_list):
+        raise ValueError(f"Pair list file not found: {args.pair_list}")
 
-    with open(args.pair_list, 'r') as f:
-        for line in f:
-            if line.strip() and not line.strip().startswith("ID"):
-                parts = line.strip().split()
-                if len(parts) < 2:
-                    print(f"[WARNING] Skipping malformed line: {line.strip()}")
-                    continue
-                id1, id2 = parts[0], parts[1]
-                id1, id2 = id1.lower(), id2.lower()   # ✅ 转为小写
-                pdb1 = os.path.join(args.pdb_dir, f"{id1}.pdb")
-                pdb2 = os.path.join(args.pdb_dir, f"{id2}.pdb")
+    if structures is None:
+        structures = build_index(args.pdb_dir, args.structure_index)
 
-                if not os.path.exists(pdb1) or not os.path.exists(pdb2):
-                    print(f"[WARNING] Missing PDB file for pair: {id1}, {id2}")
-                    continue
+    # 规范化、去重后的 pair 列表（小写，A B 与 B A 只保留一个）
+    listed = read_pair_list(args.pair_list) if pairs is None else pairs
+    if args.incremental:
+        listed = ledger.select_pending(listed, ledger.read_ledger(args.result_file), "MEGADOCK")
+    pairs = []
+    for id1, id2 in listed:
+        if id1 not in structures or id2 not in structures:
+            print(f"[WARNING] Missing PDB file for pair: {id1}, {id2}")
+            continue
+        pairs.append((id1, id2))
+
+    print(f"[INFO] Loaded {len(pairs)} pairs. Running with {workers} workers, "
+          f"OMP_NUM_THREADS={omp_threads} per job...")
 
-                R, L, score = run_megadock(
-                    pdb1, pdb2,
-                    output_dir=args.output_dir,
-                    pdb_dir=args.pdb_dir,
-                    docker_image=args.docker_image,
-                    n_decoys=args.N,
-                    t=args.t,
-                    cpu_cores=args.e
+    # 受体、配体 PDB 内容相同的 pair 只对接一次
+    unique_pairs, aliases = dedup_pairs(pairs, structures, "MEGADOCK pairs")
+
+    # 估算内存超过上限的 pair 放入大任务队列，其余 pair 完成后逐个运行
+    normal_pairs, large_pairs = split_large(
+        unique_pairs, lambda pair: estimate_megadock(structures[pair[0]], structures[pair[1]]), "MEGADOCK",
+        name_fn="-".join
+    )
+    task_kwargs = dict(
+        output_dir=args.output_dir,
+        pdb_dir=args.pdb_dir,
+        docker_image=args.docker_image,
+        n_decoys=args.N,
+        t=args.t,
+        cpu_cores=omp_threads,
+        score_mode=args.score_mode,
+        cache_dir=args.cache_dir,
+        structures=structures
+    )
+    scores = {}
+
+    def collect(pair, R, L, score):
+        if score is not None:
+            results.append(f"{R}\t{L}\t{score:.4f}")
+            scores[pair] = score
+
+    def pdb_paths(pair):
+        return tuple(os.path.join(args.pdb_dir, f"{pid}.pdb") for pid in pair)
+
+    # 每个 worker 对应一个设备槽位，--persistent 时再附带一个常驻容器
+    slots = Queue()
+    containers = []
+    try:
+        for i, device in enumerate(build_device_slots(workers, devices)):
+            container = None
+            if args.persistent:
+                container = start_megadock_container(
+                    f"megadock-{os.getpid()}-{i}", args.pdb_dir, args.output_dir,
+                    args.docker_image, omp_threads, device
                 )
+                containers.append(container)
+            slots.put((device, container))
 
-                if score is not None:
-                    results.append(f"{R}\t{L}\t{score:.4f}")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(run_megadock_in_slot, slots, *pdb_paths(pair), **task_kwargs): pair
+                for pair in normal_pairs
+            }
 
-    # 按得分从大到小排序
-    results_sorted = sorted(results, key=lambda x: float(x.strip().split("\t")[2]), reverse=True)
+            for future in as_completed(futures):
+                try:
+                    R, L, score = future.result()
+                except Exception as e:
+                    print(f"[ERROR] Exception in {futures[future]}: {e}")
+                    continue
+                collect(futures[future], R, L, score)
+
+        for pair in large_pairs:
+            try:
+                R, L, score = run_megadock_in_slot(slots, *pdb_paths(pair), **task_kwargs)
+            except Exception as e:
+                print(f"[ERROR] Exception in {pair}: {e}")
+                continue
+            collect(pair, R, L, score)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to start persistent MEGADOCK container: {e}") from e
+    finally:
+        for container in containers:
+            stop_megadock_container(container)
+        if args.cache_dir:
+            cache.flush_stats(args.cache_dir)
+            if args.cache_max_gb:
+                cache.evict(args.cache_dir, int(args.cache_max_gb * 1024 ** 3))
+
+    # 重复的 pair 复用代表 pair 的得分
+    for alias, rep in aliases.items():
+        chosen = choose_receptor_ligand(structures, args.pdb_dir, *alias)
+        if rep in scores and chosen:
+            results.append(f"{chosen[0]}\t{chosen[1]}\t{scores[rep]:.4f}")
 
     # 写入输出文件
     try:
-        with open(args.result_file, 'w') as out:
-            out.write("\n".join(results_sorted))
+        write_results(results, args.result_file, append=args.incremental)
         print(f"[DONE] MEGADOCK completed. Results saved to {args.result_file}")
     except Exception as e:
-        print(f"[ERROR] Failed to write result file {args.result_file}: {e}")
+        raise RuntimeError(f"Failed to write result file {args.result_file}: {e}") from e
+
+
+def main():
+    args = build_parser().parse_args()
+    command_runner.install_signal_handlers()
+    try:
+        run(args)
+    except (RuntimeError, ValueError) as e:
+        print(f"[ERROR] {e}")
         sys.exit(1)
 
 
@@ -4,9 +4,14 @@
 import argparse
 import os
 import shutil
-import subprocess
 import sys
 
+import command_runner
+import job_ledger
+import resources
+from pipeline_dag import run_dag
+from ppi_prediction import PipelineData, dock_hdock, dock_megadock, fold_complexes, fold_monomers, merge
+
 
 def check_file(path, label):
     if not os.path.isfile(path):
@@ -46,15 +51,14 @@ def build_paths(base_dir):
         "af_complex_output_dir": os.path.join(base_dir, "af_complex_out"),
         "af_complex_result": os.path.join(base_dir, "af_complex.tsv"),
         "merged_result": os.path.join(base_dir, "merged_scores.tsv"),
+        "structure_index": os.path.join(base_dir, "structure_index.tsv"),
     }
 
 
-def run_command(cmd, description):
+def run_stage(description, stage, *stage_args, **stage_kwargs):
+    """在本进程中运行一个步骤；失败时异常直接向上传递"""
     print(f"[STEP] {description}")
-    print("[CMD] " + " ".join(cmd))
-    result = subprocess.run(cmd)
-    if result.returncode != 0:
-        raise RuntimeError(f"{description} failed with exit code {result.returncode}")
+    return stage(*stage_args, **stage_kwargs)
 
 
 def validate_environment(args, paths):
@@ -69,93 +73,77 @@ def validate_environment(args, paths):
     if not args.skip_hdock:
         maybe_check_hdock(args.hdock_path)
 
-    if args.convert_complex_pdb or not args.skip_single_af:
-        check_command("pymol", "PyMOL")
-
-
-def run_single_alphafold(script_path, args, paths):
-    cmd = [
-        sys.executable,
-        script_path,
-        "--step", args.af_step,
-        "--fasta", args.fasta,
-        "--json_dir", paths["af_json_dir"],
-        "--output_dir", paths["af_output_dir"],
-        "--parameter_dir", args.parameter_dir,
-        "--database_dir", args.database_dir,
-        "--docker_image", args.af_docker_image,
-    ]
+
+def cache_options(args):
+    return {"cache_dir": args.cache_dir, "cache_max_gb": args.cache_max_gb}
+
+
+def af_worker_options(args):
+    if not args.af_persistent_worker:
+        return {}
+    return {"persistent_worker": True, "gpus": args.af_gpus}
+
+
+def run_single_alphafold(args, paths, data):
+    options = {"docker_image": args.af_docker_image}
     if args.af_step == "Msa":
-        cmd.extend(["--num_workers", str(args.num_workers)])
-    run_command(cmd, "AlphaFold3 single-protein prediction")
+        options["num_workers"] = args.num_workers
+    else:
+        options.update(cache_options(args))
+        if args.af_stream:
+            options.update(stream=True, num_workers=args.num_workers, queue_depth=args.af_queue_depth,
+                           gpus=args.af_gpus)
+        else:
+            options.update(af_worker_options(args))
+    return run_stage("AlphaFold3 single-protein prediction", fold_monomers, data, paths["af_json_dir"],
+                     paths["af_output_dir"], args.parameter_dir, args.database_dir, step=args.af_step, **options)
 
 
-def run_megadock(script_path, args, paths):
+def run_megadock(args, paths, data):
     pdb_dir = os.path.join(paths["af_output_dir"], "pdbs")
     check_dir(pdb_dir, "AlphaFold3 single-protein PDB directory")
-    cmd = [
-        sys.executable,
-        script_path,
-        "--pair_list", args.pair_list,
-        "--pdb_dir", pdb_dir,
-        "--output_dir", paths["megadock_output_dir"],
-        "--result_file", paths["megadock_result"],
-        "--docker_image", args.megadock_docker_image,
-        "-N", str(args.megadock_decoys),
-        "-t", str(args.megadock_fft_threads),
-        "-e", str(args.megadock_cpu_cores),
-    ]
-    run_command(cmd, "MEGADOCK docking")
-
-
-def run_hdock(script_path, args, paths):
+    run_stage(
+        "MEGADOCK docking", dock_megadock, data, pdb_dir, paths["megadock_output_dir"], paths["megadock_result"],
+        n_decoys=args.megadock_decoys, fft_threads=args.megadock_fft_threads, cpu_cores=args.megadock_cpu_cores,
+        docker_image=args.megadock_docker_image, workers=args.megadock_workers, devices=args.megadock_devices,
+        persistent=args.megadock_persistent, incremental=args.incremental, **cache_options(args)
+    )
+
+
+def run_hdock(args, paths, data):
     pdb_dir = os.path.join(paths["af_output_dir"], "pdbs")
     check_dir(pdb_dir, "AlphaFold3 single-protein PDB directory")
-    cmd = [
-        sys.executable,
-        script_path,
-        "--pair_list", args.pair_list,
-        "--pdb_dir", pdb_dir,
-        "--output_dir", paths["hdock_output_dir"],
-        "--result_file", paths["hdock_result"],
-        "--threads", str(args.hdock_threads),
-    ]
-    if args.hdock_path:
-        cmd.extend(["--hdock_path", args.hdock_path])
-    run_command(cmd, "HDOCK docking")
-
-
-def run_complex_alphafold(script_path, args, paths):
-    cmd = [
-        sys.executable,
-        script_path,
-        "--pair_list", args.pair_list,
-        "--fasta", args.fasta,
-        "--json_dir", paths["af_complex_json_dir"],
-        "--output_dir", paths["af_complex_output_dir"],
-        "--model_dir", args.parameter_dir,
-        "--database_dir", args.database_dir,
-        "--docker_image", args.af_docker_image,
-        "--outfile", paths["af_complex_result"],
-    ]
-    if args.convert_complex_pdb:
-        cmd.append("--convert_pdb")
-    run_command(cmd, "AlphaFold3 complex prediction")
-
-
-def run_merge(script_path, args, paths):
-    cmd = [
-        sys.executable,
-        script_path,
-        "--output", paths["merged_result"],
-    ]
+    run_stage(
+        "HDOCK docking", dock_hdock, data, pdb_dir, paths["hdock_output_dir"], paths["hdock_result"],
+        threads=args.hdock_threads, executor=args.hdock_executor, hdock_path=args.hdock_path,
+        model_threshold=args.hdock_model_threshold, all_models=args.hdock_all_models,
+        incremental=args.incremental, **cache_options(args)
+    )
+
+
+def run_complex_alphafold(args, paths, data):
+    msa_dirs = []
+    if not args.no_msa_reuse:
+        # 复用单蛋白步骤得到的 MSA 和模板；在单蛋白步骤结束后才检查目录是否存在
+        msa_dirs = [msa_dir for msa_dir in (paths["af_output_dir"], os.path.join(paths["af_json_dir"], "msa"))
+                    if os.path.isdir(msa_dir)]
+    run_stage(
+        "AlphaFold3 complex prediction", fold_complexes, data, paths["af_complex_json_dir"],
+        paths["af_complex_output_dir"], args.parameter_dir, args.database_dir, paths["af_complex_result"],
+        docker_image=args.af_docker_image, convert_pdb=args.convert_complex_pdb, incremental=args.incremental,
+        msa_dir=msa_dirs, **af_worker_options(args)
+    )
+
+
+def run_merge(args, paths):
+    sources = {}
     if not args.skip_megadock and os.path.exists(paths["megadock_result"]):
-        cmd.extend(["--megadock", paths["megadock_result"]])
+        sources["megadock"] = paths["megadock_result"]
     if not args.skip_hdock and os.path.exists(paths["hdock_result"]):
-        cmd.extend(["--hdock", paths["hdock_result"]])
+        sources["hdock"] = paths["hdock_result"]
     if not args.skip_complex_af and os.path.exists(paths["af_complex_result"]):
-        cmd.extend(["--af", paths["af_complex_result"]])
-    run_command(cmd, "Merge score tables")
+        sources["af"] = paths["af_complex_result"]
+    run_stage("Merge score tables", merge, paths["merged_result"], incremental=args.incremental, **sources)
 
 
 def parse_args():
@@ -170,16 +158,54 @@ def parse_args():
     parser.add_argument("--af_step", choices=["Prediction", "Msa"], default="Prediction",
                         help="Single-protein AlphaFold3 mode. Use Prediction for one-step run, Msa for MSA-only.")
     parser.add_argument("--af_docker_image", default="alphafold3", help="AlphaFold3 Docker image name")
+    parser.add_argument("--af_stream", action="store_true",
+                        help="Overlap single-protein MSA and inference (Prediction mode); uses --num_workers MSA jobs and --af_gpus")
+    parser.add_argument("--af_queue_depth", type=int, default=4,
+                        help="Finished MSAs allowed to wait for inference with --af_stream")
+    parser.add_argument("--af_persistent_worker", action="store_true",
+                        help="Run AlphaFold3 inference with one long-lived container per GPU instead of one per input")
+    parser.add_argument("--af_gpus", default=None,
+                        help="Comma-separated GPU IDs for AlphaFold3 persistent workers, e.g. 0,1")
+    parser.add_argument("--cache_dir", default=None,
+                        help="Shared result cache directory reused across work_dirs (e.g. on NFS)")
+    parser.add_argument("--cache_max_gb", type=float, default=0,
+                        help="Evict least recently used cache entries above this size (default: no limit)")
+    parser.add_argument("--resource_dir", default=None,
+                        help="Shared CPU/GPU/memory pool directory; every job waits for free resources before starting "
+                             "(default: $PPI_RESOURCE_DIR)")
+    parser.add_argument("--job_ledger", default=None,
+                        help="SQLite job ledger recording every docking/prediction job; finished jobs are skipped on "
+                             "restart (default: $PPI_JOB_LEDGER, or WORK_DIR/jobs.sqlite)")
+    parser.add_argument("--timeout_scale", type=float, default=None,
+                        help="Multiply the per-command wall-clock timeouts (scaled by sequence length); 0 disables "
+                             "them (default: $PPI_TIMEOUT_SCALE or 1)")
+    parser.add_argument("--retries", type=int, default=None,
+                        help="Retries for timed-out or transiently failed docker/HDOCK commands, with exponential "
+                             "backoff (default: $PPI_RETRIES or 0)")
     parser.add_argument("--megadock_docker_image", default="hub.rat.dev/akiyamalab/megadock:gpu",
                         help="MEGADOCK Docker image name")
     parser.add_argument("--hdock_path", default=None, help="Optional directory containing hdock and createpl")
-    parser.add_argument("--num_workers", type=int, default=6, help="Concurrent MSA jobs for AlphaFold3 Msa mode")
+    parser.add_argument("--num_workers", type=int, default=6, help="Concurrent MSA jobs for AlphaFold3 Msa mode or --af_stream")
     parser.add_argument("--megadock_decoys", type=int, default=10800, help="MEGADOCK decoy number")
     parser.add_argument("--megadock_fft_threads", type=int, default=3, help="MEGADOCK FFT thread number")
     parser.add_argument("--megadock_cpu_cores", type=int, default=32, help="MEGADOCK OMP_NUM_THREADS value")
+    parser.add_argument("--megadock_workers", type=int, default=None,
+                        help="Concurrent MEGADOCK jobs (default: number of --megadock_devices, or 1)")
+    parser.add_argument("--megadock_devices", default=None,
+                        help="Comma-separated GPU IDs for MEGADOCK workers, e.g. 0,1 (default: all GPUs)")
+    parser.add_argument("--megadock_persistent", action="store_true",
+                        help="Reuse one long-lived MEGADOCK container per worker instead of a docker run per pair")
     parser.add_argument("--hdock_threads", type=int, default=8, help="Parallel HDOCK jobs")
+    parser.add_argument("--hdock_executor", choices=["thread", "process"], default="thread",
+                        help="Run parallel HDOCK jobs in a thread pool or a process pool")
+    parser.add_argument("--hdock_model_threshold", type=float, default=None,
+                        help="Build HDOCK complex PDBs (createpl) only for pairs scoring at or below this value")
+    parser.add_argument("--hdock_all_models", action="store_true",
+                        help="Build HDOCK complex PDBs for every pair")
     parser.add_argument("--convert_complex_pdb", action="store_true",
-                        help="Convert AlphaFold3 complex CIF files to PDB with PyMOL")
+                        help="Convert AlphaFold3 complex CIF files to PDB")
+    parser.add_argument("--no_msa_reuse", action="store_true",
+                        help="Run the full AlphaFold3 data pipeline for complexes instead of reusing monomer MSAs")
     parser.add_argument("--skip_single_af", action="store_true",
                         help="Skip single-protein AlphaFold3 and reuse existing work_dir/af_output/pdbs")
     parser.add_argument("--skip_megadock", action="store_true", help="Skip MEGADOCK step")
@@ -187,6 +213,14 @@ def parse_args():
     parser.add_argument("--skip_complex_af", action="store_true",
                         help="Skip AlphaFold3 complex prediction step")
     parser.add_argument("--skip_merge", action="store_true", help="Skip score merge step")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only run pairs not yet in the result tables' ledgers; append new rows to the tables "
+                             "and merge them into the existing merged_scores.tsv")
+    parser.add_argument("--scheduler", choices=["dag", "stage"], default="dag",
+                        help="dag: start each pair's docking as soon as both monomer PDBs exist, with MEGADOCK, HDOCK "
+                             "and complex AlphaFold3 running concurrently; stage: run the steps one after another")
+    parser.add_argument("--poll_interval", type=int, default=30,
+                        help="Seconds between scans for new monomer PDBs with --scheduler dag")
     return parser.parse_args()
 
 
@@ -199,6 +233,14 @@ def main():
     args.parameter_dir = os.path.abspath(args.parameter_dir) if args.parameter_dir else None
     args.database_dir = os.path.abspath(args.database_dir) if args.database_dir else None
     args.hdock_path = os.path.abspath(args.hdock_path) if args.hdock_path else None
+    args.cache_dir = os.path.abspath(args.cache_dir) if args.cache_dir else None
+    # 通过环境变量传给各步骤和进程池，AF3、MEGADOCK、HDOCK 共用同一个资源池
+    resources.configure(args.resource_dir)
+    # 任务账本同样通过环境变量传给各步骤和 DAG 调度中的进程池
+    job_ledger.configure(args.job_ledger, default_dir=args.work_dir)
+    # 超时倍数和重试次数；Ctrl-C 时终止所有正在运行的命令及其容器
+    command_runner.configure(args.timeout_scale, args.retries)
+    command_runner.install_signal_handlers()
 
     if (not args.skip_single_af or not args.skip_complex_af) and (not args.parameter_dir or not args.database_dir):
         raise ValueError("--parameter_dir and --database_dir are required unless all AlphaFold3 steps are skipped")
@@ -206,32 +248,36 @@ def main():
     paths = build_paths(args.work_dir)
     os.makedirs(args.work_dir, exist_ok=True)
 
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    scripts = {
-        "single_af": os.path.join(script_dir, "run_alphafold3.py"),
-        "megadock": os.path.join(script_dir, "run_megadock.py"),
-        "hdock": os.path.join(script_dir, "run_hdock.py"),
-        "complex_af": os.path.join(script_dir, "run_alphafold3_complex.py"),
-        "merge": os.path.join(script_dir, "merge_score.py"),
-    }
+    # 各步骤在本进程中运行，共用读取一次的 FASTA、pair 列表和结构索引
+    data = PipelineData(args.pair_list, args.fasta, structure_index=paths["structure_index"])
 
     try:
         validate_environment(args, paths)
 
-        if not args.skip_single_af:
-            run_single_alphafold(scripts["single_af"], args, paths)
+        if args.scheduler == "dag":
+            if args.skip_single_af and not (args.skip_megadock and args.skip_hdock):
+                check_dir(os.path.join(paths["af_output_dir"], "pdbs"), "AlphaFold3 single-protein PDB directory")
+            run_dag(
+                args, paths, data,
+                single_af=None if args.skip_single_af else lambda: run_single_alphafold(args, paths, data),
+                complex_af=None if args.skip_complex_af else lambda: run_complex_alphafold(args, paths, data),
+                poll_interval=args.poll_interval,
+            )
+        else:
+            if not args.skip_single_af:
+                run_single_alphafold(args, paths, data)
 
-        if not args.skip_megadock:
-            run_megadock(scripts["megadock"], args, paths)
+            if not args.skip_megadock:
+                run_megadock(args, paths, data)
 
-        if not args.skip_hdock:
-            run_hdock(scripts["hdock"], args, paths)
+            if not args.skip_hdock:
+                run_hdock(args, paths, data)
 
-        if not args.skip_complex_af:
-            run_complex_alphafold(scripts["complex_af"], args, paths)
+            if not args.skip_complex_af:
+                run_complex_alphafold(args, paths, data)
 
         if not args.skip_merge:
-            run_merge(scripts["merge"], args, paths)
+            run_merge(args, paths)
 
     except Exception as exc:
         print(f"[ERROR] {exc}")
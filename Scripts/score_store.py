@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+score_store.py
+
+功能说明：
+    merged_scores.tsv 的列式索引存储（Arrow IPC），用于按蛋白 ID、得分阈值和 top-K 快速查询，
+    不必每次完整读取 TSV。需要 pyarrow（可选依赖，只有建库和查询时才导入）。
+
+    存储目录包含：
+        pairs.arrow     每个 pair 存两行（Query → Partner 两个方向，同源二聚体只存一行），
+                        按 Query、Partner 排序，分成固定行数的 record batch；
+                        列：Query Partner 各得分列 Canonical（Query 为规范化 pair 中的 ID1 时为 true）
+        by_<得分>.arrow 每个得分列的排序索引：Score（升序，不含缺失值）和 Row（pairs.arrow 中的行号，
+                        只指向 Canonical 行）
+        index.json      每个 batch 的首尾 Query，查询某个 ID 时只读取覆盖它的 batch
+
+    查询时以内存映射方式打开各文件，数据不复制进内存：
+        按 ID 查询    二分查找 index.json 定位 batch，只扫描这几个 batch；
+        全表查询      在排序索引上二分查找阈值、直接截取 top-K，只取出命中的行，每个 pair 只出现一次。
+
+    阈值用 --min / --max 指定，列名可写 megadock、hdock、af 或完整列名；
+    --top_k 按 --sort 列取最好的 K 个（MEGADOCK 和 AF3 越大越好，HDOCK 越小越好）。
+
+使用示例：
+    python score_store.py build -i merged_scores.tsv -s score_store
+    python score_store.py query -s score_store --id AT1G01010 --max hdock=-200
+    python score_store.py query -s score_store --min megadock=10 --top_k 20 --sort megadock
+"""
+
+import os
+import sys
+import json
+import time
+import bisect
+import argparse
+
+import numpy as np
+
+from merge_score import SCORE_COLUMNS
+
+STORE_FILE = "pairs.arrow"
+INDEX_FILE = "index.json"
+DEFAULT_BATCH_ROWS = 65536
+
+# 得分越大越好的列；其余（HDOCK）越小越好
+HIGHER_IS_BETTER = {SCORE_COLUMNS["megadock"], SCORE_COLUMNS["af"]}
+SHORT_NAMES = {column: kind for kind, column in SCORE_COLUMNS.items()}
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.csv
+        import pyarrow.ipc
+    except ImportError:
+        print("[ERROR] pyarrow is required for the score store: pip install pyarrow")
+        sys.exit(1)
+    return pyarrow
+
+
+def resolve_column(name):
+    """megadock / hdock / af 或完整列名 → 列名"""
+    column = SCORE_COLUMNS.get(name.lower(), name)
+    if column not in SCORE_COLUMNS.values():
+        raise ValueError(f"Unknown score column: {name}")
+    return column
+
+
+def read_merged(merged_tsv):
+    """读取 merge_score.py 的输出（跳过第一行说明文字），返回 pyarrow.Table"""
+    pa = _require_pyarrow()
+    with open(merged_tsv, "r", encoding="utf-8") as f:
+        f.readline()
+        columns = f.readline().rstrip("\n").split("\t")
+    column_types = {column: pa.float64() for column in columns[2:]}
+    column_types.update({"ID1": pa.string(), "ID2": pa.string()})
+    return pa.csv.read_csv(
+        merged_tsv,
+        read_options=pa.csv.ReadOptions(skip_rows=1),
+        parse_options=pa.csv.ParseOptions(delimiter="\t"),
+        convert_options=pa.csv.ConvertOptions(column_types=column_types),
+    )
+
+
+def _write_arrow(pa, path, table, batch_rows):
+    """写出 Arrow IPC 文件，返回写入的 batch；空表也写一个空 batch，读取方总能取到第 0 个"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    batches = table.to_batches(max_chunksize=batch_rows)
+    with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        for batch in batches or [pa.RecordBatch.from_pylist([], schema=table.schema)]:
+            writer.write_batch(batch)
+    os.replace(tmp, path)
+    return batches
+
+
+def build_store(merged_tsv, store_dir, batch_rows=DEFAULT_BATCH_ROWS):
+    """由 merged_scores.tsv 建立存储；先写临时文件再 rename，查询方不会读到一半的文件"""
+    pa = _require_pyarrow()
+    pc = pa.compute
+    table = read_merged(merged_tsv)
+    scores = table.column_names[2:]
+
+    forward = pa.table(
+        [table["ID1"], table["ID2"]] + [table[c] for c in scores] + [pa.repeat(True, table.num_rows)],
+        names=["Query", "Partner"] + scores + ["Canonical"],
+    )
+    reverse = table.filter(pc.not_equal(table["ID1"], table["ID2"]))
+    reverse = pa.table(
+        [reverse["ID2"], reverse["ID1"]] + [reverse[c] for c in scores] + [pa.repeat(False, reverse.num_rows)],
+        names=["Query", "Partner"] + scores + ["Canonical"],
+    )
+    rows = pa.concat_tables([forward, reverse])
+    rows = rows.sort_by([("Query", "ascending"), ("Partner", "ascending")]).combine_chunks()
+
+    os.makedirs(store_dir, exist_ok=True)
+    batches = [[batch.column(0)[0].as_py(), batch.column(0)[-1].as_py()]
+               for batch in _write_arrow(pa, os.path.join(store_dir, STORE_FILE), rows, batch_rows)]
+
+    # 各得分列的排序索引
+    canonical = np.flatnonzero(rows["Canonical"].to_numpy(zero_copy_only=False))
+    for column in scores:
+        values = rows[column].take(canonical)
+        valid = values.is_valid().to_numpy(zero_copy_only=False)
+        values = values.to_numpy(zero_copy_only=False)[valid]
+        order = np.argsort(values, kind="stable")
+        _write_arrow(pa, os.path.join(store_dir, f"by_{SHORT_NAMES[column]}.arrow"),
+                     pa.table({"Score": values[order], "Row": canonical[valid][order]}), len(values) or 1)
+
+    index = {"pairs": table.num_rows, "rows": rows.num_rows, "score_columns": scores, "batches": batches}
+    index_path = os.path.join(store_dir, INDEX_FILE)
+    tmp = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp, index_path)
+    return index
+
+
+def open_store(store_dir):
+    """内存映射打开存储，返回 (reader, index)"""
+    pa = _require_pyarrow()
+    with open(os.path.join(store_dir, INDEX_FILE), "r") as f:
+        index = json.load(f)
+    reader = pa.ipc.open_file(pa.memory_map(os.path.join(store_dir, STORE_FILE), "r"))
+    return reader, index
+
+
+def partners(reader, index, protein_id):
+    """某个蛋白的全部 pair（Query = protein_id），只读取覆盖该 ID 的 batch"""
+    pa = _require_pyarrow()
+    protein_id = protein_id.upper()
+    batches = index["batches"]
+    start = bisect.bisect_left([last for _, last in batches], protein_id)
+    selected = []
+    for i in range(start, len(batches)):
+        if batches[i][0] > protein_id:
+            break
+        batch = reader.get_batch(i)
+        selected.append(batch.filter(pa.compute.equal(batch.column("Query"), protein_id)))
+    return pa.Table.from_batches(selected, schema=reader.schema)
+
+
+def read_sorted_index(store_dir, column):
+    """
+    内存映射读取某得分列的排序索引，返回 (Score, Row) 两个 numpy 数组（不复制）；
+    该列没有任何得分时返回空数组（旧版本建立的存储中这样的文件没有 batch）
+    """
+    pa = _require_pyarrow()
+    path = os.path.join(store_dir, f"by_{SHORT_NAMES[column]}.arrow")
+    reader = pa.ipc.open_file(pa.memory_map(path, "r"))
+    if reader.num_record_batches == 0:
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int64)
+    batch = reader.get_batch(0)
+    return batch.column(0).to_numpy(), batch.column(1).to_numpy()
+
+
+def candidate_rows(store_dir, minimum=(), maximum=(), top_k=None, sort=None):
+    """
+    全表查询的候选行号：在阈值最严的列的排序索引上二分查找，
+    没有阈值时直接取 --sort 列的前 K 个；返回 None 表示需要全表
+    """
+    bounds = {}
+    for column, value in minimum:
+        bound = bounds.setdefault(column, [-np.inf, np.inf])
+        bound[0] = max(bound[0], value)
+    for column, value in maximum:
+        bound = bounds.setdefault(column, [-np.inf, np.inf])
+        bound[1] = min(bound[1], value)
+
+    best = None
+    for column, (low, high) in bounds.items():
+        scores, rows = read_sorted_index(store_dir, column)
+        selected = rows[np.searchsorted(scores, low, "left"):np.searchsorted(scores, high, "right")]
+        if best is None or len(selected) < len(best):
+            best = selected
+    if best is not None:
+        return np.sort(best)
+    if top_k:
+        scores, rows = read_sorted_index(store_dir, sort)
+        selected = rows[-top_k:] if sort in HIGHER_IS_BETTER else rows[:top_k]
+        return np.sort(selected)
+    return None
+
+
+def all_pairs(reader, rows=None):
+    """全表或指定行（每个 pair 一行，Query 为 ID1）"""
+    table = reader.read_all()
+    if rows is not None:
+        return table.take(rows)
+    return table.filter(table["Canonical"])
+
+
+def apply_filters(table, minimum=(), maximum=(), top_k=None, sort=None):
+    """minimum / maximum: [(列名, 阈值)]；缺失得分的 pair 不满足任何阈值"""
+    pa = _require_pyarrow()
+    pc = pa.compute
+    for column, value in minimum:
+        table = table.filter(pc.greater_equal(table[column], value))
+    for column, value in maximum:
+        table = table.filter(pc.less_equal(table[column], value))
+    if top_k:
+        order = "descending" if sort in HIGHER_IS_BETTER else "ascending"
+        table = table.filter(pc.is_valid(table[sort]))
+        table = table.take(pc.select_k_unstable(table, top_k, [(sort, order)]))
+        table = table.sort_by([(sort, order), ("Query", "ascending"), ("Partner", "ascending")])
+    return table
+
+
+def write_tsv(table, out, id_columns):
+    """输出 TSV，缺失得分为空"""
+    scores = [c for c in table.column_names if c in SCORE_COLUMNS.values()]
+    out.write("\t".join(id_columns + scores) + "\n")
+    columns = [table[c].to_pylist() for c in ["Query", "Partner"] + scores]
+    for row in zip(*columns):
+        out.write("\t".join("" if value is None else str(value) for value in row) + "\n")
+
+
+def parse_thresholds(values):
+    thresholds = []
+    for value in values:
+        name, _, number = value.partition("=")
+        thresholds.append((resolve_column(name), float(number)))
+    return thresholds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the columnar PPI score store")
+    parser.add_argument("command", choices=["build", "query"])
+    parser.add_argument("-s", "--store", required=True, help="Score store directory")
+    parser.add_argument("-i", "--input", help="merged_scores.tsv to index (build)")
+    parser.add_argument("--batch_rows", type=int, default=DEFAULT_BATCH_ROWS, help="Rows per record batch (build)")
+    parser.add_argument("--id", action="append", default=[], help="Protein ID whose partners to list (repeatable)")
+    parser.add_argument("--min", action="append", default=[], metavar="COLUMN=VALUE",
+                        help="Keep pairs with score >= VALUE, e.g. megadock=10 (repeatable)")
+    parser.add_argument("--max", action="append", default=[], metavar="COLUMN=VALUE",
+                        help="Keep pairs with score <= VALUE, e.g. hdock=-200 (repeatable)")
+    parser.add_argument("--top_k", type=int, default=None, help="Return only the best K pairs by --sort")
+    parser.add_argument("--sort", default="megadock", help="Score column for --top_k (default: megadock)")
+    parser.add_argument("-o", "--output", default=None, help="Write results here instead of stdout")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if not args.input:
+            print("[ERROR] --input is required for build.")
+            sys.exit(1)
+        index = build_store(args.input, args.store, args.batch_rows)
+        print(f"[DONE] Score store with {index['pairs']} pairs ({len(index['batches'])} batches) saved to {args.store}")
+        return
+
+    try:
+        minimum = parse_thresholds(args.min)
+        maximum = parse_thresholds(args.max)
+        sort = resolve_column(args.sort)
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    reader, index = open_store(args.store)
+    for column in [c for c, _ in minimum + maximum] + ([sort] if args.top_k else []):
+        if column not in index["score_columns"]:
+            print(f"[ERROR] {column} is not in the score store (columns: {', '.join(index['score_columns'])})")
+            sys.exit(1)
+    pa = _require_pyarrow()
+    if args.id:
+        table = pa.concat_tables([partners(reader, index, pid) for pid in args.id])
+        id_columns = ["ID", "Partner"]
+    else:
+        table = all_pairs(reader, candidate_rows(args.store, minimum, maximum, args.top_k, sort))
+        id_columns = ["ID1", "ID2"]
+    table = apply_filters(table, minimum, maximum, args.top_k, sort)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            write_tsv(table, f, id_columns)
+    else:
+        write_tsv(table, sys.stdout, id_columns)
+    print(f"[INFO] {table.num_rows} pairs in {elapsed:.1f} ms (of {index['pairs']} in the store)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
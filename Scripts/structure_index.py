@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+structure_index.py
+
+功能说明：
+    单体结构索引。一次扫描 pdb_dir 中的全部 PDB，记录每个蛋白的残基数（CA 原子数）、
+    原子数、外接长方体对角线长度（Å，用于估算对接网格大小）、sha256 和链列表，保存为 TSV。对接脚本启动时加载一次，之后按 ID 直接查表
+    决定受体/配体，不再为每个 pair 重新读取 PDB；sha256 同时用作对接结果缓存的 key。
+
+    再次运行时只重新解析大小或 mtime 发生变化的文件，已删除的文件会从索引中移除。
+
+    索引文件格式（TSV）：
+        # pdb_dir	/abs/path/to/pdbs
+        ID	Size	Mtime_ns	Residues	Atoms	Diameter	Sha256	Chains
+
+使用示例：
+    python structure_index.py -d af_output/pdbs -o pipeline_run/structure_index.tsv -n 8
+"""
+
+import os
+import sys
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+COLUMNS = ["ID", "Size", "Mtime_ns", "Residues", "Atoms", "Diameter", "Sha256", "Chains"]
+
+
+def scan_pdb(pdb_file):
+    """单次读取 PDB，返回 {residues, atoms, diameter, sha256, chains}"""
+    h = hashlib.sha256()
+    residues = 0
+    atoms = 0
+    chains = []
+    lo = [float("inf")] * 3
+    hi = [float("-inf")] * 3
+    with open(pdb_file, "rb") as f:
+        for raw in f:
+            h.update(raw)
+            if raw.startswith(b"ATOM") or raw.startswith(b"HETATM"):
+                atoms += 1
+                try:
+                    xyz = (float(raw[30:38]), float(raw[38:46]), float(raw[46:54]))
+                except ValueError:
+                    xyz = None
+                if xyz:
+                    for k in range(3):
+                        lo[k] = min(lo[k], xyz[k])
+                        hi[k] = max(hi[k], xyz[k])
+                chain = raw[21:22].decode(errors="replace").strip() or "_"
+                if chain not in chains:
+                    chains.append(chain)
+                if raw.startswith(b"ATOM") and raw[12:16].strip() == b"CA":
+                    residues += 1
+    diameter = sum((hi[k] - lo[k]) ** 2 for k in range(3)) ** 0.5 if atoms and lo[0] <= hi[0] else 0.0
+    return {"residues": residues, "atoms": atoms, "diameter": round(diameter, 1), "sha256": h.hexdigest(),
+            "chains": chains}
+
+
+def _stat_entry(pdb_file):
+    st = os.stat(pdb_file)
+    return st.st_size, st.st_mtime_ns
+
+
+def _scan_one(task):
+    protein_id, pdb_file = task
+    try:
+        size, mtime_ns = _stat_entry(pdb_file)
+        entry = scan_pdb(pdb_file)
+    except OSError as e:
+        return protein_id, None, str(e)
+    entry.update({"size": size, "mtime_ns": mtime_ns})
+    return protein_id, entry, None
+
+
+def load_index(index_file, pdb_dir=None):
+    """读取索引文件；文件不存在、格式不符（包括旧版列）或记录的 pdb_dir 不一致时返回空索引"""
+    index = {}
+    if not index_file or not os.path.exists(index_file):
+        return index
+    with open(index_file, "r") as f:
+        first = f.readline().rstrip("\n").split("\t")
+        if len(first) != 2 or first[0] != "# pdb_dir":
+            return index
+        if pdb_dir and os.path.abspath(pdb_dir) != first[1]:
+            return index
+        if f.readline().rstrip("\n").split("\t") != COLUMNS:
+            return index
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) != len(COLUMNS):
+                continue
+            index[parts[0]] = {
+                "size": int(parts[1]),
+                "mtime_ns": int(parts[2]),
+                "residues": int(parts[3]),
+                "atoms": int(parts[4]),
+                "diameter": float(parts[5]),
+                "sha256": parts[6],
+                "chains": parts[7].split(",") if parts[7] else [],
+            }
+    return index
+
+
+def save_index(index, index_file, pdb_dir):
+    """先写临时文件再 rename，多个进程同时保存时不会读到半个文件"""
+    os.makedirs(os.path.dirname(os.path.abspath(index_file)), exist_ok=True)
+    tmp_file = f"{index_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as f:
+        f.write(f"# pdb_dir\t{os.path.abspath(pdb_dir)}\n")
+        f.write("\t".join(COLUMNS) + "\n")
+        for protein_id in sorted(index):
+            e = index[protein_id]
+            f.write(f"{protein_id}\t{e['size']}\t{e['mtime_ns']}\t{e['residues']}\t{e['atoms']}\t"
+                    f"{e['diameter']}\t{e['sha256']}\t{','.join(e['chains'])}\n")
+    os.replace(tmp_file, index_file)
+
+
+def update_index(index, pdb_dir, num_workers=1):
+    """重新解析新增或变化（大小/mtime 不同）的 PDB，删除已不存在的条目；返回重新解析的数量"""
+    present = set()
+    tasks = []
+    for name in os.listdir(pdb_dir):
+        if not name.endswith(".pdb"):
+            continue
+        protein_id = name[:-4]
+        pdb_file = os.path.join(pdb_dir, name)
+        try:
+            size, mtime_ns = _stat_entry(pdb_file)
+        except OSError:
+            continue
+        present.add(protein_id)
+        old = index.get(protein_id)
+        if old is None or old["size"] != size or old["mtime_ns"] != mtime_ns:
+            tasks.append((protein_id, pdb_file))
+
+    for protein_id in set(index) - present:
+        del index[protein_id]
+
+    if num_workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(_scan_one, tasks, chunksize=16))
+    else:
+        results = [_scan_one(task) for task in tasks]
+
+    for protein_id, entry, error in results:
+        if error:
+            print(f"[WARNING] Failed to index {protein_id}: {error}")
+            index.pop(protein_id, None)
+        else:
+            index[protein_id] = entry
+    return len(tasks)
+
+
+def build_index(pdb_dir, index_file=None, num_workers=1):
+    """加载（如有）并增量更新索引；指定 index_file 时把结果写回"""
+    index = load_index(index_file, pdb_dir)
+    updated = update_index(index, pdb_dir, num_workers)
+    if index_file and (updated or not os.path.exists(index_file)):
+        save_index(index, index_file, pdb_dir)
+    print(f"[INFO] Structure index: {len(index)} structures, {updated} (re)parsed")
+    return index
+
+
+def get_entry(index, pdb_dir, protein_id):
+    """按 ID 查表；索引中缺失的 PDB（例如索引建立之后才生成）在此补充解析"""
+    entry = index.get(protein_id)
+    if entry is not None:
+        return entry
+    pdb_file = os.path.join(pdb_dir, f"{protein_id}.pdb")
+    if not os.path.exists(pdb_file):
+        return None
+    _, entry, error = _scan_one((protein_id, pdb_file))
+    if error:
+        return None
+    index[protein_id] = entry
+    return entry
+
+
+def choose_receptor_ligand(index, pdb_dir, id1, id2):
+    """残基数多的作为受体（相等时 id1 为受体），返回 (R, L, R 条目, L 条目)；缺少 PDB 时返回 None"""
+    entry1 = get_entry(index, pdb_dir, id1)
+    entry2 = get_entry(index, pdb_dir, id2)
+    if entry1 is None or entry2 is None:
+        return None
+    if entry1["residues"] >= entry2["residues"]:
+        return id1, id2, entry1, entry2
+    return id2, id1, entry2, entry1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or refresh the monomer structure index")
+    parser.add_argument("-d", "--pdb_dir", required=True, help="Directory with monomer PDB files")
+    parser.add_argument("-o", "--index_file", required=True, help="Index file (TSV) to create or update")
+    parser.add_argument("-n", "--num_workers", type=int, default=1, help="Number of parsing processes")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.pdb_dir):
+        print(f"[ERROR] PDB directory not found: {args.pdb_dir}")
+        sys.exit(1)
+
+    build_index(args.pdb_dir, args.index_file, args.num_workers)
+    print(f"[DONE] Structure index saved to {args.index_file}")
+
+
+if __name__ == "__main__":
+    main()
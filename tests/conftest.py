@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+测试共用的 fixture。Scripts/ 下的脚本互相以模块名直接导入，这里把 Scripts/ 加入 sys.path；
+需要外部程序（docker 等）的测试用 fake_bin 在 PATH 前面放一个假的可执行文件，
+并在子进程中运行脚本，环境变量和模块级状态不会在测试之间残留。
+"""
+
+import os
+import sys
+import json
+import textwrap
+import subprocess
+
+import pytest
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Scripts")
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+sys.path.insert(0, SCRIPTS_DIR)
+
+# 假的 docker：每次调用记录一行 JSON（argv、处理的 AF3 输入、开始/结束时间）到 $FAKE_DOCKER_LOG。
+#   megadock-gpu：在 -o 指定的位置（经 -v 挂载换算成主机路径）写出 decoy 表；
+#   run_alphafold.py：为 --json_path / --input_dir 中的每个输入写出 <name>_model.cif 和
+#   _summary_confidences.json；--gpus 与 $FAKE_DOCKER_FAIL_GPUS 相同时不写输出、以退出码 1 结束
+FAKE_DOCKER = textwrap.dedent('''\
+    #!{python}
+    import os, sys, glob, json, time, random
+
+    argv = sys.argv[1:]
+    start = time.time()
+    mounts = {{}}
+    for i, arg in enumerate(argv[:-1]):
+        if arg == "-v":
+            host, _, container = argv[i + 1].partition(":")
+            mounts[container] = host
+
+    def host_path(path):
+        for container, host in mounts.items():
+            if path.startswith(container + "/"):
+                return host + path[len(container):]
+        return path
+
+    if "megadock-gpu" in argv:
+        time.sleep(float(os.environ.get("FAKE_DOCKER_SLEEP", "0")))
+        out = host_path(argv[argv.index("-o") + 1])
+        n = int(argv[argv.index("-N") + 1])
+        rng = random.Random(out)
+        with open(out, "w") as f:
+            f.write("128\\t1.200000\\t1\\n0.0\\t0.0\\t0.0\\nR\\t1.0\\t2.0\\t3.0\\n0.0\\t0.0\\t0.0\\nL\\t1.0\\t2.0\\t3.0\\n")
+            for _ in range(n):
+                f.write("0.1\\t0.2\\t0.3\\t1\\t2\\t3\\t%.6f\\n" % rng.gauss(1000, 200))
+
+    inputs = []
+    exit_code = 0
+    if "run_alphafold.py" in argv:
+        time.sleep(float(os.environ.get("FAKE_DOCKER_SLEEP", "0")))
+        flags = dict(arg.split("=", 1) for arg in argv if arg.startswith("--") and "=" in arg)
+        if "--input_dir" in flags:
+            paths = sorted(glob.glob(os.path.join(host_path(flags["--input_dir"] + "/"), "*.json")))
+        else:
+            paths = [mounts[flags["--json_path"]]]
+        gpu = argv[argv.index("--gpus") + 1] if "--gpus" in argv else None
+        if gpu is not None and gpu == os.environ.get("FAKE_DOCKER_FAIL_GPUS"):
+            exit_code = 1
+            paths = []
+        out = mounts["/root/af_output"]
+        for path in paths:
+            with open(path) as f:
+                name = json.load(f)["name"].lower()
+            inputs.append(name)
+            os.makedirs(os.path.join(out, name), exist_ok=True)
+            with open(os.path.join(out, name, name + "_model.cif"), "w") as f:
+                f.write("data_" + name + "\\n")
+            with open(os.path.join(out, name, name + "_summary_confidences.json"), "w") as f:
+                json.dump({{"ptm": 0.5, "iptm": 0.3}}, f)
+
+    with open(os.environ["FAKE_DOCKER_LOG"], "a") as log:
+        log.write(json.dumps({{"argv": argv, "inputs": inputs, "start": start, "end": time.time()}}) + "\\n")
+    sys.exit(exit_code)
+''')
+
+
+@pytest.fixture
+def fake_docker(tmp_path):
+    """PATH 前面放假的 docker；返回 (env, 读取调用记录的函数)"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    docker = bin_dir / "docker"
+    docker.write_text(FAKE_DOCKER.format(python=sys.executable))
+    docker.chmod(0o755)
+    log = tmp_path / "docker.log"
+
+    env = {key: value for key, value in os.environ.items()
+           if key not in ("PPI_RESOURCE_DIR", "PPI_JOB_LEDGER", "PPI_TIMEOUT_SCALE", "PPI_RETRIES")}
+    env["PATH"] = f"{bin_dir}{os.pathsep}{env.get('PATH', '')}"
+    env["FAKE_DOCKER_LOG"] = str(log)
+
+    def calls():
+        if not log.exists():
+            return []
+        return [json.loads(line) for line in log.read_text().splitlines()]
+
+    return env, calls
+
+
+def run_script(name, *args, env=None, cwd=None):
+    """在子进程中运行 Scripts/ 下的脚本，返回 CompletedProcess（文本输出）"""
+    return subprocess.run([sys.executable, os.path.join(SCRIPTS_DIR, name), *map(str, args)],
+                          env=env, cwd=cwd, capture_output=True, text=True, timeout=300)
+
+
+def write_pdb(path, residues, offset=0.0):
+    """写一个只有 CA 原子的最小 PDB；offset 使不同蛋白的内容（sha256）不同"""
+    lines = []
+    for i in range(residues):
+        x, y, z = i * 3.8 + offset, 0.0, 0.0
+        lines.append(f"ATOM  {i + 1:5d}  CA  ALA A{i + 1:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00           C")
+    lines.append("END")
+    path.write_text("\n".join(lines) + "\n")
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""af3_worker.py 的常驻 worker：用假的 docker 检查任务分配、收件箱交接、输出发布和 worker 异常"""
+
+import os
+import json
+from collections import Counter
+
+import pytest
+
+import af3_worker
+import memory_model
+from af3_worker import output_complete, run_inference_workers
+
+TOKENS = {"j1": 900, "j2": 700, "j3": 500, "j4": 300, "j5": 100}
+
+
+@pytest.fixture
+def af3_env(tmp_path, fake_docker, monkeypatch):
+    env, calls = fake_docker
+    for key in ("PPI_RESOURCE_DIR", "PPI_JOB_LEDGER", "PPI_TIMEOUT_SCALE", "PPI_RETRIES"):
+        monkeypatch.delenv(key, raising=False)
+    monkeypatch.setenv("PATH", env["PATH"])
+    monkeypatch.setenv("FAKE_DOCKER_LOG", env["FAKE_DOCKER_LOG"])
+    # 大任务上限不取决于本机内存
+    monkeypatch.setattr(memory_model, "_ceilings", (1000, 1000))
+    json_dir = tmp_path / "json"
+    json_dir.mkdir()
+    jobs = []
+    for name in TOKENS:
+        path = json_dir / f"{name}.json"
+        path.write_text(json.dumps({"name": name, "sequences": []}))
+        jobs.append((name, str(path)))
+    dirs = {key: str(tmp_path / key) for key in ("out", "models", "db", "queue")}
+    return jobs, dirs, calls
+
+
+def run_workers(jobs, dirs, **kwargs):
+    done = []
+    run_inference_workers(jobs, dirs["out"], dirs["models"], dirs["db"], "alphafold3", dirs["queue"],
+                          on_done=done.append, **kwargs)
+    return done
+
+
+def af3_calls(calls):
+    return [call for call in calls() if "run_alphafold.py" in call["argv"]]
+
+
+def device_of(call):
+    return call["argv"][call["argv"].index("--gpus") + 1]
+
+
+def test_static_assignment_one_container_per_gpu(af3_env):
+    jobs, dirs, calls = af3_env
+    done = run_workers(jobs, dirs, devices=["0", "1"], tokens=TOKENS)
+
+    runs = af3_calls(calls)
+    # batch_size=0：每块 GPU 只启动一个容器，按预计耗时做 LPT 分配
+    # （A100 参考耗时 j1 80s、j2 52s、j3 j4 33s、j5 23s → 113s / 108s）
+    assert {device_of(call): sorted(call["inputs"]) for call in runs} == {
+        '"device=0"': ["j1", "j4"], '"device=1"': ["j2", "j3", "j5"]}
+    assert sorted(done) == sorted(TOKENS)
+    for name in TOKENS:
+        assert output_complete(dirs["out"], name)
+    # 收件箱和临时目录都已清理
+    assert os.listdir(dirs["queue"]) == []
+    assert not os.path.exists(os.path.join(dirs["out"], af3_worker.SCRATCH_DIR))
+
+
+def test_shared_queue_hands_out_batches(af3_env, monkeypatch):
+    jobs, dirs, calls = af3_env
+    monkeypatch.setenv("FAKE_DOCKER_SLEEP", "0.3")
+    run_workers(jobs, dirs, devices=["0", "1"], batch_size=2, tokens=TOKENS)
+
+    runs = af3_calls(calls)
+    assert sorted(len(call["inputs"]) for call in runs) == [1, 2, 2]
+    # 每个任务只运行一次；收件箱每批重新填充，不会残留上一批的输入
+    assert Counter(name for call in runs for name in call["inputs"]) == Counter(set(TOKENS))
+    # 队列按 LPT 顺序出队：最先开始的两批是最长的四个任务
+    first_two = sorted(runs, key=lambda call: call["start"])[:2]
+    assert sorted(name for call in first_two for name in call["inputs"]) == ["j1", "j2", "j3", "j4"]
+
+
+def test_failed_container_does_not_publish(af3_env, monkeypatch):
+    jobs, dirs, calls = af3_env
+    monkeypatch.setenv("FAKE_DOCKER_FAIL_GPUS", '"device=1"')
+    run_workers(jobs, dirs, devices=["0", "1"], tokens=TOKENS)
+
+    failed = {"j2", "j3", "j5"}
+    for name in TOKENS:
+        assert output_complete(dirs["out"], name) == (name not in failed)
+
+
+def test_large_jobs_run_last_with_unified_memory(af3_env, monkeypatch):
+    jobs, dirs, calls = af3_env
+    host_gb = memory_model.estimate_af3(TOKENS["j2"])[0]
+    monkeypatch.setattr(memory_model, "_ceilings", (host_gb, 1000))
+    run_workers(jobs, dirs, devices=["0", "1"], tokens=TOKENS)
+
+    runs = sorted(af3_calls(calls), key=lambda call: call["start"])
+    # 只有 j1 超过上限：普通任务的两个容器结束后单独运行，并开启统一内存
+    assert [call["inputs"] for call in runs[2:]] == [["j1"]]
+    assert "TF_FORCE_UNIFIED_MEMORY=true" in runs[2]["argv"]
+    assert all("TF_FORCE_UNIFIED_MEMORY=true" not in call["argv"] for call in runs[:2])
+    assert runs[2]["start"] >= max(call["end"] for call in runs[:2])
+
+
+def test_worker_exception_fails_the_step(af3_env, monkeypatch):
+    jobs, dirs, calls = af3_env
+    fill_inbox = af3_worker.fill_inbox
+
+    def broken_fill_inbox(inbox, json_paths):
+        if inbox.endswith("worker1"):
+            raise OSError("disk full")
+        fill_inbox(inbox, json_paths)
+
+    monkeypatch.setattr(af3_worker, "fill_inbox", broken_fill_inbox)
+    with pytest.raises(RuntimeError, match="1 of 2 AlphaFold3 workers failed") as info:
+        run_workers(jobs, dirs, devices=["0", "1"], tokens=TOKENS)
+    assert isinstance(info.value.__cause__, OSError)
+
+    # 另一个 worker 仍然做完了自己的任务
+    [run] = af3_calls(calls)
+    for name in run["inputs"]:
+        assert output_complete(dirs["out"], name)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""cache.py：条目在 lookup 之后被淘汰时按未命中处理"""
+
+import shutil
+from collections import defaultdict
+
+import pytest
+
+import cache
+import run_megadock
+
+
+@pytest.fixture
+def entry(tmp_path):
+    src = tmp_path / "a-b.out"
+    src.write_text("decoys\n")
+    key = cache.make_key("megadock", "a", "b")
+    path = cache.insert(str(tmp_path / "cache"), run_megadock.CACHE_NAMESPACE, key, {"result.out": str(src)})
+    return tmp_path / "cache", key, path
+
+
+@pytest.fixture
+def counts(monkeypatch):
+    monkeypatch.setattr(cache, "_counts", defaultdict(lambda: [0, 0]))
+    return cache._counts
+
+
+def test_materialize(entry, tmp_path):
+    _, _, path = entry
+    dst = tmp_path / "out" / "a-b.out"
+    assert cache.materialize(path, {"result.out": str(dst), "result.out.pdb": str(tmp_path / "x.pdb")},
+                             required=["result.out"])
+    assert dst.read_text() == "decoys\n"
+    # 条目中没有的文件没有就位
+    assert not cache.materialize(path, {"result.out": str(dst), "result.out.pdb": str(tmp_path / "x.pdb")})
+
+
+def test_megadock_hit(entry, tmp_path, counts):
+    cache_dir, key, _ = entry
+    out = tmp_path / "out" / "a-b.out"
+    assert run_megadock.materialize_cached(str(cache_dir), key, str(out))
+    assert out.exists()
+    assert counts[run_megadock.CACHE_NAMESPACE] == [1, 0]
+
+
+def test_megadock_entry_evicted_after_lookup(entry, tmp_path, counts, monkeypatch):
+    cache_dir, key, path = entry
+    lookup = cache.lookup
+
+    def lookup_then_evict(*args):
+        # 模拟另一个进程在 lookup 和链接之间执行 evict
+        found = lookup(*args)
+        shutil.rmtree(path)
+        return found
+
+    monkeypatch.setattr(cache, "lookup", lookup_then_evict)
+    out = tmp_path / "out" / "a-b.out"
+    assert not run_megadock.materialize_cached(str(cache_dir), key, str(out))
+    assert not out.exists()
+    assert counts[run_megadock.CACHE_NAMESPACE] == [0, 1]
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+"""command_runner.py：超时终止、瞬时失败重试、超时和取消时删除容器；作为库使用时不替换信号处理，默认不重试"""
+
+import os
+import sys
+import json
+import time
+import signal
+import textwrap
+import threading
+
+import pytest
+
+import command_runner
+
+ENV_KEYS = ("PPI_TIMEOUT_SCALE", "PPI_RETRIES")
+
+
+@pytest.fixture
+def runner(monkeypatch):
+    # configure() 会写入环境变量：结束时恢复原值，不影响之后的测试
+    saved = {key: os.environ.get(key) for key in ENV_KEYS}
+    for key in ENV_KEYS:
+        os.environ.pop(key, None)
+    monkeypatch.setattr(command_runner, "_settings", {})
+    monkeypatch.setattr(command_runner, "_handlers_installed", False)
+    yield command_runner
+    command_runner._cancelled.clear()
+    for key, value in saved.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+
+
+@pytest.fixture
+def docker_log(tmp_path, monkeypatch):
+    """PATH 中放一个只记录参数的 docker，返回读取记录的函数"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    log = tmp_path / "docker.log"
+    docker = bin_dir / "docker"
+    docker.write_text(textwrap.dedent(f"""\
+        #!{sys.executable}
+        import sys, json
+        with open({str(log)!r}, "a") as f:
+            f.write(json.dumps(sys.argv[1:]) + "\\n")
+        """))
+    docker.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return lambda: [json.loads(line) for line in log.read_text().splitlines()] if log.exists() else []
+
+
+def python(code):
+    return [sys.executable, "-c", textwrap.dedent(code)]
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # 已结束但尚未被回收的进程
+    with open(f"/proc/{pid}/stat") as f:
+        return f.read().split(") ", 1)[1][0] != "Z"
+
+
+def wait_for(path, seconds=10):
+    deadline = time.time() + seconds
+    while not path.exists() or not path.read_text():
+        assert time.time() < deadline, f"{path} was not written"
+        time.sleep(0.05)
+    return path.read_text()
+
+
+def test_library_use_keeps_signal_handlers(runner):
+    sigint, sigterm = signal.getsignal(signal.SIGINT), signal.getsignal(signal.SIGTERM)
+    runner.configure(2, 1)
+    result = runner.run([sys.executable, "-c", "print('ok')"], "echo", capture=True)
+    assert result.stdout == b"ok\n"
+    assert signal.getsignal(signal.SIGINT) is sigint
+    assert signal.getsignal(signal.SIGTERM) is sigterm
+
+
+def test_install_signal_handlers(runner):
+    sigint, sigterm = signal.getsignal(signal.SIGINT), signal.getsignal(signal.SIGTERM)
+    try:
+        runner.install_signal_handlers()
+        assert signal.getsignal(signal.SIGINT) is runner._handle_signal
+        assert signal.getsignal(signal.SIGTERM) is runner._handle_signal
+    finally:
+        signal.signal(signal.SIGINT, sigint)
+        signal.signal(signal.SIGTERM, sigterm)
+
+
+def test_defaults(runner):
+    runner.configure()
+    assert runner.get_retries() == 0
+    assert runner.get_timeout_scale() == 1
+    assert runner.timeout_for("pymol") == 600
+
+
+def test_no_retry_by_default(runner, capsys):
+    # 退出码 125 是瞬时失败，但默认不重试
+    result = runner.run([sys.executable, "-c", "raise SystemExit(125)"], "transient")
+    assert result.returncode == 125
+    assert "[RETRY]" not in capsys.readouterr().out
+
+
+def test_timeout_kills_process_group_and_removes_container(runner, tmp_path, docker_log, capsys):
+    child_pid = tmp_path / "child.pid"
+    # 命令再启动一个子进程：超时后整个进程组都被终止
+    command = python(f"""
+        import sys, time, subprocess
+        child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+        open({str(child_pid)!r}, "w").write(str(child.pid))
+        time.sleep(60)
+        """)
+    name = runner.container_name("megadock-a-b")
+    start = time.time()
+    result = runner.run(command, "sleeper", timeout=1, retries=0, cleanup=runner.docker_cleanup(name))
+    assert time.time() - start < runner.KILL_GRACE_SECONDS
+    assert result.returncode == runner.TIMEOUT_EXIT_CODE
+    assert "[TIMEOUT] sleeper: still running after 1s, killed" in capsys.readouterr().out
+    assert docker_log() == [["rm", "-f", name]]
+    pid = int(wait_for(child_pid))
+    deadline = time.time() + 5
+    while pid_alive(pid):
+        assert time.time() < deadline, "child process survived the timeout"
+        time.sleep(0.05)
+
+
+def test_transient_failure_retried_with_backoff(runner, tmp_path, docker_log, monkeypatch, capsys):
+    monkeypatch.setattr(runner, "BACKOFF_SECONDS", 0.2)
+    monkeypatch.setattr(runner.random, "uniform", lambda low, high: 0)
+    attempts = tmp_path / "attempts"
+    # 前两次以 125 退出（docker run 自身出错），第三次成功
+    command = python(f"""
+        import os
+        path = {str(attempts)!r}
+        n = int(open(path).read()) + 1 if os.path.exists(path) else 1
+        open(path, "w").write(str(n))
+        raise SystemExit(125 if n < 3 else 0)
+        """)
+    name = runner.container_name("af3-x")
+    start = time.time()
+    result = runner.run(command, "flaky", retries=3, cleanup=runner.docker_cleanup(name))
+    # 退避 0.2 s、0.4 s
+    assert time.time() - start >= 0.6
+    assert result.returncode == 0
+    assert attempts.read_text() == "3"
+    out = capsys.readouterr().out
+    assert out.count("[RETRY] flaky: exit code 125") == 2
+    assert "(1/3)" in out and "(2/3)" in out
+    # 每次重试前删除失败的尝试可能留下的同名容器
+    assert docker_log() == [["rm", "-f", name]] * 2
+
+
+def test_retries_exhausted_and_program_errors(runner, monkeypatch, capsys):
+    monkeypatch.setattr(runner, "BACKOFF_SECONDS", 0.01)
+    assert runner.run(python("raise SystemExit(125)"), "down", retries=2).returncode == 125
+    assert capsys.readouterr().out.count("[RETRY]") == 2
+    # 程序本身的错误不重试；stderr 中的 daemon 错误视为瞬时失败
+    assert runner.run(python("raise SystemExit(1)"), "bug", retries=2).returncode == 1
+    assert "[RETRY]" not in capsys.readouterr().out
+    assert runner.is_transient(1, "Cannot connect to the Docker daemon at unix:///var/run/docker.sock", False)
+    assert runner.is_transient(0, "", True)
+
+
+def test_cancel_all_removes_containers(runner, tmp_path, docker_log):
+    started = tmp_path / "started"
+    command = python(f"""
+        import time
+        open({str(started)!r}, "w").write("1")
+        time.sleep(60)
+        """)
+    name = runner.container_name("hdock-a-b")
+    errors = []
+
+    def submit():
+        try:
+            runner.run(command, "long job", cleanup=runner.docker_cleanup(name))
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    thread = threading.Thread(target=submit)
+    thread.start()
+    wait_for(started)
+    start = time.time()
+    runner.cancel_all()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert time.time() - start < runner.KILL_GRACE_SECONDS
+    assert errors == ["long job: cancelled"]
+    assert docker_log() == [["rm", "-f", name]]
+    # 取消之后提交的命令直接失败
+    with pytest.raises(RuntimeError, match="cancelled"):
+        runner.run(python("pass"), "late")
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""hdock_score.py：从 HDOCK .out 的 decoy 表读取得分"""
+
+import os
+import shutil
+
+import pytest
+
+from conftest import DATA_DIR, run_script
+from hdock_score import SCORE_COLUMN, read_top_scores, split_out_name, top_score
+
+# 6 行表头（网格间距、角度间隔、两行初始平移、受体和配体文件名），
+# 之后是按得分从优到差排列的 decoy：3 个旋转角、3 个平移、得分、RMSD、标记
+SAMPLE = os.path.join(DATA_DIR, "hdock_sample.out")
+SAMPLE_SCORES = [-312.47, -298.10, -265.93, -241.06, -198.55]
+
+
+def test_score_column_follows_rotation_and_translation():
+    assert SCORE_COLUMN == 6
+    assert read_top_scores(SAMPLE, 100) == SAMPLE_SCORES
+
+
+def test_top_score_is_first_decoy():
+    # 第一条 decoy 即 createpl -nmax 1 输出的模型，其 REMARK Score 与之相同
+    assert top_score(SAMPLE) == -312.47
+
+
+def test_top_k_keeps_file_order():
+    assert read_top_scores(SAMPLE) == [-312.47]
+    assert read_top_scores(SAMPLE, 3) == [-312.47, -298.10, -265.93]
+
+
+def test_missing_decoy_table(tmp_path):
+    header_only = tmp_path / "a-b.out"
+    header_only.write_text("".join(open(SAMPLE).readlines()[:6]))
+    assert read_top_scores(str(header_only), 5) == []
+    with pytest.raises(ValueError):
+        top_score(str(header_only))
+
+    not_hdock = tmp_path / "c-d.out"
+    not_hdock.write_text("text\n" * 20)
+    with pytest.raises(ValueError, match="No decoy table"):
+        read_top_scores(str(not_hdock))
+
+
+def test_split_out_name():
+    assert split_out_name("/x/rec1-lig2.out") == ("rec1", "lig2")
+
+
+def test_cli_reports_top_k(tmp_path):
+    out_dir = tmp_path / "hdock_out"
+    out_dir.mkdir()
+    shutil.copy(SAMPLE, out_dir / "rec1-lig2.out")
+    result_file = tmp_path / "hdock.tsv"
+
+    result = run_script("hdock_score.py", "-d", out_dir, "-r", result_file, "-k", 2)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert result_file.read_text() == "rec1\tlig2\t-312.4700\t-312.4700,-298.1000\n"
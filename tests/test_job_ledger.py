@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""job_ledger.py：已完成的任务只有在输出仍然存在时才跳过"""
+
+import pytest
+
+import job_ledger
+
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    monkeypatch.setenv(job_ledger.ENV_VAR, str(tmp_path / "jobs.sqlite"))
+    monkeypatch.setattr(job_ledger, "_ledger_path", None)
+    return job_ledger
+
+
+def test_done_job_with_output_is_skipped(ledger, tmp_path):
+    out = tmp_path / "a-b.out"
+    out.write_text("decoys\n")
+    ledger.record("megadock", str(out), "hash1")
+    assert ledger.is_done("megadock", str(out), "hash1")
+    # 输入哈希变化时重新运行
+    assert not ledger.is_done("megadock", str(out), "hash2")
+
+
+def test_missing_output_is_downgraded(ledger, tmp_path):
+    out = tmp_path / "a-b.out"
+    ledger.record("megadock", str(out), "hash1")
+    assert ledger.lookup("megadock", str(out))[0] == "done"
+    assert not ledger.is_done("megadock", str(out), "hash1", adopt=lambda: True)
+    assert ledger.lookup("megadock", str(out))[0] == "failed"
+    # 重新运行之前不会再被视为完成
+    out.write_text("decoys\n")
+    assert not ledger.is_done("megadock", str(out), "hash1")
+
+
+def test_adopt_existing_output(ledger, tmp_path):
+    out = tmp_path / "a-b.out"
+    out.write_text("decoys\n")
+    assert not ledger.is_done("megadock", str(out), "hash1", adopt=lambda: False)
+    assert ledger.is_done("megadock", str(out), "hash1", adopt=lambda: True)
+    assert ledger.lookup("megadock", str(out))[0] == "adopted"
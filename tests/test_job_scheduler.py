@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""job_scheduler.py：token 桶、LPT 排序和静态分配是确定的"""
+
+import random
+import itertools
+
+import pytest
+
+from job_scheduler import AF3_BUCKETS, assign_lpt, estimate_seconds, lpt_order, predict_makespan, token_bucket
+
+TOKENS = {"a": 300, "b": 1000, "c": 300, "d": 2000, "e": 510, "f": 1000, "g": 120, "h": 300}
+
+
+def names(jobs):
+    return [job[0] for job in jobs]
+
+
+@pytest.mark.parametrize("n_tokens, bucket", [
+    (0, 256), (1, 256), (256, 256), (257, 512), (512, 512), (513, 768),
+    (1536, 1536), (1537, 2048), (5120, 5120), (5121, 5121), (9000, 9000),
+])
+def test_token_bucket_boundaries(n_tokens, bucket):
+    assert token_bucket(n_tokens) == bucket
+
+
+def test_bucket_boundary_sets_cost():
+    # 同一个桶内耗时相同，跨过边界才增加
+    assert estimate_seconds(257) == estimate_seconds(512)
+    assert estimate_seconds(512) < estimate_seconds(513)
+    assert AF3_BUCKETS == sorted(AF3_BUCKETS)
+
+
+def test_lpt_order_bucket_major_then_tokens_then_name():
+    jobs = [(name,) for name in TOKENS]
+    # 桶：d 2048 > b f 1024 > e a c h 512 > g 256；
+    # 同一桶内 token 数多的在前（e 510 > a c h 300），token 数相同时按任务名
+    assert names(lpt_order(jobs, TOKENS)) == ["d", "b", "f", "e", "a", "c", "h", "g"]
+
+
+def test_lpt_order_ties_do_not_depend_on_input_order():
+    jobs = [(name,) for name in TOKENS]
+    expected = lpt_order(jobs, TOKENS)
+    rng = random.Random(0)
+    for _ in range(20):
+        shuffled = jobs[:]
+        rng.shuffle(shuffled)
+        assert lpt_order(shuffled, TOKENS) == expected
+
+
+def test_lpt_order_keeps_buckets_contiguous():
+    jobs = [(name,) for name in TOKENS]
+    buckets = [token_bucket(TOKENS[name]) for name in names(lpt_order(jobs, TOKENS))]
+    # 每个桶只出现在一段连续的区间里
+    assert len([bucket for bucket, _ in itertools.groupby(buckets)]) == len(set(buckets))
+
+
+def test_lpt_order_missing_tokens_last():
+    jobs = [("x",), ("a",), ("g",)]
+    assert names(lpt_order(jobs, TOKENS)) == ["a", "g", "x"]
+
+
+def test_lpt_order_keeps_job_payload():
+    jobs = [("a", "a.json", True), ("d", "d.json", False)]
+    assert lpt_order(jobs, TOKENS) == [("d", "d.json", False), ("a", "a.json", True)]
+
+
+def test_assign_lpt_equal_jobs_split_evenly():
+    tokens = {f"j{i}": 700 for i in range(6)}
+    batches, loads = assign_lpt([(name,) for name in tokens], tokens, 3)
+    # 负载相同时取编号小的 worker：按任务名依次轮流分配
+    assert [names(batch) for batch in batches] == [["j0", "j3"], ["j1", "j4"], ["j2", "j5"]]
+    assert loads == [2 * estimate_seconds(700)] * 3
+
+
+def test_assign_lpt_balance():
+    jobs = [(name,) for name in TOKENS]
+    batches, loads = assign_lpt(jobs, TOKENS, 3)
+    assert sorted(names(job for batch in batches for job in batch)) == sorted(TOKENS)
+    assert loads == [sum(estimate_seconds(TOKENS[name]) for name in names(batch)) for batch in batches]
+    # LPT：最忙与最闲的 worker 相差不超过一个任务的耗时
+    assert max(loads) - min(loads) <= max(estimate_seconds(n) for n in TOKENS.values())
+    # 预计耗时 d 296s、b f 80s、e a c h 33s、g 23s：d 单独占一个 worker，
+    # 其余任务在另外两个 worker 间交替（负载相同时取编号小的）
+    assert [names(batch) for batch in batches] == [["d"], ["b", "e", "c", "g"], ["f", "a", "h"]]
+
+
+def test_assign_lpt_more_workers_than_jobs():
+    jobs = [("a",), ("d",)]
+    batches, loads = assign_lpt(jobs, TOKENS, 4)
+    assert [names(batch) for batch in batches] == [["d"], ["a"], [], []]
+    assert loads[2:] == [0.0, 0.0]
+
+
+def test_schedule_is_deterministic_across_calls():
+    jobs = [(name,) for name in TOKENS]
+    first = assign_lpt(jobs, TOKENS, 2)
+    for _ in range(5):
+        assert assign_lpt(jobs, TOKENS, 2) == first
+        assert assign_lpt(list(reversed(jobs)), TOKENS, 2) == first
+        assert lpt_order(jobs, TOKENS) == lpt_order(jobs, TOKENS)
+
+
+def test_lpt_not_worse_than_input_order():
+    # 输入顺序把最长的任务放在最后，LPT 能明显缩短预计总耗时
+    tokens = {"s1": 200, "s2": 200, "s3": 200, "s4": 200, "long": 3000}
+    jobs = [(name,) for name in tokens]
+    assert predict_makespan(lpt_order(jobs, tokens), tokens, 2) < predict_makespan(jobs, tokens, 2)
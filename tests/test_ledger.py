@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""ledger.py：增量运行的已完成 pair 账本"""
+
+import ledger
+
+
+def test_select_pending_keeps_order(capsys):
+    pairs = [("at1g1", "at1g2"), ("at1g3", "glyma_1"), ("at1g1", "at1g4"), ("at1g2", "at1g3")]
+    done = {("at1g1", "at1g2"), ("at1g2", "at1g3"), ("at1g8", "at1g9")}
+    assert ledger.select_pending(pairs, done, "MEGADOCK") == [("at1g3", "glyma_1"), ("at1g1", "at1g4")]
+    assert "4 pairs in the list, 2 already done, 2 to run" in capsys.readouterr().out
+
+
+def test_ledger_created_from_result_table(tmp_path):
+    result = tmp_path / "megadock.tsv"
+    result.write_text("AT1G2\tat1g1\t12.5\nGlyma_1\tAT1G3\t8.0\n")
+    assert ledger.read_ledger(str(result)) == {("at1g1", "at1g2"), ("at1g3", "glyma_1")}
+    assert (tmp_path / "megadock.tsv.ledger").read_text() == "at1g1\tat1g2\nat1g3\tglyma_1\n"
+
+    # 之后只读账本，新完成的 pair 追加到账本
+    ledger.record(str(result), [("at1g1", "at1g4"), ("at1g1", "at1g4")])
+    result.write_text("")
+    assert ledger.read_ledger(str(result)) == {("at1g1", "at1g2"), ("at1g3", "glyma_1"), ("at1g1", "at1g4")}
+
+    ledger.reset(str(result))
+    assert not (tmp_path / "megadock.tsv.ledger").exists()
+    assert ledger.read_ledger(str(result)) == set()
+
+
+def test_joined_result_table(tmp_path):
+    result = tmp_path / "af.tsv"
+    result.write_text("Pair\tPTM\tIPTM\nat1g2-at1g1\t0.5\t0.3\n")
+    assert ledger.read_ledger(str(result), joined=True) == {("at1g1", "at1g2")}
+
+
+def test_append_lines_completes_last_line(tmp_path):
+    path = tmp_path / "result.tsv"
+    path.write_text("a\tb\t1")
+    ledger.append_lines(str(path), ["c\td\t2"])
+    ledger.append_lines(str(path), [])
+    assert path.read_text() == "a\tb\t1\nc\td\t2\n"
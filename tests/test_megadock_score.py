@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+"""megadock_score.py：从 .out 文件计算的 E 值与 ppiscore 的定义一致"""
+
+import os
+import shutil
+
+import pytest
+
+from conftest import DATA_DIR
+from megadock_score import SCORE_COLUMN, ppi_score, read_decoy_scores, rescore_directory
+
+SAMPLE = os.path.join(DATA_DIR, "megadock_sample.out")
+
+# ppiscore 的 E 值：前 N 个 decoy 的 (最高得分 - 平均得分) / 总体标准差（除以 N）。
+# 前 5 个得分 10.5 8.0 7.5 6.0 3.0：平均 7.0，方差 30.5 / 5 = 6.1
+E_FIRST_5 = 1.417108577813103
+# 用样本标准差（除以 N - 1）得到的值，不应出现
+E_FIRST_5_SAMPLE_SD = 1.2675004445952593
+# 6 个 decoy 全部计入（包括末尾得分 99 的离群 decoy）
+E_ALL_6 = 2.2312490017591515
+
+
+def test_score_column_is_last_of_seven():
+    # decoy 行：3 个旋转角、3 个体素坐标、得分
+    assert SCORE_COLUMN == 6
+    assert list(read_decoy_scores(SAMPLE)) == [10.5, 8.0, 7.5, 6.0, 3.0, 99.0]
+
+
+def test_header_lines_skipped_and_n_limits_decoys():
+    assert list(read_decoy_scores(SAMPLE, 5)) == [10.5, 8.0, 7.5, 6.0, 3.0]
+    assert list(read_decoy_scores(SAMPLE, 1)) == [10.5]
+
+
+def test_ppi_score_matches_ppiscore_definition():
+    assert ppi_score(SAMPLE, 5) == pytest.approx(E_FIRST_5, rel=1e-9)
+    assert ppi_score(SAMPLE, 5) != pytest.approx(E_FIRST_5_SAMPLE_SD, rel=1e-3)
+    # N 大于 decoy 数时使用全部 decoy
+    assert ppi_score(SAMPLE, 6) == pytest.approx(E_ALL_6, rel=1e-9)
+    assert ppi_score(SAMPLE, 10800) == pytest.approx(E_ALL_6, rel=1e-9)
+
+
+def test_zero_variance_rejected():
+    with pytest.raises(ValueError):
+        ppi_score(SAMPLE, 1)
+
+
+def test_rescore_directory_names_receptor_and_ligand(tmp_path):
+    shutil.copy(SAMPLE, tmp_path / "rec1-lig2.out")
+    (tmp_path / "notes.txt").write_text("not a docking output\n")
+    [(R, L, score)] = rescore_directory(str(tmp_path), 5)
+    assert (R, L) == ("rec1", "lig2")
+    assert score == pytest.approx(E_FIRST_5, rel=1e-9)
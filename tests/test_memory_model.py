@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+"""memory_model.py：估算时只读取一次模型文件，校准后重新读取"""
+
+import json
+
+import pytest
+
+import memory_model
+import resources
+
+
+@pytest.fixture
+def resource_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(resources, "_resource_dir", str(tmp_path))
+    monkeypatch.setattr(memory_model, "_models", {})
+    monkeypatch.setattr(memory_model, "_ceilings", None)
+    return tmp_path
+
+
+def count_loads(monkeypatch):
+    loads = []
+    load_model = memory_model.load_model
+
+    def counting_load_model(resource_dir=None):
+        loads.append(resource_dir)
+        return load_model(resource_dir)
+
+    monkeypatch.setattr(memory_model, "load_model", counting_load_model)
+    return loads
+
+
+def test_planning_reads_model_once(resource_dir, monkeypatch):
+    (resource_dir / memory_model.MODEL_FILE).write_text(json.dumps(
+        {"af3": {"host_gb": [10.0, 1.0]}, "ceiling_gb": {"host": 200, "gpu": 40}}))
+    loads = count_loads(monkeypatch)
+
+    for tokens in (300, 900, 2500):
+        memory_model.estimate_af3(tokens)
+        memory_model.is_large(*memory_model.estimate_af3(tokens, data_pipeline=False))
+        memory_model.estimate("megadock", 120)
+    assert len(loads) == 1
+    # 校准后的系数和上限生效：特征 (1024 / 1000)^2 ≈ 1.05，主机 10 + 1.05，显存沿用默认 6 + 2.4 × 1.05
+    assert memory_model.estimate("af3", 1024) == (11.0, 8.5)
+    assert memory_model.get_ceilings() == (200, 40)
+
+
+def test_saving_the_model_invalidates_cache(resource_dir):
+    assert memory_model.estimate("hdock", 2000) == (0.8, 0.0)
+    model = memory_model.load_model(str(resource_dir))
+    model["hdock"]["host_gb"] = [1.0, 1.0]
+    memory_model.save_model(str(resource_dir), model)
+    assert memory_model.estimate("hdock", 2000) == (3.0, 0.0)
+
+
+def test_fit_model_updates_estimates(resource_dir):
+    for size, host_gb in ((1000, 3.0), (3000, 5.0)):
+        memory_model.record_observation(str(resource_dir), "hdock", size, host_gb)
+    before = memory_model.estimate("hdock", 2000)
+    memory_model.fit_model(str(resource_dir))
+    assert memory_model.estimate("hdock", 2000) != before
+    assert memory_model.estimate("hdock", 2000)[0] == pytest.approx(4.0)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""merge_score.py：流式合并与内存合并的输出逐字节相同；增量合并与完整合并的输出相同"""
+
+import json
+import random
+import itertools
+
+import pandas as pd
+import pytest
+
+from merge_score import (STATE_SUFFIX, merge_full, merge_in_memory, merge_incremental, merge_streaming,
+                         normalize_ids)
+
+# 跨过 'Z'..'a' 之间字符（'_'）的 ID：按小写和按大写比较的顺序不同；另有 pandas 默认视为缺失的字符串
+PROTEINS = ["AT1G01010", "AT5G99999", "Glyma_01G1", "GLYMAB", "GLYMA_02", "glymaz1", "Zm00001", "zm00002",
+            "NA", "null", "N/A", "nan", "None"]
+
+
+def mixed_case(rng, protein_id):
+    return "".join(c.upper() if rng.random() < 0.5 else c.lower() for c in protein_id)
+
+
+def write_tables(tmp_path, seed=0):
+    rng = random.Random(seed)
+    pairs = list(itertools.combinations_with_replacement(PROTEINS, 2))
+    sources = []
+    for kind in ("megadock", "hdock", "af"):
+        lines = []
+        for a, b in rng.sample(pairs, int(len(pairs) * 0.7)):
+            if rng.random() < 0.5:
+                a, b = b, a
+            a, b = mixed_case(rng, a), mixed_case(rng, b)
+            if kind == "af":
+                lines.append(f"{a}-{b}\t{rng.random():.2f}\t{rng.random():.2f}\n")
+            else:
+                # 少数得分为空
+                score = "" if rng.random() < 0.1 else f"{rng.uniform(-400, 15):.4f}"
+                lines.append(f"{a}\t{b}\t{score}\n")
+        path = tmp_path / f"{kind}.tsv"
+        path.write_text(("Pair\tPTM\tIPTM\n" if kind == "af" else "") + "".join(lines))
+        sources.append((kind, str(path)))
+    return sources
+
+
+@pytest.mark.parametrize("seed, chunksize, n_buckets", [(0, 7, 4), (1, 1000, 1), (2, 3, 64)])
+def test_streaming_identical_to_in_memory(tmp_path, seed, chunksize, n_buckets):
+    sources = write_tables(tmp_path, seed)
+    merge_in_memory(sources, str(tmp_path / "memory.tsv"))
+    merge_streaming(sources, str(tmp_path / "streaming.tsv"), chunksize, n_buckets, str(tmp_path))
+    in_memory = (tmp_path / "memory.tsv").read_bytes()
+    assert (tmp_path / "streaming.tsv").read_bytes() == in_memory
+
+    lines = in_memory.decode().splitlines()[2:]
+    # NA 等 ID 原样保留，不被当作缺失值
+    ids = {field for line in lines for field in line.split("\t")[:2]}
+    assert {"NA", "NULL", "N/A", "NAN", "NONE"} <= ids
+    assert "" not in ids
+    keys = [line.split("\t")[:2] for line in lines]
+    assert keys == sorted(keys)
+    assert len({tuple(key) for key in keys}) == len(keys)
+
+
+def test_normalize_ids_orders_by_lowercase():
+    df = normalize_ids(pd.DataFrame({"ID1": ["GLYMAB", "na", "AT1G1"], "ID2": ["Glyma_01G1", "AT1G2", "at1g1"]}))
+    # 'glyma_' < 'glymab'，而 'GLYMA_' > 'GLYMAB'
+    assert df[["ID1", "ID2"]].values.tolist() == [["GLYMA_01G1", "GLYMAB"], ["AT1G2", "NA"], ["AT1G1", "AT1G1"]]
+
+
+def test_incremental_merge_matches_full_merge(tmp_path):
+    megadock = tmp_path / "megadock.tsv"
+    hdock = tmp_path / "hdock.tsv"
+    af = tmp_path / "af.tsv"
+    megadock.write_text("AT1G1\tAT1G2\t12.5\nGlyma_01G1\tAT1G1\t8.0\n")
+    hdock.write_text("at1g2\tat1g1\t-250.0\n")
+    af.write_text("Pair\tPTM\tIPTM\nAT1G1-AT1G2\t0.5\t0.3\n")
+    sources = [("megadock", str(megadock)), ("hdock", str(hdock)), ("af", str(af))]
+    output = tmp_path / "merged.tsv"
+    merge_incremental(sources, str(output))
+
+    state = json.loads((tmp_path / f"merged.tsv{STATE_SUFFIX}").read_text())
+    assert state["columns"] == ["ID1", "ID2", "MEGADOCK_Score", "HDOCK_Score", "Alphafold_pTM+ipTM"]
+    assert {kind: entry["offset"] for kind, entry in state["sources"].items()} == {
+        "megadock": megadock.stat().st_size, "hdock": hdock.stat().st_size, "af": af.stat().st_size}
+
+    # 新 pair，已有 pair 的其他来源得分，以及还在写入中的半行（不以换行结尾）
+    with open(megadock, "a") as f:
+        f.write("NA\tGLYMAB\t3.0\n")
+    with open(hdock, "a") as f:
+        f.write("AT1G1\tglyma_01g1\t-180.0\nGLYMAB\tNA\t-120.0\nAT1G9\tAT1")
+    with open(af, "a") as f:
+        f.write("glymab-at1g2\t0.7\t0.1\n")
+    merge_incremental(sources, str(output))
+    state = json.loads((tmp_path / f"merged.tsv{STATE_SUFFIX}").read_text())
+    assert state["sources"]["hdock"]["offset"] == hdock.stat().st_size - len("AT1G9\tAT1")
+
+    with open(hdock, "a") as f:
+        f.write("G2\t-300.0\n")
+    merge_incremental(sources, str(output))
+
+    merge_full(sources, str(tmp_path / "fresh.tsv"))
+    assert output.read_bytes() == (tmp_path / "fresh.tsv").read_bytes()
+    assert "AT1G2\tAT1G9\t\t-300.0\t\n" in output.read_text()
+
+
+def test_incremental_merge_falls_back_when_source_rewritten(tmp_path, capsys):
+    megadock = tmp_path / "megadock.tsv"
+    megadock.write_text("AT1G1\tAT1G2\t12.5\nAT1G1\tAT1G3\t8.0\n")
+    sources = [("megadock", str(megadock))]
+    output = tmp_path / "merged.tsv"
+    merge_full(sources, str(output))
+
+    # 结果表被重写（非增量运行），已合并的行不再是它的前缀
+    megadock.write_text("AT1G1\tAT1G2\t11.0\nAT1G1\tAT1G4\t9.0\n")
+    merge_incremental(sources, str(output))
+    assert "被重写" in capsys.readouterr().out
+    merge_full(sources, str(tmp_path / "fresh.tsv"))
+    assert output.read_bytes() == (tmp_path / "fresh.tsv").read_bytes()
+
+    # 来源变化时同样退回完整合并
+    hdock = tmp_path / "hdock.tsv"
+    hdock.write_text("AT1G1\tAT1G4\t-200.0\n")
+    sources.append(("hdock", str(hdock)))
+    merge_incremental(sources, str(output))
+    assert "没有可用的合并状态" in capsys.readouterr().out
+    merge_full(sources, str(tmp_path / "fresh.tsv"))
+    assert output.read_bytes() == (tmp_path / "fresh.tsv").read_bytes()
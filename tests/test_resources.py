@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""resources.py：按到达顺序分配、为更早的等待者预留、回收已退出进程的租约、请求截断到总量"""
+
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from resources import _free_pool, _normalize_request, _reap, _try_grant
+
+LIMITS = {"cpu": 8, "mem_gb": 64, "gpus": {"0": 1, "1": 1}, "gpu_mem_gb": {"0": 40, "1": 24}}
+HOST = socket.gethostname()
+
+
+def waiter(since, cpu=0, gpus=0, mem_gb=0, device=None, gpu_mem_gb=0, pid=None, host=HOST):
+    request = _normalize_request(LIMITS, cpu, gpus, mem_gb, device, gpu_mem_gb)
+    return dict(request, pid=pid or os.getpid(), host=host, label="", since=since)
+
+
+def lease(cpu=0, mem_gb=0, gpu_ids=(), gpu_mem_gb=0, pid=None, host=HOST):
+    return {"cpu": cpu, "mem_gb": mem_gb, "gpu_ids": list(gpu_ids), "gpu_mem_gb": gpu_mem_gb,
+            "pid": pid or os.getpid(), "host": host, "label": "", "since": 0}
+
+
+def state(leases=(), **waiters):
+    return {"leases": {f"lease{i}": record for i, record in enumerate(leases)}, "waiters": waiters}
+
+
+@pytest.fixture
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+def test_waiters_granted_in_arrival_order():
+    s = state(a=waiter(1, cpu=4), b=waiter(2, cpu=4), c=waiter(3, cpu=1))
+    assert _try_grant(LIMITS, s, "a") == []
+    assert _try_grant(LIMITS, s, "b") == []
+    # a、b 已占满 CPU，后到的 c 等待
+    assert _try_grant(LIMITS, s, "c") is None
+
+
+def test_large_request_not_starved_by_small_ones():
+    s = state([lease(cpu=6)], big=waiter(1, cpu=8), small=waiter(2, cpu=1))
+    # 还有 2 个空闲核，但都预留给更早到达的大任务
+    assert _try_grant(LIMITS, s, "small") is None
+    assert _try_grant(LIMITS, s, "big") is None
+    s["leases"].clear()
+    assert _try_grant(LIMITS, s, "big") == []
+    assert _try_grant(LIMITS, s, "small") is None
+    # 大任务开始运行后，小任务等它结束
+    s["leases"]["big"] = lease(cpu=8)
+    del s["waiters"]["big"]
+    assert _try_grant(LIMITS, s, "small") is None
+
+
+def test_gpu_choice_and_memory():
+    # 优先空闲显存多的 GPU
+    assert _try_grant(LIMITS, state(a=waiter(1, gpus=1)), "a") == ["0"]
+    assert _try_grant(LIMITS, state(a=waiter(1, gpus=1, device="1")), "a") == ["1"]
+    assert _try_grant(LIMITS, state(a=waiter(1, gpus=2)), "a") == ["0", "1"]
+    # 只有 GPU 0 的显存足够；被占用时等待，而不是分配到显存不足的 GPU 1
+    assert _try_grant(LIMITS, state(a=waiter(1, gpus=1, gpu_mem_gb=30)), "a") == ["0"]
+    busy = [lease(gpu_ids=["0"], gpu_mem_gb=10)]
+    assert _try_grant(LIMITS, state(busy, a=waiter(1, gpus=1, gpu_mem_gb=30)), "a") is None
+    assert _try_grant(LIMITS, state(busy, a=waiter(1, gpus=1, gpu_mem_gb=20)), "a") == ["1"]
+
+
+def test_later_waiter_uses_what_earlier_ones_leave():
+    s = state([lease(cpu=2, gpu_ids=["0"])], first=waiter(1, cpu=2, gpus=1, device="0"),
+              same=waiter(2, cpu=1, gpus=1, device="0"), other=waiter(3, cpu=2, gpus=1), late=waiter(4, cpu=4))
+    # first 等待 GPU 0，预留它的 2 核和 GPU 0；后到的请求只能使用其余资源
+    assert _try_grant(LIMITS, s, "first") is None
+    assert _try_grant(LIMITS, s, "same") is None
+    assert _try_grant(LIMITS, s, "other") == ["1"]
+    # 8 核减去租约 2、first 2、same 1、other 2，只剩 1 核
+    assert _try_grant(LIMITS, s, "late") is None
+
+
+def test_blocked_head_reserves_everything_it_asked_for():
+    s = state([lease(cpu=4, mem_gb=60)], head=waiter(1, cpu=1, mem_gb=10), next=waiter(2, cpu=1))
+    # 预留可以扣成负数：队首缺内存时，后到的请求也不会先于它得到资源
+    assert _try_grant(LIMITS, s, "head") is None
+    assert _try_grant(LIMITS, s, "next") is None
+    s["leases"]["lease0"]["mem_gb"] = 50
+    assert _try_grant(LIMITS, s, "head") == []
+    assert _try_grant(LIMITS, s, "next") == []
+
+
+def test_reap_dead_processes(dead_pid):
+    s = state([lease(cpu=8, pid=dead_pid), lease(cpu=0, pid=dead_pid, host="other-node"), lease(cpu=0)],
+              gone=waiter(1, cpu=8, pid=dead_pid), live=waiter(2, cpu=8))
+    _reap(s)
+    # 本机已退出进程的租约和等待记录被回收；其他节点的记录无法检查，保留
+    assert [record["host"] for record in s["leases"].values()] == ["other-node", HOST]
+    assert list(s["waiters"]) == ["live"]
+    assert _try_grant(LIMITS, s, "live") == []
+
+
+def test_normalize_request_clamps_to_limits():
+    assert _normalize_request(LIMITS, 100, 5, 1000, None, 100) == {
+        "cpu": 8, "mem_gb": 64, "gpus": 2, "gpu_mem_gb": 40, "device": None}
+    assert _normalize_request(LIMITS, -1, -1, -5, "all") == {
+        "cpu": 0, "mem_gb": 0.0, "gpus": 0, "gpu_mem_gb": 0.0, "device": None}
+    # 指定设备时按该 GPU 的显存截断；未知设备视为任意 GPU
+    assert _normalize_request(LIMITS, 1, 1, 0, 1, 100)["gpu_mem_gb"] == 24
+    assert _normalize_request(LIMITS, 1, 1, 0, "7", 0)["device"] is None
+    # 未配置 GPU 或内存时不计
+    no_gpu = {"cpu": 4, "mem_gb": 0, "gpus": {}, "gpu_mem_gb": {}}
+    assert _normalize_request(no_gpu, 2, 1, 50, None, 10) == {
+        "cpu": 2, "mem_gb": 0.0, "gpus": 0, "gpu_mem_gb": 0.0, "device": None}
+
+
+def test_limits_without_gpu_memory():
+    # 旧版 limits.json 没有 gpu_mem_gb：不限制显存
+    limits = {"cpu": 4, "mem_gb": 16, "gpus": {"0": 2}}
+    pool = _free_pool(limits, [lease(gpu_ids=["0"], gpu_mem_gb=10)])
+    assert pool["gpus"] == {"0": 1}
+    assert pool["gpu_mem_gb"] == {"0": float("inf")}
+    request = dict(_normalize_request(limits, 1, 1, 1, None, 80), pid=os.getpid(), host=HOST, label="", since=1)
+    assert _try_grant(limits, {"leases": {"l": lease(gpu_ids=["0"])}, "waiters": {"a": request}}, "a") == ["0"]
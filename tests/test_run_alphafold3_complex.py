@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""run_alphafold3_complex.py：结果表整体写出，任务账本的任务名与工作目录无关"""
+
+
+import pytest
+
+import run_alphafold3_complex
+from conftest import run_script
+
+FASTA = ">A1\nMKTAYIAKQR\n>B2\nMSHHWGYGKH\n>C3\nMAAAAGGGKK\n"
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    (tmp_path / "pep.fa").write_text(FASTA)
+    (tmp_path / "pairs.list").write_text("A1\tB2\nC3\tA1\n")
+    (tmp_path / "sub").mkdir()
+    return tmp_path
+
+
+def complex_args(json_dir, output_dir, outfile, *extra, inputs="."):
+    return ("-l", f"{inputs}/pairs.list", "-fa", f"{inputs}/pep.fa", "-jd", json_dir, "-od", output_dir,
+            "-p", "models", "-d", "db", "-o", outfile, *extra)
+
+
+def af3_calls(calls):
+    return [call for call in calls() if "run_alphafold.py" in call["argv"]]
+
+
+def test_result_table(inputs, fake_docker):
+    env, calls = fake_docker
+    result = run_script("run_alphafold3_complex.py", *complex_args("json", "out", "af.tsv"), env=env, cwd=inputs)
+    assert result.returncode == 0, result.stdout + result.stderr
+
+    lines = (inputs / "af.tsv").read_text().splitlines()
+    assert lines[0] == "Pair\tPTM\tIPTM"
+    assert sorted(lines[1:]) == ["a1-b2\t0.5\t0.3", "a1-c3\t0.5\t0.3"]
+    assert not (inputs / "af.tsv.part").exists()
+
+
+def test_incremental_appends_new_pairs(inputs, fake_docker):
+    env, calls = fake_docker
+    (inputs / "pairs.list").write_text("A1\tB2\n")
+    assert run_script("run_alphafold3_complex.py", *complex_args("json", "out", "af.tsv"), env=env,
+                      cwd=inputs).returncode == 0
+
+    (inputs / "pairs.list").write_text("A1\tB2\nB2\tC3\n")
+    result = run_script("run_alphafold3_complex.py", *complex_args("json", "out", "af.tsv", "--incremental"),
+                        env=env, cwd=inputs)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert (inputs / "af.tsv").read_text().splitlines() == [
+        "Pair\tPTM\tIPTM", "a1-b2\t0.5\t0.3", "b2-c3\t0.5\t0.3"]
+    assert [call["inputs"] for call in af3_calls(calls)] == [["a1-b2"], ["b2-c3"]]
+
+
+def test_ledger_keys_independent_of_working_directory(inputs, fake_docker):
+    env, calls = fake_docker
+    first = run_script("run_alphafold3_complex.py", *complex_args("json", "out", "af.tsv"), env=env, cwd=inputs)
+    assert first.returncode == 0, first.stdout + first.stderr
+    assert len(af3_calls(calls)) == 2
+
+    # 同一个输出目录，用另一个工作目录下的相对路径指定：账本中的任务仍然命中
+    second = run_script("run_alphafold3_complex.py", *complex_args("../json", "../out", "../af.tsv", inputs=".."),
+                        env=env, cwd=inputs / "sub")
+    assert second.returncode == 0, second.stdout + second.stderr
+    assert len(af3_calls(calls)) == 2
+    assert second.stdout.count("[SKIP] Prediction already done") == 2
+
+
+def test_interrupted_run_keeps_previous_table(inputs, monkeypatch):
+    (inputs / "af.tsv").write_text("Pair\tPTM\tIPTM\nold-pair\t0.9\t0.8\n")
+    monkeypatch.chdir(inputs)
+    for key in ("PPI_RESOURCE_DIR", "PPI_JOB_LEDGER", "PPI_TIMEOUT_SCALE", "PPI_RETRIES"):
+        monkeypatch.delenv(key, raising=False)
+
+    def interrupted(*args, **kwargs):
+        raise RuntimeError("1 of 1 AlphaFold3 workers failed")
+
+    monkeypatch.setattr(run_alphafold3_complex, "run_inference_workers", interrupted)
+    args = run_alphafold3_complex.build_parser().parse_args(
+        [str(arg) for arg in complex_args("json", "out", "af.tsv", "--persistent_worker")])
+    with pytest.raises(RuntimeError):
+        run_alphafold3_complex.run(args)
+    assert (inputs / "af.tsv").read_text() == "Pair\tPTM\tIPTM\nold-pair\t0.9\t0.8\n"
+    assert not (inputs / "af.tsv.part").exists()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""run_megadock.py 的多设备 worker 池：用假的 docker 检查任务在设备间的分配和 --gpus 参数"""
+
+import itertools
+
+import pytest
+
+from conftest import run_script, write_pdb
+from run_megadock import build_device_slots, gpu_option, parse_devices
+
+IDS = ["p1", "p2", "p3", "p4", "p5"]
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    pdb_dir = tmp_path / "pdbs"
+    pdb_dir.mkdir()
+    for i, pid in enumerate(IDS):
+        write_pdb(pdb_dir / f"{pid}.pdb", residues=20 + i, offset=i)
+    pair_list = tmp_path / "pairs.list"
+    pairs = list(itertools.combinations(IDS, 2))[:8]
+    pair_list.write_text("".join(f"{a}\t{b}\n" for a, b in pairs))
+    return pair_list, pdb_dir, pairs
+
+
+def megadock_args(tmp_path, pair_list, pdb_dir, *extra):
+    return ("-l", pair_list, "-d", pdb_dir, "-od", tmp_path / "out", "-r", tmp_path / "megadock.tsv",
+            "-N", 200, *extra)
+
+
+def docking_calls(calls):
+    return [call for call in calls() if "megadock-gpu" in call["argv"]]
+
+
+def device_of(argv):
+    return argv[argv.index("--gpus") + 1]
+
+
+def test_device_slots_round_robin():
+    assert parse_devices("0, 1,,3") == ["0", "1", "3"]
+    assert parse_devices("all") is None
+    assert build_device_slots(5, ["0", "1"]) == ["0", "1", "0", "1", "0"]
+    assert build_device_slots(2, None) == [None, None]
+    assert gpu_option("2") == ["--gpus", '"device=2"']
+    assert gpu_option(None) == ["--gpus", "all"]
+
+
+def test_pool_spreads_jobs_over_devices(tmp_path, inputs, fake_docker):
+    env, calls = fake_docker
+    env["FAKE_DOCKER_SLEEP"] = "0.5"
+    pair_list, pdb_dir, pairs = inputs
+
+    result = run_script("run_megadock.py", *megadock_args(tmp_path, pair_list, pdb_dir, "--devices", "0,1"), env=env)
+    assert result.returncode == 0, result.stdout + result.stderr
+
+    docked = docking_calls(calls)
+    assert len(docked) == len(pairs)
+    # 每个任务只看到一块 GPU，两块 GPU 都被使用
+    devices = [device_of(call["argv"]) for call in docked]
+    assert set(devices) == {'"device=0"', '"device=1"'}
+    # 同一设备上的任务不重叠：槽位用完后才归还
+    for device in set(devices):
+        spans = sorted((call["start"], call["end"]) for call in docked if device_of(call["argv"]) == device)
+        assert all(prev_end <= start for (_, prev_end), (start, _) in zip(spans, spans[1:]))
+    # 两个设备的任务确实并发运行
+    spans = sorted((call["start"], call["end"]) for call in docked)
+    assert any(start < prev_end for (_, prev_end), (start, _) in zip(spans, spans[1:]))
+
+    rows = (tmp_path / "megadock.tsv").read_text().splitlines()
+    assert len(rows) == len(pairs)
+
+
+def test_more_workers_than_devices_share_devices(tmp_path, inputs, fake_docker):
+    env, calls = fake_docker
+    pair_list, pdb_dir, pairs = inputs
+
+    result = run_script("run_megadock.py", *megadock_args(tmp_path, pair_list, pdb_dir, "--devices", "3", "-w", 2),
+                        env=env)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert {device_of(call["argv"]) for call in docking_calls(calls)} == {'"device=3"'}
+    assert "Running with 2 workers" in result.stdout
+
+
+def test_zero_workers_rejected(tmp_path, inputs, fake_docker):
+    env, calls = fake_docker
+    pair_list, pdb_dir, _ = inputs
+
+    result = run_script("run_megadock.py", *megadock_args(tmp_path, pair_list, pdb_dir, "--devices", "0,1", "-w", 0),
+                        env=env)
+    assert result.returncode == 1
+    assert "--workers must be at least 1" in result.stdout
+    assert calls() == []
+
+
+def test_deleted_output_is_docked_again(tmp_path, inputs, fake_docker):
+    env, calls = fake_docker
+    pair_list, pdb_dir, pairs = inputs
+    args = megadock_args(tmp_path, pair_list, pdb_dir, "--job_ledger", tmp_path / "jobs.sqlite")
+    assert run_script("run_megadock.py", *args, env=env).returncode == 0
+    assert len(docking_calls(calls)) == len(pairs)
+
+    # 账本中记为 done 的输出被删除：重新对接，而不是跳过后丢掉这个 pair
+    deleted = sorted((tmp_path / "out").glob("*.out"))[0]
+    deleted.unlink()
+    result = run_script("run_megadock.py", *args, env=env)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert len(docking_calls(calls)) == len(pairs) + 1
+    assert f"output {deleted} is recorded as done but missing" in result.stdout
+    assert deleted.exists()
+    assert len((tmp_path / "megadock.tsv").read_text().splitlines()) == len(pairs)
+
+
+def test_incremental_docks_only_new_pairs(tmp_path, inputs, fake_docker):
+    env, calls = fake_docker
+    pair_list, pdb_dir, pairs = inputs
+    pair_list.write_text("".join(f"{a}\t{b}\n" for a, b in pairs[:5]))
+    assert run_script("run_megadock.py", *megadock_args(tmp_path, pair_list, pdb_dir), env=env).returncode == 0
+    rows = (tmp_path / "megadock.tsv").read_text().splitlines()
+
+    # 新的 pair 列表：已完成的 pair 换了顺序，另加 3 个
+    pair_list.write_text("".join(f"{b}\t{a}\n" for a, b in pairs[:5]) + "".join(f"{a}\t{b}\n" for a, b in pairs[5:]))
+    result = run_script("run_megadock.py", *megadock_args(tmp_path, pair_list, pdb_dir, "--incremental"), env=env)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "8 pairs in the list, 5 already done, 3 to run" in result.stdout
+    assert len(docking_calls(calls)) == len(pairs)
+    # 已有的行不重写，新结果追加在后面
+    new_rows = (tmp_path / "megadock.tsv").read_text().splitlines()
+    assert new_rows[:5] == rows and len(new_rows) == len(pairs)
+    assert len((tmp_path / "megadock.tsv.ledger").read_text().splitlines()) == len(pairs)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""score_store.py：由 merge_score.py 的输出建库，按 ID、阈值和 top-K 查询"""
+
+import pytest
+
+from conftest import run_script
+
+pytest.importorskip("pyarrow")
+
+MEGADOCK = "AT1G1\tAT1G2\t12.5\nAT1G3\tAT1G1\t8.0\nAT1G2\tAT1G3\t10.5\nAT1G4\tAT1G4\t15.0\nAT1G2\tAT1G4\t3.0\n"
+HDOCK = "AT1G1\tAT1G2\t-250.0\nAT1G1\tAT1G3\t-180.0\nAT1G2\tAT1G3\t-220.5\nAT1G9\tAT1G1\t-300.0\n"
+HDOCK_EMPTY = "AT1G1\tAT1G2\t\nAT1G1\tAT1G3\t\n"
+
+
+def build(tmp_path, hdock=HDOCK, *extra):
+    (tmp_path / "m.tsv").write_text(MEGADOCK)
+    (tmp_path / "h.tsv").write_text(hdock)
+    result = run_script("merge_score.py", "--megadock", tmp_path / "m.tsv", "--hdock", tmp_path / "h.tsv",
+                        "--output", tmp_path / "merged.tsv", "--store", tmp_path / "st", cwd=tmp_path)
+    assert result.returncode == 0, result.stdout + result.stderr
+    if extra:
+        result = run_script("score_store.py", "build", "-s", tmp_path / "st", "-i", tmp_path / "merged.tsv", *extra)
+        assert result.returncode == 0, result.stdout + result.stderr
+
+
+def query(tmp_path, *args):
+    result = run_script("score_store.py", "query", "-s", tmp_path / "st", *args)
+    assert result.returncode == 0, result.stdout + result.stderr
+    return result.stdout.splitlines()
+
+
+@pytest.mark.parametrize("batch_rows", [None, 2])
+def test_query_by_id(tmp_path, batch_rows):
+    build(tmp_path, HDOCK, *(["--batch_rows", batch_rows] if batch_rows else []))
+    assert query(tmp_path, "--id", "at1g1") == [
+        "ID\tPartner\tMEGADOCK_Score\tHDOCK_Score",
+        "AT1G1\tAT1G2\t12.5\t-250.0",
+        "AT1G1\tAT1G3\t8.0\t-180.0",
+        "AT1G1\tAT1G9\t\t-300.0",
+    ]
+    # 同源二聚体只有一个方向
+    assert query(tmp_path, "--id", "AT1G4") == [
+        "ID\tPartner\tMEGADOCK_Score\tHDOCK_Score",
+        "AT1G4\tAT1G2\t3.0\t",
+        "AT1G4\tAT1G4\t15.0\t",
+    ]
+
+
+def test_query_thresholds(tmp_path):
+    build(tmp_path)
+    assert query(tmp_path, "--min", "megadock=10")[1:] == [
+        "AT1G1\tAT1G2\t12.5\t-250.0",
+        "AT1G2\tAT1G3\t10.5\t-220.5",
+        "AT1G4\tAT1G4\t15.0\t",
+    ]
+    # 缺失得分的 pair 不满足阈值
+    assert query(tmp_path, "--min", "megadock=10", "--max", "hdock=-200")[1:] == [
+        "AT1G1\tAT1G2\t12.5\t-250.0",
+        "AT1G2\tAT1G3\t10.5\t-220.5",
+    ]
+    assert query(tmp_path, "--max", "HDOCK_Score=-260")[1:] == ["AT1G1\tAT1G9\t\t-300.0"]
+
+
+def test_query_top_k(tmp_path):
+    build(tmp_path)
+    assert query(tmp_path, "--top_k", 2)[1:] == ["AT1G4\tAT1G4\t15.0\t", "AT1G1\tAT1G2\t12.5\t-250.0"]
+    # HDOCK 越小越好
+    assert query(tmp_path, "--top_k", 2, "--sort", "hdock")[1:] == [
+        "AT1G1\tAT1G9\t\t-300.0", "AT1G1\tAT1G2\t12.5\t-250.0"]
+
+
+def test_column_without_scores(tmp_path):
+    build(tmp_path, HDOCK_EMPTY)
+    assert query(tmp_path, "--max", "hdock=-200") == ["ID1\tID2\tMEGADOCK_Score\tHDOCK_Score"]
+    assert query(tmp_path, "--top_k", 3, "--sort", "hdock") == ["ID1\tID2\tMEGADOCK_Score\tHDOCK_Score"]
+    assert len(query(tmp_path, "--min", "megadock=0")) == 6
+
+
+def test_sorted_index_without_batches(tmp_path):
+    # 旧版本为没有得分的列写出的索引文件不含 batch
+    import pyarrow as pa
+    import pyarrow.ipc
+
+    from score_store import read_sorted_index
+
+    schema = pa.schema([("Score", pa.float64()), ("Row", pa.int64())])
+    with pa.OSFile(str(tmp_path / "by_hdock.arrow"), "wb") as sink, pa.ipc.new_file(sink, schema):
+        pass
+    scores, rows = read_sorted_index(str(tmp_path), "HDOCK_Score")
+    assert len(scores) == 0 and len(rows) == 0